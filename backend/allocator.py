@@ -0,0 +1,68 @@
+"""总预算的本地分配：按历史支出比例切分，带上下限，并用最大余数法保证合计精确等于总额。"""
+import os
+
+import numpy as np
+
+# 每个分类至少 / 至多分到总预算的比例
+MIN_SHARE = float(os.getenv("BUDGET_MIN_SHARE", "0.02"))
+MAX_SHARE = float(os.getenv("BUDGET_MAX_SHARE", "0.6"))
+
+
+def _clamp_proportional(total, weights, floors, caps):
+    """Split ``total`` proportionally to ``weights`` subject to per-item floors / caps.
+
+    Items that hit a bound are fixed there and the rest is re-split among
+    the remaining items until nothing moves (water filling).
+    """
+    quota = np.zeros_like(weights)
+    free = np.ones(len(weights), dtype=bool)
+    while True:
+        remaining = total - quota[~free].sum()
+        w = weights[free]
+        quota[free] = remaining * (w / w.sum() if w.sum() > 0 else np.full(len(w), 1 / len(w)))
+        low = free & (quota < floors)
+        high = free & (quota > caps)
+        if not low.any() and not high.any():
+            return quota
+        # 先处理越界更多的一侧，避免来回震荡
+        if (floors - quota)[low].sum() >= (quota - caps)[high].sum():
+            quota[low], free[low] = floors[low], False
+        else:
+            quota[high], free[high] = caps[high], False
+        if not free.any():
+            # 全部卡在上下限上仍凑不齐总额：把差额平摊，保证合计正确
+            return quota + (total - quota.sum()) / len(quota)
+
+
+def allocate(total, weights, min_share=MIN_SHARE, max_share=MAX_SHARE):
+    """Allocate ``total`` across items proportionally to ``weights``.
+
+    Returns a list of amounts in the same order whose sum equals ``total``
+    exactly: whole yuan when ``total`` is an integer, otherwise cents.
+    Each item gets at least ``min_share`` and at most ``max_share`` of the
+    total (relaxed when they cannot all be satisfied), and the rounding
+    uses the largest-remainder method with ties broken by weight, then
+    position, so the result is deterministic.
+    """
+    n = len(weights)
+    if n == 0:
+        return []
+    unit = 1 if float(total).is_integer() else 0.01
+    units = int(round(total / unit))
+    weights = np.clip(np.asarray(weights, dtype=float), 0, None)
+
+    # 上下限不可能同时满足时放宽到平均值
+    floor = min(np.floor(units * min_share), units // n)
+    cap = max(np.ceil(units * max_share), -(-units // n))
+    quota = _clamp_proportional(units, weights, np.full(n, floor), np.full(n, cap))
+
+    base = np.floor(quota + 1e-9).astype(np.int64)
+    left = units - int(base.sum())
+    if left > 0:
+        # 最大余数法：小数部分最大的优先补 1；相同时优先历史支出多的、再按原顺序
+        order = np.lexsort((np.arange(n), -weights, -(quota - base)))
+        base[order[:left]] += 1
+    elif left < 0:
+        order = np.lexsort((np.arange(n), weights, quota - base))
+        base[order[:-left]] -= 1
+    return [int(v) if unit == 1 else round(int(v) * unit, 2) for v in base]
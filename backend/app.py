@@ -1,20 +1,32 @@
-from flask import Flask, request, jsonify, g, session
-from db import init_db, get_db
-from handlers import *
 from dotenv import load_dotenv
-import os, requests, secrets
+load_dotenv()  # 加载 .env 文件；需先于其它模块导入，它们在导入时读取环境变量
+
+from flask import Flask, Response, request, jsonify, g, session, stream_with_context
+from db import init_db, get_db, close_db, normalize_date, month_range, data_version, to_cents, from_cents, category_ref
+from handlers import *
+from export import export, columnar_info
+from importer import parse_rows, import_rows
+import metrics
+from llm import client as llm_client, LLMError
+from intent import intent_cache, parse_local, LOCAL_PARSE_THRESHOLD, INTENT_SOURCE
+from conversation import conversations
+from state import load_secret_key
+from cache import response_cache, RESPONSE_CACHE_MAX_BYTES, CACHE_REQUESTS
+import os, json, re
 from flask_cors import CORS
 from datetime import datetime
+from forecast import get_forecast
 from werkzeug.security import generate_password_hash, check_password_hash
 
 app = Flask(__name__)
-app.secret_key = os.getenv("SECRET_KEY", secrets.token_hex(16))
-CORS(app, supports_credentials=True)
-init_db()
-load_dotenv()  # 加载 .env 文件
-
-# 在内存中维护最近10条对话记录
-chat_history = []  # [{"role": "user"/"assistant", "content": "..."}]
+# 多个 worker 必须使用同一个签名密钥，否则会话在进程间失效
+app.secret_key = load_secret_key()
+CORS(app, supports_credentials=True, expose_headers=["X-Next-Cursor", "ETag"])
+app.teardown_appcontext(close_db)  # 请求结束后归还数据库连接
+metrics.init_app(app)
+init_db()  # 已是最新版本时立即返回；迁移本身在写锁内执行，多进程同时启动也只会跑一次
+if os.getenv("LLM_PREWARM", "1") == "1":
+    llm_client.prewarm()  # 提前建立到 LLM 服务的连接
 
 # ===== 简易用户认证 =====
 
@@ -30,6 +42,64 @@ def login_required(f):
     return wrapper
 
 
+def conditional_get(vary=None):
+    """Serve a GET endpoint with an ETag derived from the user's data version.
+
+    Every write to the user's records / income / budgets / categories bumps
+    the version (DB triggers), so a matching ``If-None-Match`` gets a 304
+    without running the view, and otherwise a response cached for the same
+    path, query string and version is replayed. ``vary`` returns any extra
+    input the response depends on (e.g. the current month used as default).
+    Must be applied inside ``login_required``.
+    """
+    from functools import wraps
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            version = data_version(get_db(readonly=True), g.user_id)
+            extra = vary() if vary else ""
+            etag = f"{g.user_id}-{version}" + (f"-{extra}" if extra else "")
+
+            if request.if_none_match.contains(etag):
+                CACHE_REQUESTS.inc(cache="response", result="not_modified")
+                response = Response(status=304)
+            else:
+                key = (g.user_id, request.path, tuple(sorted(request.args.items(multi=True))), extra)
+                cached = response_cache.get(key, version)
+                if cached is not None:
+                    status, headers, body = cached
+                    response = Response(body, status=status, headers=headers)
+                else:
+                    response = app.make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    # 流式响应与超大响应只加 ETag，不放进缓存
+                    if not response.is_streamed and (response.content_length or 0) <= RESPONSE_CACHE_MAX_BYTES:
+                        response_cache.put(key, version,
+                                           (response.status_code, list(response.headers), response.get_data()))
+
+            response.set_etag(etag)
+            # 浏览器每次都带 If-None-Match 回来校验；响应因登录用户而异
+            response.headers["Cache-Control"] = "private, no-cache"
+            response.vary.add("Cookie")
+            return response
+        return wrapper
+    return decorator
+
+
+def current_month_default():
+    return "" if request.args.get("month") else datetime.now().strftime("%Y-%m")
+
+
+MONTH_RE = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
+MONTH_ERROR = "month 参数格式应为 YYYY-MM"
+
+
+def current_day():
+    return datetime.now().strftime("%Y-%m-%d")
+
+
 @app.route("/api/register", methods=["POST"])
 def register():
     data = request.get_json() or {}
@@ -66,6 +136,7 @@ def login():
 @app.route("/api/logout", methods=["POST"])
 @login_required
 def logout():
+    conversations.clear(g.user_id)
     session.pop("user_id", None)
     session.pop("username", None)
     return jsonify({"success": True})
@@ -90,18 +161,8 @@ INTENT_ALIAS = {
     "add_record": "add_record"
 }
 
-def call_deepseek_intent(message, llm=None):
-    import os, requests
-
-    llm = llm or {}
-
+def build_intent_messages(message):
     today_str = datetime.now().strftime("%Y-%m-%d")
-    api_key = llm.get("apikey") or os.getenv("DEEPSEEK_API_KEY")
-    url = llm.get("url") or "https://api.siliconflow.cn/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
 
     prompt = (
         f"今天是 {today_str}。\n"
@@ -125,45 +186,12 @@ def call_deepseek_intent(message, llm=None):
         "月份：2025-06"
     )
 
-    payload = {
-        "model": llm.get("model") or "Pro/deepseek-ai/DeepSeek-V3",
-        "temperature": 0.7,
-        "messages": [
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": message}
-        ]
-    }
-
-    try:
-        res = requests.post(url, headers=headers, json=payload, timeout=10)
-        data = res.json()
-        print("📥 DeepSeek 返回内容：", data)  # 打印原始返回，方便调试
-
-        if "choices" in data:
-            return data["choices"][0]["message"]["content"]
-        elif "error" in data:
-            print("❌ DeepSeek API 错误：", data["error"])
-            return "意图：unknown\\n参数："
-        else:
-            print("❓ 未知格式响应：", data)
-            return "意图：unknown\\n参数："
-
-    except Exception as e:
-        print("DeepSeek 调用失败:", e)
-        return "意图：unknown\\n参数："
-
-def call_deepseek_summary(user_msg, handler_result, llm=None):
-    import os, requests
-
-    llm = llm or {}
-
-    api_key = llm.get("apikey") or os.getenv("DEEPSEEK_API_KEY")
-    url = llm.get("url") or "https://api.siliconflow.cn/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": message}
+    ]
 
+def build_summary_messages(user_msg, handler_result):
     summary_prompt = (
         "你是一个财务顾问，请根据用户的操作结果进行总结和建议。\n"
         "用户输入：{user_msg}\n"
@@ -175,59 +203,41 @@ def call_deepseek_summary(user_msg, handler_result, llm=None):
         "如果用户此次操作为本月消费分析请求，给出消费行为详细分析及评分，此时不限制回答字数，必须分别分析当月消费和总体消费，严禁混淆分析！"
     ).format(user_msg=user_msg, handler_result=handler_result)
 
-    data = {
-        "model": llm.get("model") or "Pro/deepseek-ai/DeepSeek-V3",
-        "messages": [
-            {"role": "system", "content": "你是一个善于总结和分析的财务顾问。"},
-            {"role": "user", "content": summary_prompt}
-        ]
-    }
-
-    response = requests.post(url, headers=headers, json=data)
-    result = response.json()
-
-    if "choices" in result:
-        return result["choices"][0]["message"]["content"]
-    elif "error" in result:
-        print("❌ DeepSeek API error:", result["error"])
-        return "❌ 分析失败：" + result["error"].get("message", "未知错误")
-    else:
-        print("❌ DeepSeek API unexpected response:", result)
-        return "❌ 分析失败：LLM 响应格式异常"
-
-def call_deepseek_chat(history, llm=None):
-    """当用户没有执行记账相关操作时，与其闲聊。"""
-    api_key = (llm or {}).get("apikey") or os.getenv("DEEPSEEK_API_KEY")
-    url = (llm or {}).get("url") or "https://api.siliconflow.cn/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
+    return [
+        {"role": "system", "content": "你是一个善于总结和分析的财务顾问。"},
+        {"role": "user", "content": summary_prompt}
+    ]
 
+def build_chat_messages(history):
     prompt = (
         "你是一个友好的记账助手，可以和用户闲聊，并在合适的时候提醒保持良好的记账习惯。\n"
         "回答控制在50字以内。"
     )
 
-    messages = [{"role": "system", "content": prompt}] + history[-10:]
+    # history 已由对话存储限定长度（可能以一条摘要开头）
+    return [{"role": "system", "content": prompt}] + history
 
-    data = {
-        "model": (llm or {}).get("model") or "Pro/deepseek-ai/DeepSeek-V3",
-        "messages": messages,
-    }
+def call_deepseek_intent(message, llm=None):
+    try:
+        content = llm_client.complete(build_intent_messages(message), llm, call="intent", temperature=0.7)
+        print("📥 DeepSeek 返回内容：", content)  # 打印原始返回，方便调试
+        return content
+    except LLMError as e:
+        print("❌ DeepSeek 调用失败：", e)
+        return "意图：unknown\\n参数："
 
+def call_deepseek_summary(user_msg, handler_result, llm=None):
     try:
-        res = requests.post(url, headers=headers, json=data, timeout=10)
-        result = res.json()
-        if "choices" in result:
-            return result["choices"][0]["message"]["content"]
-        elif "error" in result:
-            print("❌ DeepSeek chat error:", result["error"])
-            return "⚠️ 暂时无法回复"
-        else:
-            print("❌ DeepSeek chat unexpected response:", result)
-            return "⚠️ 暂时无法回复"
-    except Exception as e:
+        return llm_client.complete(build_summary_messages(user_msg, handler_result), llm, call="summary")
+    except LLMError as e:
+        print("❌ DeepSeek API error:", e)
+        return f"❌ 分析失败：{e}"
+
+def call_deepseek_chat(history, llm=None):
+    """当用户没有执行记账相关操作时，与其闲聊。"""
+    try:
+        return llm_client.complete(build_chat_messages(history), llm, call="chat")
+    except LLMError as e:
         print("DeepSeek chat failed:", e)
         return "⚠️ 暂时无法回复"
 
@@ -248,10 +258,59 @@ def parse_response(text):
 
     return intent, params
 
-@app.route("/api/chat", methods=["POST"])
-@login_required
-def chat():
-    data = request.get_json()
+def resolve_intent_fast(user_id, message, llm_cfg, timer):
+    """本地规则解析 -> 意图缓存，命中返回 (intent, params)，否则返回 None。"""
+    with timer.stage("local_parse"):
+        rows = get_db().execute("SELECT name, type FROM categories WHERE user_id = ?", (user_id,)).fetchall()
+        local = parse_local(message, {row["name"]: row["type"] for row in rows})
+    if local and local[2] >= LOCAL_PARSE_THRESHOLD:
+        intent, params, confidence = local
+        INTENT_SOURCE.inc(source="local")
+        print(f"⚡ 本地解析（置信度 {confidence}）：", intent, params)
+        return intent, params
+
+    with timer.stage("intent_cache"):
+        cached = intent_cache.get(message, llm_cfg.get("model"))
+    if cached:
+        INTENT_SOURCE.inc(source="cache")
+        print("⚡ 命中意图缓存：", *cached)
+        return cached
+    return None
+
+def finish_intent(message, llm_output, llm_cfg, timer):
+    """解析 LLM 的结构化输出并写入意图缓存。"""
+    print("🧠 LLM 原始结构化输出：", llm_output)
+
+    with timer.stage("parse"):
+        intent, params = parse_response(llm_output)
+    INTENT_SOURCE.inc(source="llm")
+    # 只缓存成功识别的结果，LLM 出错时返回的 unknown 不缓存
+    if intent in handlers or intent == "chat":
+        intent_cache.put(message, intent, params, llm_cfg.get("model"))
+    return intent, params
+
+def resolve_intent(user_id, message, llm_cfg, timer):
+    """本地规则解析 -> 意图缓存 -> LLM，依次尝试，返回 (intent, params)。"""
+    fast = resolve_intent_fast(user_id, message, llm_cfg, timer)
+    if fast:
+        return fast
+
+    with timer.stage("intent_llm"):
+        llm_output = call_deepseek_intent(message, llm_cfg)
+    return finish_intent(message, llm_output, llm_cfg, timer)
+
+def run_handler(user_id, intent, params, llm_cfg, timer):
+    """执行意图对应的 handler，返回执行结果文本。"""
+    with timer.stage("handler"):
+        if intent == "suggest_budgets":
+            result = handlers[intent](user_id, params, llm_cfg)
+        else:
+            result = handlers[intent](user_id, params)
+    print("📦 handler 执行结果：", result)
+    return result
+
+def begin_chat(user_id, data):
+    """解析请求、记录用户消息，返回 (最新消息, llm 配置)。"""
     llm_cfg = data.get("llm") or {}
     user_msg = data.get("message", "")
     latest_msg = user_msg
@@ -259,86 +318,258 @@ def chat():
         latest_msg = user_msg.strip().split("\n")[-1]
 
     # 记录对话历史
-    chat_history.append({"role": "user", "content": user_msg})
-    if len(chat_history) > 10:
-        del chat_history[:-10]
-
+    conversations.append(user_id, "user", user_msg)
     print("最新消息: ",latest_msg)
-    llm_output = call_deepseek_intent(latest_msg, llm_cfg)
-    print("🧠 LLM 原始结构化输出：", llm_output)
+    return latest_msg, llm_cfg
 
-    intent, params = parse_response(llm_output)
+def end_chat(user_id, reply, intent, timer):
+    # 记录 assistant 回复
+    conversations.append(user_id, "assistant", reply)
+
+    print("⏱ 各阶段耗时(ms)：", json.dumps(timer.finish(intent if intent in handlers else "chat")))
+
+@app.route("/api/chat", methods=["POST"])
+@login_required
+def chat():
+    latest_msg, llm_cfg = begin_chat(g.user_id, request.get_json())
+    timer = metrics.StageTimer()
+    intent, params = resolve_intent(g.user_id, latest_msg, llm_cfg, timer)
 
     if intent in handlers:
-        if intent == "suggest_budgets":
-            result = handlers[intent](g.user_id, params, llm_cfg)
-        else:
-            result = handlers[intent](g.user_id, params)
-        print("📦 handler 执行结果：", result)
-
-        if intent == "add_record":
-            from db import get_db
-            db = get_db()
-            cursor = db.execute("SELECT * FROM records ORDER BY date DESC")
-            print("📒 当前记录：")
-            for row in cursor.fetchall():
-                print(dict(row))
-
-        if intent == "add_income":
-            from db import get_db
-            db = get_db()
-            cursor = db.execute("SELECT * FROM income ORDER BY date DESC")
-            print("📒 当前记录：")
-            for row in cursor.fetchall():
-                print(dict(row))
+        result = run_handler(g.user_id, intent, params, llm_cfg, timer)
         # 用 LLM 进行总结生成自然语言
-        reply = call_deepseek_summary(latest_msg, result, llm_cfg)
+        with timer.stage("summary_llm"):
+            reply = call_deepseek_summary(latest_msg, result, llm_cfg)
     else:
         # 如果未识别出意图，直接和用户闲聊几句
-        print("llm输入:",chat_history)
-        reply = call_deepseek_chat(chat_history, llm_cfg)
+        history = conversations.history(g.user_id)
+        print("llm输入:",history)
+        with timer.stage("chat_llm"):
+            reply = call_deepseek_chat(history, llm_cfg)
 
-    # 记录 assistant 回复
-    chat_history.append({"role": "assistant", "content": reply})
-    if len(chat_history) > 10:
-        del chat_history[:-10]
+    end_chat(g.user_id, reply, intent, timer)
+    return jsonify({"reply": reply})
 
-    return jsonify({"reply": reply}) 
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
 
-@app.route('/api/records')
+@app.route("/api/chat/stream", methods=["POST"])
 @login_required
-def get_records():
+def chat_stream():
+    """与 /api/chat 相同，但以 Server-Sent Events 逐步返回：
+
+    event: result  handler 执行结果（闲聊时为空），一拿到就先推送
+    event: token   LLM 回复的增量文本 {"text": ...}
+    event: error   LLM 调用失败 {"error": ...}
+    event: done    完整回复 {"reply": ...}
+    """
+    user_id = g.user_id
+    latest_msg, llm_cfg = begin_chat(user_id, request.get_json())
+    timer = metrics.StageTimer()
+    intent, params = resolve_intent(user_id, latest_msg, llm_cfg, timer)
+
+    if intent in handlers:
+        result = run_handler(user_id, intent, params, llm_cfg, timer)
+        stage, fallback = "summary_llm", "❌ 分析失败：{}"
+        messages, call = build_summary_messages(latest_msg, result), "summary"
+    else:
+        result = None
+        history = conversations.history(user_id)
+        print("llm输入:",history)
+        stage, fallback = "chat_llm", "⚠️ 暂时无法回复"
+        messages, call = build_chat_messages(history), "chat"
+
+    def generate():
+        parts = []
+        try:
+            yield sse_event("result", {"intent": intent or "chat", "result": result})
+            try:
+                with timer.stage(stage):
+                    for delta in llm_client.stream(messages, llm_cfg, call=call):
+                        parts.append(delta)
+                        yield sse_event("token", {"text": delta})
+            except LLMError as e:
+                print("❌ DeepSeek 流式调用失败：", e)
+                yield sse_event("error", {"error": str(e)})
+                if not parts:
+                    parts = [fallback.format(e)]
+            yield sse_event("done", {"reply": "".join(parts)})
+        finally:
+            # ✅ 客户端中途断开时也保存已生成的回复并记录各阶段耗时（与 asgi.py 一致）
+            end_chat(user_id, "".join(parts), intent, timer)
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # 禁止 nginx 等反向代理缓冲
+    return response
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4") 
+
+# 单页最多返回的条数
+PAGE_LIMIT_MAX = 500
+# 金额以分存储，列表接口直接在查询里换算成元
+AMOUNT_COLUMN = "t.amount / 100.0 AS amount"
+
+
+def _parse_cursor(after):
+    """Parse a keyset cursor of the form ``YYYY-MM-DD,id`` into ``(day, id)``."""
+    date_part, _, id_part = after.partition(",")
+    _, day, _, _ = normalize_date(date_part)
+    return day, int(id_part)
+
+
+def _stream_rows(rows, fmt, transform=None):
+    """Yield rows as an NDJSON stream or as chunks of one JSON array."""
+    first = True
+    if fmt == "json":
+        yield "["
+    for row in rows:
+        item = dict(row)
+        if transform:
+            transform(item)
+        if fmt == "ndjson":
+            yield app.json.dumps(item) + "\n"
+        else:
+            yield ("" if first else ",") + app.json.dumps(item)
+        first = False
+    if fmt == "json":
+        yield "]"
+
+
+def _list_ledger(table, columns, transform=None):
+    """Shared listing for records / income.
+
+    Rows are ordered by ``(day, id)`` descending, which the ``(user_id, kind, day)``
+    index already provides because SQLite appends the rowid to every index.
+    ``?limit=&after=<date,id>`` pages by keyset and reports the next cursor in
+    the ``X-Next-Cursor`` header; ``?stream=json|ndjson`` writes the rows out
+    from the cursor as they are read instead of materializing the list.
+    """
     db = get_db()
+    # 分类名通过 category_id 关联 categories 取出（t 为明细表，c 为分类表）
+    query = f"SELECT {columns} FROM {table} t LEFT JOIN categories c ON c.id = t.category_id WHERE t.user_id = ?"
+    args = [g.user_id]
+
     month = request.args.get("month")
     if month:
-        cursor = db.execute(
-            """
-            SELECT *, strftime('%Y-%m', date) as month
-            FROM records
-            WHERE strftime('%Y-%m', date) = ? AND user_id = ?
-            ORDER BY date DESC
-        """,
-            (month, g.user_id)
+        if not MONTH_RE.match(month):
+            return jsonify({"error": MONTH_ERROR}), 400
+        query += " AND t.day BETWEEN ? AND ?"
+        args.extend(month_range(month))
+
+    after = request.args.get("after")
+    if after:
+        try:
+            args.extend(_parse_cursor(after))
+        except ValueError:
+            return jsonify({"error": "after 参数格式应为「日期,id」"}), 400
+        query += " AND (t.day, t.id) < (?, ?)"
+
+    query += " ORDER BY t.day DESC, t.id DESC"
+
+    limit = request.args.get("limit", type=int)
+    if limit:
+        limit = max(1, min(limit, PAGE_LIMIT_MAX))
+        query += " LIMIT ?"
+        args.append(limit + 1)  # 多取一条用来判断是否还有下一页
+
+    fmt = request.args.get("stream")
+    if fmt not in (None, "json", "ndjson"):
+        return jsonify({"error": "stream 参数只能是 json 或 ndjson"}), 400
+
+    cursor = db.execute(query, tuple(args))
+    headers = {}
+    if limit:
+        rows = cursor.fetchall()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            headers["X-Next-Cursor"] = f"{rows[-1]['date']},{rows[-1]['id']}"
+    else:
+        rows = cursor
+
+    if fmt:
+        mimetype = "application/x-ndjson" if fmt == "ndjson" else "application/json"
+        return Response(stream_with_context(_stream_rows(rows, fmt, transform)), mimetype=mimetype, headers=headers)
+
+    results = [dict(row) for row in rows]
+    if transform:
+        for r in results:
+            transform(r)
+    return jsonify(results), 200, headers
+
+
+@app.route('/api/records')
+@login_required
+@conditional_get()
+def get_records():
+    return _list_ledger("records", f"t.id, t.user_id, c.name AS category, {AMOUNT_COLUMN}, t.note, t.date, t.month, t.year")
+
+@app.route('/api/export')
+@login_required
+def export_data():
+    table = request.args.get("table", "records")
+    fmt = request.args.get("format", "csv")
+    categories = [c.strip() for c in request.args.get("category", "").split(",") if c.strip()]
+    try:
+        chunks = export(
+            get_db(readonly=True), table, g.user_id, fmt,
+            start=request.args.get("start"),
+            end=request.args.get("end"),
+            categories=categories or None,
         )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if fmt == "csv":
+        ext, mimetype = "csv", "text/csv"
+    elif fmt == "ndjson":
+        ext, mimetype = "ndjson", "application/x-ndjson"
     else:
-        cursor = db.execute(
-            """
-            SELECT *, strftime('%Y-%m', date) as month
-            FROM records
-            WHERE user_id = ?
-            ORDER BY date DESC
-        """,
-            (g.user_id,)
+        ext, mimetype = columnar_info()
+    filename = f"{table}-{datetime.now().strftime('%Y%m%d')}.{ext}"
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.route('/api/import', methods=['POST'])
+@login_required
+def import_data():
+    """批量导入账单：multipart 上传 file（CSV / JSON），或直接提交 JSON {"rows": [...]}。"""
+    if "file" in request.files:
+        upload = request.files["file"]
+        form = request.form
+        fmt = form.get("format") or ("json" if (upload.filename or "").lower().endswith(".json") else "csv")
+        data = upload.read()
+    else:
+        form = request.get_json(silent=True) or {}
+        fmt, data = "json", json.dumps(form.get("rows") or [])
+
+    mapping = form.get("mapping") or None
+    try:
+        if isinstance(mapping, str):
+            mapping = json.loads(mapping)
+        summary = import_rows(
+            get_db(), g.user_id, parse_rows(data, fmt),
+            mapping=mapping,
+            default_kind=form.get("kind", "expense"),
+            default_category=(form.get("default_category") or "").strip() or None,
         )
-    results = [dict(row) for row in cursor.fetchall()]
-    return jsonify(results)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    print("📥 导入结果：", summary["inserted"], "重复", summary["duplicates"], "错误", summary["error_count"])
+    return jsonify({"success": True, **summary})
 
 @app.route('/api/records/<int:record_id>', methods=['DELETE'])
 @login_required
 def delete_record(record_id):
     db = get_db()
     db.execute(
-        "DELETE FROM records WHERE id = ? AND user_id = ?",
+        "DELETE FROM transactions WHERE id = ? AND user_id = ? AND kind = '支出'",
         (record_id, g.user_id)
     )
     db.commit()
@@ -349,64 +580,44 @@ def delete_record(record_id):
 def update_record(record_id):
     data = request.get_json()
     category = data.get('category', '').strip()
-    amount = float(data.get('amount', 0))
     note = data.get('note', '').strip()
-    date = data.get('date')
-    month = date[:7] if date else ''
-    year = date[:4] if date else ''
+    try:
+        amount = to_cents(data.get('amount', 0))
+        date, day, month, year = normalize_date(data.get('date'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     db = get_db()
+    # 分类不存在时按支出分类补建
+    category_id = category_ref(db, g.user_id, category, "支出")[0] if category else None
     db.execute(
         """
-        UPDATE records SET category = ?, amount = ?, note = ?, date = ?, month = ?, year = ?
-        WHERE id = ? AND user_id = ?
+        UPDATE transactions SET category_id = ?, amount = ?, note = ?, date = ?, day = ?, month = ?, year = ?
+        WHERE id = ? AND user_id = ? AND kind = '支出'
         """,
-        (category, amount, note, date, month, year, record_id, g.user_id),
+        (category_id, amount, note, date, day, month, year, record_id, g.user_id),
     )
     db.commit()
     return jsonify({"success": True})
 
+def _fill_income_date(r):
+    # ✅ 防御式检查每条记录都有 date 字段
+    if "date" not in r or not r["date"]:
+        r["date"] = (r.get("month") or "") + "-01"
+
+
 @app.route('/api/income')
 @login_required
+@conditional_get()
 def get_income():
-    db = get_db()
-    month = request.args.get("month")
-
-    if month:
-        cursor = db.execute(
-            """
-            SELECT id, category, amount, note, date, month, year
-            FROM income
-            WHERE month = ? AND user_id = ?
-            ORDER BY date DESC
-        """,
-            (month, g.user_id)
-        )
-    else:
-        cursor = db.execute(
-            """
-            SELECT id, category, amount, note, date, month, year
-            FROM income
-            WHERE user_id = ?
-            ORDER BY date DESC
-        """,
-            (g.user_id,)
-        )
-
-    results = [dict(row) for row in cursor.fetchall()]
-
-    # ✅ 防御式检查每条记录都有 date 字段
-    for r in results:
-        if "date" not in r or not r["date"]:
-            r["date"] = r.get("month", "") + "-01"
-
-    return jsonify(results)
+    return _list_ledger("income", f"t.id, c.name AS category, {AMOUNT_COLUMN}, t.note, t.date, t.month, t.year",
+                        _fill_income_date)
 
 @app.route('/api/income/<int:income_id>', methods=['DELETE'])
 @login_required
 def delete_income(income_id):
     db = get_db()
     db.execute(
-        "DELETE FROM income WHERE id = ? AND user_id = ?",
+        "DELETE FROM transactions WHERE id = ? AND user_id = ? AND kind = '收入'",
         (income_id, g.user_id)
     )
     db.commit()
@@ -417,24 +628,28 @@ def delete_income(income_id):
 def update_income(income_id):
     data = request.get_json()
     category = data.get('category', '').strip()
-    amount = float(data.get('amount', 0))
     note = data.get('note', '').strip()
-    date = data.get('date')
-    month = date[:7] if date else ''
-    year = date[:4] if date else ''
+    try:
+        amount = to_cents(data.get('amount', 0))
+        date, day, month, year = normalize_date(data.get('date'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     db = get_db()
+    # 分类不存在时按收入分类补建
+    category_id = category_ref(db, g.user_id, category, "收入")[0] if category else None
     db.execute(
         """
-        UPDATE income SET category = ?, amount = ?, note = ?, date = ?, month = ?, year = ?
-        WHERE id = ? AND user_id = ?
+        UPDATE transactions SET category_id = ?, amount = ?, note = ?, date = ?, day = ?, month = ?, year = ?
+        WHERE id = ? AND user_id = ? AND kind = '收入'
         """,
-        (category, amount, note, date, month, year, income_id, g.user_id),
+        (category_id, amount, note, date, day, month, year, income_id, g.user_id),
     )
     db.commit()
     return jsonify({"success": True})
 
 @app.route("/api/categories", methods=["GET"])
 @login_required
+@conditional_get()
 def get_categories():
     db = get_db()
     category_type = request.args.get("type")
@@ -464,79 +679,35 @@ def get_categories():
 month = datetime.now().strftime("%Y-%m")
 @app.route('/api/budgets')
 @login_required
+@conditional_get()
 def get_budgets():
     db = get_db()
     month = request.args.get('month')
     result = []
 
+    # ✅ 预算与当月支出汇总按整数键 (category_id, month) 直接关联
+    query = """
+        SELECT c.name AS category, b.amount, b.month, COALESCE(t.total, 0) AS spent
+        FROM budgets b
+        JOIN categories c ON c.id = b.category_id
+        LEFT JOIN monthly_totals t
+          ON t.user_id = b.user_id AND t.kind = '支出' AND t.month = b.month AND t.category_id = b.category_id
+        WHERE b.user_id = ? AND c.type = '支出'
+    """
+    args = [g.user_id]
     if month:
-        # ✅ 仅查指定月份支出类预算
-        cursor = db.execute(
-            """
-            SELECT b.category, b.amount
-            FROM budgets b
-            JOIN categories c ON b.category = c.name AND c.user_id = b.user_id
-            WHERE b.month = ? AND b.user_id = ? AND c.type = '支出'
-        """,
-            (month, g.user_id)
-        )
-        budgets = cursor.fetchall()
+        # 仅查指定月份
+        query += " AND b.month = ?"
+        args.append(month)
+    query += " ORDER BY b.id"
 
-        cursor = db.execute(
-            """
-            SELECT category, SUM(amount) as total
-            FROM records
-            WHERE strftime('%Y-%m', date) = ? AND user_id = ?
-            GROUP BY category
-        """,
-            (month, g.user_id)
-        )
-        spend_map = {row['category']: row['total'] for row in cursor.fetchall()}
-
-        for b in budgets:
-            spent = spend_map.get(b['category'], 0)
-            remaining = float(b['amount']) - float(spent)
-            result.append({
-                'category': b['category'],
-                'amount': float(b['amount']),
-                'remaining': round(remaining, 2),
-                'month': month
-            })
-
-    else:
-        # ✅ 查所有月份的支出类预算
-        cursor = db.execute(
-            """
-            SELECT b.category, b.amount, b.month
-            FROM budgets b
-            JOIN categories c ON b.category = c.name AND c.user_id = b.user_id
-            WHERE b.user_id = ? AND c.type = '支出'
-        """,
-            (g.user_id,)
-        )
-        all_budgets = cursor.fetchall()
-
-        cursor = db.execute(
-            """
-            SELECT category, strftime('%Y-%m', date) as month, SUM(amount) as total
-            FROM records
-            WHERE user_id = ?
-            GROUP BY category, month
-        """,
-            (g.user_id,)
-        )
-        spend_map = {(row['category'], row['month']): row['total'] for row in cursor.fetchall()}
-
-        for b in all_budgets:
-            key = (b['category'], b['month'])
-            spent = spend_map.get(key, 0)
-            remaining = float(b['amount']) - float(spent)
-            result.append({
-                'category': b['category'],
-                'amount': float(b['amount']),
-                'remaining': round(remaining, 2),
-                'month': b['month']
-            })
+    for b in db.execute(query, tuple(args)).fetchall():
+        result.append({
+            'category': b['category'],
+            'amount': from_cents(b['amount']),
+            'remaining': from_cents(b['amount'] - b['spent']),
+            'month': b['month']
+        })
 
     return jsonify(result)
 
@@ -570,60 +741,73 @@ def add_category_manual():
 def delete_category_manual(name):
     db = get_db()
 
-    # ✅ 获取分类类型
-    row = db.execute(
-        "SELECT type FROM categories WHERE name = ? AND user_id = ?",
-        (name, g.user_id)
-    ).fetchone()
-    if not row:
+    # ✅ 获取分类 id
+    ref = category_ref(db, g.user_id, name)
+    if not ref:
         return jsonify({"error": f"分类「{name}」不存在"}), 404
+    category_id = ref[0]
 
-    category_type = row["type"]
-
-    # ✅ 删除记录
-    if category_type == "支出":
-        db.execute("DELETE FROM records WHERE category = ? AND user_id = ?", (name, g.user_id))
-        db.execute("DELETE FROM budgets WHERE category = ? AND user_id = ?", (name, g.user_id))
-    elif category_type == "收入":
-        db.execute("DELETE FROM income WHERE source = ? AND user_id = ?", (name, g.user_id))
+    # ✅ 删除引用该分类的全部记录与预算
+    for table in ("transactions", "budgets"):
+        db.execute(f"DELETE FROM {table} WHERE category_id = ? AND user_id = ?", (category_id, g.user_id))
 
     # ✅ 删除分类本身
-    db.execute("DELETE FROM categories WHERE name = ? AND user_id = ?", (name, g.user_id))
+    db.execute("DELETE FROM categories WHERE id = ?", (category_id,))
     db.commit()
 
     return jsonify({"success": True})
 
+@app.route("/api/categories/<name>", methods=["PUT"])
+@login_required
+def rename_category_manual(name):
+    """重命名分类：记录只引用 category_id，只需更新 categories 中的一行。"""
+    data = request.get_json() or {}
+    new_name = (data.get("name") or "").strip()
+    if not new_name:
+        return jsonify({"error": "缺少新的分类名称"}), 400
+
+    db = get_db()
+    ref = category_ref(db, g.user_id, name)
+    if not ref:
+        return jsonify({"error": f"分类「{name}」不存在"}), 404
+    if new_name != name and category_ref(db, g.user_id, new_name):
+        return jsonify({"error": f"分类「{new_name}」已存在"}), 400
+
+    db.execute("UPDATE categories SET name = ? WHERE id = ?", (new_name, ref[0]))
+    db.commit()
+    return jsonify({"success": True})
+
 @app.route("/api/budgets", methods=["POST"])
 @login_required
 def set_budget_manual():
     data = request.get_json()
     category = data.get("category", "").strip()
-    amount = float(data.get("amount", 0))
     cycle = data.get("cycle", "月")
     month = data.get("month") or datetime.now().strftime('%Y-%m')
 
     if not category:
         return jsonify({"error": "缺少分类名称"}), 400
+    try:
+        amount = to_cents(data.get("amount", 0))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     db = get_db()
 
     # ✅ 检查分类是否存在且为支出类型
-    row = db.execute(
-        "SELECT type FROM categories WHERE name = ? AND user_id = ?",
-        (category, g.user_id)
-    ).fetchone()
-    if not row:
+    ref = category_ref(db, g.user_id, category)
+    if not ref:
         return jsonify({"error": f"分类「{category}」不存在"}), 400
-    if row["type"] != "支出":
+    if ref[1] != "支出":
         return jsonify({"error": f"分类「{category}」不是支出类型，无法设置预算"}), 400
 
     # ✅ 写入预算
     db.execute(
         """
-        INSERT OR REPLACE INTO budgets (user_id, category, amount, cycle, month)
+        INSERT OR REPLACE INTO budgets (user_id, category_id, amount, cycle, month)
         VALUES (?, ?, ?, ?, ?)
     """,
-        (g.user_id, category, amount, cycle, month)
+        (g.user_id, ref[0], amount, cycle, month)
     )
     db.commit()
     return jsonify({"success": True})
@@ -632,50 +816,37 @@ def set_budget_manual():
 
 @app.route("/api/stats/monthly", methods=["GET"])
 @login_required
+@conditional_get()
 def monthly_stats():
-    db = get_db()
+    db = get_db(readonly=True)
     year = request.args.get("year")
     if year:
         # 按年份过滤
-        spend_cursor = db.execute(
-            """
-            SELECT strftime('%Y-%m', date) AS month, SUM(amount) AS total
-            FROM records WHERE year = ? AND user_id = ?
-            GROUP BY month
-            """,
-            (year, g.user_id),
-        )
-        income_cursor = db.execute(
+        cursor = db.execute(
             """
-            SELECT month, SUM(amount) AS total
-            FROM income WHERE year = ? AND user_id = ?
-            GROUP BY month
+            SELECT month, kind, SUM(total) AS total
+            FROM monthly_totals
+            WHERE user_id = ? AND month BETWEEN ? AND ?
+            GROUP BY month, kind
             """,
-            (year, g.user_id),
+            (g.user_id, f"{year}-01", f"{year}-12"),
         )
     else:
         # 无年份限制，统计全部月份
-        spend_cursor = db.execute(
-            """
-            SELECT strftime('%Y-%m', date) AS month, SUM(amount) AS total
-            FROM records
-            WHERE user_id = ?
-            GROUP BY month
-            """,
-            (g.user_id,)
-        )
-        income_cursor = db.execute(
+        cursor = db.execute(
             """
-            SELECT month, SUM(amount) AS total
-            FROM income
+            SELECT month, kind, SUM(total) AS total
+            FROM monthly_totals
             WHERE user_id = ?
-            GROUP BY month
+            GROUP BY month, kind
             """,
             (g.user_id,)
         )
 
-    spend_data = {row['month']: float(row['total']) for row in spend_cursor.fetchall()}
-    income_data = {row['month']: float(row['total']) for row in income_cursor.fetchall()}
+    spend_data, income_data = {}, {}
+    for row in cursor.fetchall():
+        target = spend_data if row["kind"] == "支出" else income_data
+        target[row["month"]] = from_cents(row["total"])
 
     if year:
         months = [f"{year}-{i:02d}" for i in range(1, 13)]
@@ -694,129 +865,116 @@ def monthly_stats():
 
 @app.route("/api/stats/by-category", methods=["GET"])
 @login_required
+@conditional_get()
 def category_stats():
-    db = get_db()
+    db = get_db(readonly=True)
     month = request.args.get("month")
     year = request.args.get("year")
 
+    # 先按整数 category_id 分组，再关联出分类名
+    query = "SELECT kind, category_id, SUM(total) AS total FROM monthly_totals WHERE user_id = ?"
+    args = [g.user_id]
     if month:
-        spend_cursor = db.execute(
-            "SELECT category AS name, SUM(amount) AS total FROM records WHERE month = ? AND user_id = ? GROUP BY category",
-            (month, g.user_id),
-        )
-        income_cursor = db.execute(
-            "SELECT category AS name, SUM(amount) AS total FROM income WHERE month = ? AND user_id = ? GROUP BY category",
-            (month, g.user_id),
-        )
+        query += " AND month = ?"
+        args.append(month)
     elif year:
-        spend_cursor = db.execute(
-            "SELECT category AS name, SUM(amount) AS total FROM records WHERE year = ? AND user_id = ? GROUP BY category",
-            (year, g.user_id),
-        )
-        income_cursor = db.execute(
-            "SELECT category AS name, SUM(amount) AS total FROM income WHERE year = ? AND user_id = ? GROUP BY category",
-            (year, g.user_id),
-        )
-    else:
-        spend_cursor = db.execute(
-            "SELECT category AS name, SUM(amount) AS total FROM records WHERE user_id = ? GROUP BY category",
-            (g.user_id,)
-        )
-        income_cursor = db.execute(
-            "SELECT category AS name, SUM(amount) AS total FROM income WHERE user_id = ? GROUP BY category",
-            (g.user_id,)
-        )
-
-    income_result = [
-        {"名称": row["name"], "金额": float(row["total"]), "类型": "收入"}
-        for row in income_cursor.fetchall()
-    ]
-    spend_result = [
-        {"名称": row["name"], "金额": float(row["total"]), "类型": "支出"}
-        for row in spend_cursor.fetchall()
-    ]
+        query += " AND month BETWEEN ? AND ?"
+        args.extend((f"{year}-01", f"{year}-12"))
+    query += " GROUP BY kind, category_id"
+    query = (f"SELECT t.kind, COALESCE(c.name, '') AS name, t.total FROM ({query}) t "
+             "LEFT JOIN categories c ON c.id = t.category_id ORDER BY name")
+
+    spend_result, income_result = [], []
+    for row in db.execute(query, tuple(args)).fetchall():
+        target = spend_result if row["kind"] == "支出" else income_result
+        target.append({"名称": row["name"], "金额": from_cents(row["total"]), "类型": row["kind"]})
     return jsonify(spend_result + income_result)
 
 @app.route("/api/stats/summary", methods=["GET"])
 @login_required
+@conditional_get(vary=current_month_default)
 def summary_stats():
-    db = get_db()
+    db = get_db(readonly=True)
     month = request.args.get("month") or datetime.now().strftime("%Y-%m")
 
-    # ✅ 查询该月总支出
-    spend_cursor = db.execute(
+    # ✅ 从汇总表一次取出该月总支出与总收入
+    cursor = db.execute(
         """
-        SELECT SUM(amount) AS total
-        FROM records
-        WHERE month = ? AND user_id = ?
+        SELECT kind, SUM(total) AS total
+        FROM monthly_totals
+        WHERE user_id = ? AND month = ?
+        GROUP BY kind
     """,
-        (month, g.user_id)
+        (g.user_id, month)
     )
-    spend_total = float(spend_cursor.fetchone()["total"] or 0.0)
+    totals = {row["kind"]: row["total"] or 0 for row in cursor.fetchall()}
+    spend_total = totals.get("支出", 0)
+    income_total = totals.get("收入", 0)
 
-    # ✅ 查询该月总收入
-    income_cursor = db.execute(
-        """
-        SELECT SUM(amount) AS total
-        FROM income
-        WHERE month = ? AND user_id = ?
-    """,
-        (month, g.user_id)
-    )
-    income_total = float(income_cursor.fetchone()["total"] or 0.0)
-
-    # ✅ 差额计算
+    # ✅ 差额按分计算，无浮点误差
     balance = income_total - spend_total
 
     return jsonify({
         "month": month,
-        "总支出": round(spend_total, 2),
-        "总收入": round(income_total, 2),
-        "结余": round(balance, 2)
+        "总支出": from_cents(spend_total),
+        "总收入": from_cents(income_total),
+        "结余": from_cents(balance)
     })
 
 @app.route("/api/stats/daily")
 @login_required
+@conditional_get()
 def daily_stats():
-    db = get_db()
+    db = get_db(readonly=True)
     month = request.args.get("month")
     if not month:
         return jsonify({"error": "缺少参数 month"}), 400
+    if not MONTH_RE.match(month):
+        return jsonify({"error": MONTH_ERROR}), 400
 
-    # 支出
-    spend_cursor = db.execute(
+    # ✅ 收支同表，一次分组同时得到每天的支出与收入（kind IN 让两侧都走 (user_id, kind, day) 索引）
+    cursor = db.execute(
         """
-        SELECT date, SUM(amount) AS total
-        FROM records
-        WHERE strftime('%Y-%m', date) = ? AND user_id = ?
-        GROUP BY date
+        SELECT date, kind, SUM(amount) AS total
+        FROM transactions
+        WHERE user_id = ? AND kind IN ('支出', '收入') AND day BETWEEN ? AND ?
+        GROUP BY day, kind
     """,
-        (month, g.user_id)
+        (g.user_id, *month_range(month))
     )
-    spend_map = {row['date']: float(row['total']) for row in spend_cursor.fetchall()}
-
-    # 收入
-    income_cursor = db.execute(
-        """
-        SELECT date, SUM(amount) AS total
-        FROM income
-        WHERE strftime('%Y-%m', date) = ? AND user_id = ?
-        GROUP BY date
-    """,
-        (month, g.user_id)
-    )
-    income_map = {row['date']: float(row['total']) for row in income_cursor.fetchall()}
+    spend_map, income_map = {}, {}
+    for row in cursor.fetchall():
+        target = spend_map if row["kind"] == "支出" else income_map
+        target[row["date"]] = row["total"]
 
     all_dates = sorted(set(spend_map) | set(income_map))
     result = []
     for d in all_dates:
-        spend = spend_map.get(d, 0.0)
-        income = income_map.get(d, 0.0)
+        spend = spend_map.get(d, 0)
+        income = income_map.get(d, 0)
         result.append({
             "date": d,
-            "支出": spend,
-            "收入": income,
-            "结余": round(income - spend, 2)
+            "支出": from_cents(spend),
+            "收入": from_cents(income),
+            "结余": from_cents(income - spend)
         })
 
     return jsonify(result)
+
+
+@app.route("/api/stats/forecast")
+@login_required
+@conditional_get(vary=current_day)  # 预测随“今天”变化，数据不变也要每天重新校验
+def forecast_stats():
+    month = request.args.get("month") or datetime.now().strftime("%Y-%m")
+    if not MONTH_RE.match(month):
+        return jsonify({"error": MONTH_ERROR}), 400
+
+    # ✅ 计算在独立线程池里做，按数据版本缓存；等不到结果时先返回 202，稍后重试即可命中缓存
+    result = get_forecast(get_db(readonly=True), g.user_id, month)
+    if result is None:
+        response = jsonify({"status": "pending"})
+        response.status_code = 202
+        response.headers["Retry-After"] = "2"
+        return response
+    return jsonify(result)
@@ -0,0 +1,239 @@
+"""ASGI 入口：聊天接口走 asyncio，其余路由照旧由 Flask 处理。
+
+/api/chat 与 /api/chat/stream 在事件循环里等待 LLM（httpx），数据库相关的
+同步代码放到独立线程池执行，等待 LLM 时不再占用线程；其它请求交给 Flask，
+在 a2wsgi 的线程池中运行。
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import CookieError, SimpleCookie
+
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+
+import metrics
+from app import (
+    app as flask_app, handlers, begin_chat, end_chat, run_handler,
+    resolve_intent_fast, finish_intent, build_intent_messages, build_summary_messages,
+    build_chat_messages, sse_event,
+)
+from conversation import conversations
+from llm import AsyncLLMClient, LLMError
+
+# 数据库 / handler 线程池，与 Flask 路由的线程池分开，互不挤占
+DB_THREADS = int(os.getenv("ASYNC_DB_THREADS", "8"))
+WSGI_THREADS = int(os.getenv("ASYNC_WSGI_THREADS", "16"))
+
+executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="chat-db")
+wsgi = WSGIMiddleware(flask_app, workers=WSGI_THREADS)
+_llm = None
+
+
+def llm_client():
+    # httpx.AsyncClient 必须在事件循环内创建
+    global _llm
+    if _llm is None:
+        _llm = AsyncLLMClient()
+    return _llm
+
+
+async def run_sync(fn, *args):
+    """Run ``fn`` on the DB pool inside a Flask app context.
+
+    Everything that touches SQLite goes through here, including the
+    conversation / intent-cache stores, which take write locks when
+    ``STATE_BACKEND=sqlite``.
+    """
+    def call():
+        with flask_app.app_context():  # 上下文结束时归还数据库连接
+            return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+
+def session_user_id(scope):
+    """Read ``user_id`` from Flask's signed session cookie, or None."""
+    cookies = SimpleCookie()
+    for name, value in scope["headers"]:
+        if name == b"cookie":
+            try:
+                cookies.load(value.decode("latin-1"))
+            except CookieError:
+                return None
+    morsel = cookies.get(flask_app.config["SESSION_COOKIE_NAME"])
+    if morsel is None:
+        return None
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        data = serializer.loads(morsel.value, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    return data.get("user_id")
+
+
+# ===== LLM 调用（与 app.py 中的 call_deepseek_* 对应）=====
+
+async def call_deepseek_intent(message, llm=None):
+    try:
+        content = await llm_client().complete(build_intent_messages(message), llm, call="intent", temperature=0.7)
+        print("📥 DeepSeek 返回内容：", content)
+        return content
+    except LLMError as e:
+        print("❌ DeepSeek 调用失败：", e)
+        return "意图：unknown\\n参数："
+
+
+async def call_deepseek_summary(user_msg, handler_result, llm=None):
+    try:
+        return await llm_client().complete(build_summary_messages(user_msg, handler_result), llm, call="summary")
+    except LLMError as e:
+        print("❌ DeepSeek API error:", e)
+        return f"❌ 分析失败：{e}"
+
+
+async def call_deepseek_chat(history, llm=None):
+    try:
+        return await llm_client().complete(build_chat_messages(history), llm, call="chat")
+    except LLMError as e:
+        print("DeepSeek chat failed:", e)
+        return "⚠️ 暂时无法回复"
+
+
+async def resolve_intent(user_id, message, llm_cfg, timer):
+    fast = await run_sync(resolve_intent_fast, user_id, message, llm_cfg, timer)
+    if fast:
+        return fast
+    with timer.stage("intent_llm"):
+        llm_output = await call_deepseek_intent(message, llm_cfg)
+    return await run_sync(finish_intent, message, llm_output, llm_cfg, timer)
+
+
+# ===== 聊天接口 =====
+
+async def chat(user_id, data, respond):
+    latest_msg, llm_cfg = await run_sync(begin_chat, user_id, data)
+    timer = metrics.StageTimer()
+    intent, params = await resolve_intent(user_id, latest_msg, llm_cfg, timer)
+
+    if intent in handlers:
+        result = await run_sync(run_handler, user_id, intent, params, llm_cfg, timer)
+        with timer.stage("summary_llm"):
+            reply = await call_deepseek_summary(latest_msg, result, llm_cfg)
+    else:
+        history = await run_sync(conversations.history, user_id)
+        print("llm输入:", history)
+        with timer.stage("chat_llm"):
+            reply = await call_deepseek_chat(history, llm_cfg)
+
+    await run_sync(end_chat, user_id, reply, intent, timer)
+    await respond(200, "application/json", json.dumps({"reply": reply}, ensure_ascii=False).encode("utf-8"))
+
+
+async def chat_stream(user_id, data, respond):
+    """SSE 版本，事件格式与 Flask 的 /api/chat/stream 相同。"""
+    latest_msg, llm_cfg = await run_sync(begin_chat, user_id, data)
+    timer = metrics.StageTimer()
+    intent, params = await resolve_intent(user_id, latest_msg, llm_cfg, timer)
+
+    if intent in handlers:
+        result = await run_sync(run_handler, user_id, intent, params, llm_cfg, timer)
+        stage, fallback = "summary_llm", "❌ 分析失败：{}"
+        messages, call = build_summary_messages(latest_msg, result), "summary"
+    else:
+        result = None
+        history = await run_sync(conversations.history, user_id)
+        print("llm输入:", history)
+        stage, fallback = "chat_llm", "⚠️ 暂时无法回复"
+        messages, call = build_chat_messages(history), "chat"
+
+    send = await respond(200, "text/event-stream", None, [(b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")])
+    parts = []
+    try:
+        await send(sse_event("result", {"intent": intent or "chat", "result": result}))
+        try:
+            with timer.stage(stage):
+                async for delta in llm_client().stream(messages, llm_cfg, call=call):
+                    parts.append(delta)
+                    await send(sse_event("token", {"text": delta}))
+        except LLMError as e:
+            print("❌ DeepSeek 流式调用失败：", e)
+            await send(sse_event("error", {"error": str(e)}))
+            if not parts:
+                parts = [fallback.format(e)]
+        await send(sse_event("done", {"reply": "".join(parts)}), more=False)
+    finally:
+        await run_sync(end_chat, user_id, "".join(parts), intent, timer)
+
+
+ASYNC_ROUTES = {"/api/chat": chat, "/api/chat/stream": chat_stream}
+
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return bytes(body)
+
+
+async def handle_async(route, view, scope, receive, send):
+    started = time.perf_counter()
+    metrics.HTTP_IN_FLIGHT.inc()
+    origin = dict(scope["headers"]).get(b"origin")
+
+    async def respond(status, content_type, body, extra_headers=()):
+        headers = [(b"content-type", f"{content_type}; charset=utf-8".encode())]
+        if origin:  # 与 flask-cors(supports_credentials=True) 的行为保持一致
+            headers += [(b"access-control-allow-origin", origin), (b"access-control-allow-credentials", b"true")]
+        await send({"type": "http.response.start", "status": status, "headers": headers + list(extra_headers)})
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started, route=route, method="POST", status=status)
+
+        async def send_chunk(text, more=True):
+            await send({"type": "http.response.body", "body": text.encode("utf-8"), "more_body": more})
+
+        if body is not None:
+            await send({"type": "http.response.body", "body": body})
+        return send_chunk
+
+    try:
+        user_id = session_user_id(scope)
+        if not user_id:
+            await respond(401, "application/json", b'{"error": "Unauthorized"}')
+            return
+        try:
+            data = json.loads(await read_body(receive) or b"{}")
+        except ValueError:
+            await respond(400, "application/json", json.dumps({"error": "请求体不是合法的 JSON"}, ensure_ascii=False).encode("utf-8"))
+            return
+        await view(user_id, data, respond)
+    finally:
+        metrics.HTTP_IN_FLIGHT.dec()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _llm is not None:
+                await _llm.aclose()
+            executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in ASYNC_ROUTES:
+        await handle_async(scope["path"], ASYNC_ROUTES[scope["path"]], scope, receive, send)
+        return
+    await wsgi(scope, receive, send)
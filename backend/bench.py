@@ -0,0 +1,347 @@
+"""接口基准测试：生成确定性的合成账本，用 Flask 测试客户端逐个请求各接口并统计耗时。
+
+    python bench.py                                   # 默认规模，结果打印到终端
+    python bench.py --users 50 --years 5 --save base.json
+    python bench.py --compare base.json               # 与保存的基线对比，退化时退出码为 1
+
+数据写入临时目录下的 records.db（--db 可指定），LLM 调用全部替换为固定回复，
+不访问网络。每个接口报告延迟分位数、每次请求执行的 SQL 条数以及峰值内存。
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+BENCH_USER = ("bench", "bench")
+
+EXPENSE_NAMES = ["餐饮", "交通", "购物", "房租", "水电", "通讯", "娱乐", "医疗", "教育", "旅行",
+                 "日用", "服饰", "运动", "宠物", "社交", "数码", "家居", "保险", "美容", "其他"]
+INCOME_NAMES = ["工资", "奖金", "兼职", "理财", "报销", "红包"]
+NOTES = ["", "", "午饭", "晚饭", "地铁", "打车", "超市", "网购", "咖啡", "聚餐", "充值", "会员"]
+
+# 发给 /api/chat 的消息 -> 桩 LLM 返回的意图（{month} 为数据的最后一个月）
+CHAT_INTENTS = {
+    "bench analyze_spend": "意图：analyze_spend\n参数：\n月份：{month}",
+    "bench budget_remain": "意图：budget_remain\n参数：\n月份：{month}",
+    "bench query_income": "意图：query_income\n参数：\n时间范围：{year}",
+    "bench suggest_budgets": "意图：suggest_budgets\n参数：\n总预算：8000",
+    "bench add_record": "意图：add_record\n参数：\n分类：餐饮\n金额：18.5\n备注：bench\n时间：{month}-15\n月份：{month}",
+}
+
+
+def month_labels(end_month, count):
+    """``count`` month labels ('YYYY-MM') ending at ``end_month``, oldest first."""
+    index = int(end_month[:4]) * 12 + int(end_month[5:7]) - 1
+    return [f"{i // 12:04d}-{i % 12 + 1:02d}" for i in range(index - count + 1, index + 1)]
+
+
+def generate(conn, args):
+    """Fill an empty, migrated database with deterministic synthetic data.
+
+    The same arguments always produce the same rows. User 1 is the
+    benchmark user; the others only add realistic table / index sizes.
+    """
+    from werkzeug.security import generate_password_hash
+    from db import normalize_date
+
+    rng = random.Random(args.seed)
+    months = month_labels(args.end_month, args.years * 12)
+    expense_names = [EXPENSE_NAMES[i] if i < len(EXPENSE_NAMES) else f"分类{i + 1}" for i in range(args.categories)]
+    income_names = INCOME_NAMES[:max(1, min(args.income_categories, len(INCOME_NAMES)))]
+    password = generate_password_hash(BENCH_USER[1])
+
+    with conn:
+        for user in range(1, args.users + 1):
+            name = BENCH_USER[0] if user == 1 else f"user{user}"
+            user_id = conn.execute("INSERT INTO users (username, password) VALUES (?, ?)", (name, password)).lastrowid
+            categories = {}
+            for cat_name, cat_type in [(n, "支出") for n in expense_names] + [(n, "收入") for n in income_names]:
+                categories[cat_name] = conn.execute(
+                    "INSERT INTO categories (user_id, name, type) VALUES (?, ?, ?)", (user_id, cat_name, cat_type)
+                ).lastrowid
+            # 每个分类一个典型金额（分），按对数正态分布波动
+            typical = {n: rng.lognormvariate(8, 1) for n in expense_names}
+            weights = [rng.random() ** 2 + 0.05 for _ in expense_names]
+
+            rows = []
+            for month in months:
+                first = date(int(month[:4]), int(month[5:7]), 1)
+                days = (date(first.year + first.month // 12, first.month % 12 + 1, 1) - first).days
+                for _ in range(args.records_per_month):
+                    cat_name = rng.choices(expense_names, weights)[0]
+                    d = first.replace(day=rng.randint(1, days)).isoformat()
+                    amount = max(1, int(typical[cat_name] * rng.lognormvariate(0, 0.5)))
+                    rows.append((user_id, "支出", categories[cat_name], amount, rng.choice(NOTES), *normalize_date(d)))
+                for _ in range(args.income_per_month):
+                    cat_name = rng.choice(income_names)
+                    d = first.replace(day=rng.randint(1, days)).isoformat()
+                    rows.append((user_id, "收入", categories[cat_name], rng.randint(100000, 2000000), "",
+                                 *normalize_date(d)))
+                for cat_name in rng.sample(expense_names, min(args.budgeted, len(expense_names))):
+                    conn.execute(
+                        "INSERT INTO budgets (user_id, category_id, amount, cycle, month) VALUES (?, ?, ?, '月', ?)",
+                        (user_id, categories[cat_name], int(typical[cat_name] * args.records_per_month), month),
+                    )
+            rows.sort(key=lambda r: r[6])  # 按日期插入，id 与日期大致同序，接近真实数据
+            conn.executemany(
+                "INSERT INTO transactions (user_id, kind, category_id, amount, note, date, day, month, year) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+
+def endpoints(args, record_id):
+    """``(name, method, path, json body)`` for every benchmarked request; writes come last."""
+    month, year = args.end_month, args.end_month[:4]
+    reads = [
+        ("GET", "/api/records"),
+        ("GET", f"/api/records?month={month}"),
+        ("GET", "/api/records?limit=50"),
+        ("GET", "/api/income"),
+        ("GET", f"/api/income?month={month}"),
+        ("GET", "/api/categories"),
+        ("GET", "/api/budgets"),
+        ("GET", f"/api/budgets?month={month}"),
+        ("GET", "/api/stats/monthly"),
+        ("GET", f"/api/stats/monthly?year={year}"),
+        ("GET", "/api/stats/by-category"),
+        ("GET", f"/api/stats/by-category?month={month}"),
+        ("GET", f"/api/stats/summary?month={month}"),
+        ("GET", f"/api/stats/daily?month={month}"),
+        ("GET", f"/api/stats/forecast?month={month}"),
+        ("GET", f"/api/export?format=csv&start={year}-01-01"),
+    ]
+    result = [(f"{m} {p}", m, p, None) for m, p in reads]
+    for message in CHAT_INTENTS:
+        if message != "bench add_record":
+            result.append((f"chat {message.split()[1]}", "POST", "/api/chat", {"message": message}))
+    result += [
+        ("PUT /api/records/<id>", "PUT", f"/api/records/{record_id}",
+         {"category": "餐饮", "amount": 12.5, "note": "bench", "date": f"{month}-01"}),
+        ("POST /api/budgets", "POST", "/api/budgets", {"category": "餐饮", "amount": 1500, "month": month}),
+        ("POST /api/import", "POST", "/api/import",
+         {"rows": [{"日期": f"{month}-{d:02d}", "金额": f"-{d}.50", "备注": "bench"} for d in range(1, 29)]}),
+        ("chat add_record", "POST", "/api/chat", {"message": "bench add_record"}),
+    ]
+    return result
+
+
+class QueryCounter:
+    """Count SQL statements issued by the app through SQLite trace callbacks."""
+
+    SKIP = ("PRAGMA", "BEGIN", "COMMIT", "ROLLBACK")
+
+    def __init__(self):
+        self.count = 0
+        self._last = None
+
+    def __call__(self, sql):
+        # 触发器内的每条语句都会以外层语句（已代入参数）的文本再回调一次，连续重复的只计一次；
+        # executemany 的每一行参数不同，按行计数。连接参数与事务控制语句不计入
+        if sql != self._last and not sql.lstrip().upper().startswith(self.SKIP):
+            self.count += 1
+        self._last = sql
+
+    def mark(self):
+        """Current count, starting a new request (repeats are not merged across it)."""
+        self._last = None
+        return self.count
+
+    def install(self, db_module):
+        connect = db_module.connect
+
+        def traced_connect(*a, **kw):
+            conn = connect(*a, **kw)
+            conn.set_trace_callback(self)
+            return conn
+
+        db_module.connect = traced_connect
+
+
+def stub_llm(args):
+    """Replace the shared LLM client with canned replies (no network)."""
+    from llm import client
+
+    intents = {m: t.format(month=args.end_month, year=args.end_month[:4]) for m, t in CHAT_INTENTS.items()}
+
+    def complete(messages, llm=None, call="chat", timeout=None, **options):
+        if call == "intent":
+            return intents.get(messages[-1]["content"], "意图：chat\n参数：")
+        return "（基准测试桩回复）"
+
+    client.complete = complete
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def run(args):
+    # ⚠️ 必须在导入应用之前设置，db / state 模块在导入时读取这些环境变量
+    workdir = tempfile.mkdtemp(prefix="ai-finance-bench-")
+    db_file = args.db or os.path.join(workdir, "records.db")
+    if os.path.exists(db_file):
+        sys.exit(f"⚠️ {db_file} 已存在，请指定一个新的文件")
+    os.environ["DB_FILE"] = db_file
+    os.environ["STATE_BACKEND"] = "memory"
+    os.environ["LLM_PREWARM"] = "0"
+    os.environ.setdefault("SECRET_KEY", "bench")
+
+    import db
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        db.init_db()
+    conn = db.connect()
+    generate(conn, args)
+    stats = conn.execute("SELECT kind, COUNT(*) FROM transactions GROUP BY kind").fetchall()
+    conn.execute("ANALYZE")
+    conn.close()
+    print(f"🧪 已生成数据（{time.perf_counter() - started:.1f}s）：{args.users} 个用户，"
+          + "，".join(f"{kind} {n} 条" for kind, n in stats) + f"，数据库 {db_file}")
+
+    # 生成数据之后再挂上计数，只统计请求期间的 SQL
+    counter = QueryCounter()
+    counter.install(db)
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        import app as app_module
+        import forecast
+        import handlers
+        from cache import response_cache
+
+    stub_llm(args)
+    client = app_module.app.test_client()
+    assert client.post("/api/login", json={"username": BENCH_USER[0], "password": BENCH_USER[1]}).json["success"]
+    record_id = client.get("/api/records?limit=1").json[0]["id"]
+
+    def clear_caches():
+        if not args.warm:
+            response_cache.clear()
+            handlers.report_cache.clear()
+            forecast.forecast_cache.clear()
+
+    def send(method, path, body):
+        clear_caches()
+        response = client.open(path, method=method, json=body)
+        response.get_data()  # 流式响应要读完才算结束
+        return response.status_code
+
+    results = {}
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        for name, method, path, body in endpoints(args, record_id):
+            for _ in range(args.warmup):
+                send(method, path, body)
+
+            timings, queries, status = [], [], None
+            for _ in range(args.iterations):
+                before = counter.mark()
+                t0 = time.perf_counter()
+                status = send(method, path, body)
+                timings.append((time.perf_counter() - t0) * 1000)
+                queries.append(counter.count - before)
+
+            # 峰值内存单独测一次：tracemalloc 会明显拖慢执行，不能和计时混在一起
+            tracemalloc.start()
+            send(method, path, body)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            timings.sort()
+            results[name] = {
+                "status": status,
+                "p50": round(percentile(timings, 50), 3),
+                "p90": round(percentile(timings, 90), 3),
+                "p99": round(percentile(timings, 99), 3),
+                "mean": round(sum(timings) / len(timings), 3),
+                "queries": round(sum(queries) / len(queries), 1),
+                "peak_kib": round(peak / 1024, 1),
+            }
+    return results
+
+
+def print_results(results):
+    width = max(len(name) for name in results)
+    print(f"{'接口':<{width - 2}}  状态   p50(ms)   p90(ms)   p99(ms)  mean(ms)  SQL/次  峰值(KiB)")
+    for name, r in results.items():
+        print(f"{name:<{width}}  {r['status']:>4}  {r['p50']:>8.2f}  {r['p90']:>8.2f}  {r['p99']:>8.2f}  "
+              f"{r['mean']:>8.2f}  {r['queries']:>6}  {r['peak_kib']:>9.1f}")
+
+
+def compare(results, baseline, threshold):
+    """Print the change against ``baseline``; return the names that regressed.
+
+    An endpoint regresses when its p50 is more than ``threshold`` percent
+    (and at least 0.2 ms) slower, or when it issues more SQL statements.
+    """
+    regressions = []
+    width = max(len(name) for name in results)
+    print(f"\n与基线对比（p50 变慢超过 {threshold:g}% 或 SQL 条数增加视为退化）：")
+    for name, r in results.items():
+        old = baseline.get(name)
+        if old is None:
+            print(f"{name:<{width}}  （基线中没有）")
+            continue
+        delta = (r["p50"] - old["p50"]) / old["p50"] * 100 if old["p50"] else 0.0
+        slower = delta > threshold and r["p50"] - old["p50"] >= 0.2
+        more_queries = r["queries"] > old["queries"]
+        flag = "⚠️ 退化" if slower or more_queries else "✅"
+        if slower or more_queries:
+            regressions.append(name)
+        print(f"{name:<{width}}  p50 {old['p50']:>8.2f} -> {r['p50']:>8.2f} ({delta:+6.1f}%)  "
+              f"SQL {old['queries']:>5} -> {r['queries']:>5}  "
+              f"内存 {old['peak_kib']:>8.1f} -> {r['peak_kib']:>8.1f} KiB  {flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI Finance 接口基准测试")
+    parser.add_argument("--users", type=int, default=20, help="用户数（第 1 个用户用于测试请求）")
+    parser.add_argument("--categories", type=int, default=12, help="每个用户的支出分类数")
+    parser.add_argument("--income-categories", type=int, default=3, help="每个用户的收入分类数")
+    parser.add_argument("--years", type=int, default=3, help="生成多少年的数据")
+    parser.add_argument("--end-month", default=date.today().strftime("%Y-%m"), help="数据的最后一个月，默认本月")
+    parser.add_argument("--records-per-month", type=int, default=60, help="每个用户每月的支出条数")
+    parser.add_argument("--income-per-month", type=int, default=2, help="每个用户每月的收入条数")
+    parser.add_argument("--budgeted", type=int, default=6, help="每月设置预算的分类数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--iterations", type=int, default=30, help="每个接口计时的请求次数")
+    parser.add_argument("--warmup", type=int, default=3, help="每个接口计时前的预热次数")
+    parser.add_argument("--warm", action="store_true", help="保留结果缓存（默认每次请求前清空，测的是实际查询开销）")
+    parser.add_argument("--db", help="数据库文件路径（必须不存在），默认放在临时目录")
+    parser.add_argument("--save", metavar="FILE", help="把结果保存为基线")
+    parser.add_argument("--compare", metavar="FILE", help="与保存的基线对比")
+    parser.add_argument("--threshold", type=float, default=20.0, help="p50 变慢超过该百分比视为退化")
+    args = parser.parse_args()
+
+    params = {k: v for k, v in vars(args).items() if k not in ("db", "save", "compare", "threshold")}
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        changed = {k for k in params if k != "end_month" and baseline["params"].get(k) != params[k]}
+        if changed:
+            print(f"⚠️ 与基线的参数不同：{', '.join(sorted(changed))}，对比结果仅供参考")
+
+    results = run(args)
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"params": params, "python": sys.version.split()[0], "results": results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"\n✅ 基线已保存到 {args.save}")
+    if baseline and compare(results, baseline["results"], args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""按用户数据版本失效的结果缓存。
+
+缓存项记录生成时的数据版本号（db.data_version），读取时版本号不一致即视为失效，
+因此无需在各个写入路径里手动清缓存，多进程部署下也不会读到旧结果。
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "1024"))
+# GET 接口响应缓存的条数，以及单个响应体的大小上限（超过的不缓存，只走 ETag）
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2048"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", "262144"))
+
+CACHE_REQUESTS = metrics.Counter("result_cache_requests_total", "结果缓存命中情况", ("cache", "result"))
+
+
+class VersionedCache:
+    """Thread-safe LRU of ``key -> value`` tagged with the data version it was built from."""
+
+    def __init__(self, name, maxsize=REPORT_CACHE_SIZE):
+        self.name = name
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] != version:
+                del self._data[key]
+                entry = None
+            if entry is not None:
+                self._data.move_to_end(key)
+        CACHE_REQUESTS.inc(cache=self.name, result="miss" if entry is None else "hit")
+        return None if entry is None else entry[1]
+
+    def put(self, key, version, value):
+        with self._lock:
+            self._data[key] = (version, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# GET 接口的响应缓存：(用户, 路径, 查询参数) -> (状态码, 响应头, 响应体)
+response_cache = VersionedCache("response", maxsize=RESPONSE_CACHE_SIZE)
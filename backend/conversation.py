@@ -0,0 +1,222 @@
+"""按用户隔离的对话历史：每个用户一个定长环形缓冲，整体按内存上限做 LRU 淘汰。
+
+多进程部署（STATE_BACKEND=sqlite）时改用 SQLite 共享存储，接口相同。
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import metrics
+from state import STATE_BACKEND, init_state_db, get_state_db, transaction
+
+# 每个用户保留的最近消息条数（user + assistant 各算一条）
+HISTORY_SIZE = int(os.getenv("CHAT_HISTORY_SIZE", "10"))
+# 所有用户历史合计的字符数上限，超出后淘汰最久未活跃的用户
+MAX_CHARS = int(os.getenv("CHAT_HISTORY_MAX_CHARS", "2000000"))
+# 是否把挤出缓冲区的旧消息压缩成一段摘要，随后续对话一起发给 LLM
+COMPACT = os.getenv("CHAT_HISTORY_COMPACT", "1") == "1"
+SUMMARY_MAX_CHARS = int(os.getenv("CHAT_HISTORY_SUMMARY_CHARS", "300"))
+# 压缩时每条旧消息保留的字数
+SNIPPET_CHARS = 40
+
+HISTORY_USERS = metrics.Gauge("chat_history_users", "内存中保有对话历史的用户数")
+HISTORY_CHARS = metrics.Gauge("chat_history_chars", "内存中对话历史的总字符数")
+HISTORY_EVICTIONS = metrics.Counter("chat_history_evictions_total", "因内存上限被淘汰的用户对话数")
+
+ROLE_NAMES = {"user": "用户", "assistant": "助手"}
+
+
+class _Conversation:
+    __slots__ = ("messages", "summary", "chars")
+
+    def __init__(self, size):
+        self.messages = deque(maxlen=size)
+        self.summary = ""
+        self.chars = 0
+
+
+def _snippet(message):
+    text = " ".join(str(message["content"]).split())
+    if len(text) > SNIPPET_CHARS:
+        text = text[:SNIPPET_CHARS] + "…"
+    return f"{ROLE_NAMES.get(message['role'], message['role'])}：{text}"
+
+
+class ConversationStore:
+    """Thread-safe per-user ring buffers of chat messages.
+
+    Each user keeps the last ``size`` messages. When ``compact`` is on,
+    messages pushed out of the buffer are folded into a short running
+    summary instead of being forgotten, so the prompt stays bounded while
+    older context survives. Idle users are evicted least-recently-used
+    first once the total size exceeds ``max_chars``.
+    """
+
+    def __init__(self, size=HISTORY_SIZE, max_chars=MAX_CHARS, compact=COMPACT):
+        self.size = size
+        self.max_chars = max_chars
+        self.compact = compact
+        self.chars = 0
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def append(self, user_id, role, content):
+        message = {"role": role, "content": content}
+        added = len(str(content))
+        with self._lock:
+            conv = self._users.get(user_id)
+            if conv is None:
+                conv = self._users[user_id] = _Conversation(self.size)
+            self._users.move_to_end(user_id)
+
+            if len(conv.messages) == self.size:
+                dropped = conv.messages.popleft()
+                added -= len(str(dropped["content"]))
+                if self.compact:
+                    before = len(conv.summary)
+                    conv.summary = self._fold(conv.summary, dropped)
+                    added += len(conv.summary) - before
+            conv.messages.append(message)
+            conv.chars += added
+            self.chars += added
+            self._evict(keep=user_id)
+            self._report()
+
+    def history(self, user_id):
+        """Messages to send to the LLM: the summary (if any) then recent turns."""
+        with self._lock:
+            conv = self._users.get(user_id)
+            if conv is None:
+                return []
+            self._users.move_to_end(user_id)
+            messages = list(conv.messages)
+            if conv.summary:
+                messages.insert(0, {"role": "system", "content": f"此前对话摘要：{conv.summary}"})
+            return messages
+
+    def clear(self, user_id):
+        with self._lock:
+            conv = self._users.pop(user_id, None)
+            if conv is not None:
+                self.chars -= conv.chars
+            self._report()
+
+    def stats(self):
+        with self._lock:
+            return {"users": len(self._users), "chars": self.chars}
+
+    @staticmethod
+    def _fold(summary, message):
+        # 摘要只保留最近的若干条片段，从最旧的开始截掉
+        parts = [p for p in summary.split("；") if p] + [_snippet(message)]
+        while len(parts) > 1 and len("；".join(parts)) > SUMMARY_MAX_CHARS:
+            parts.pop(0)
+        return "；".join(parts)[-SUMMARY_MAX_CHARS:]
+
+    def _evict(self, keep):
+        while self.chars > self.max_chars and len(self._users) > 1:
+            user_id = next(iter(self._users))
+            if user_id == keep:
+                break
+            self.chars -= self._users.pop(user_id).chars
+            HISTORY_EVICTIONS.inc()
+
+    def _report(self):
+        HISTORY_USERS.set(len(self._users))
+        HISTORY_CHARS.set(self.chars)
+
+
+class SqliteConversationStore:
+    """:class:`ConversationStore` backed by the shared state DB.
+
+    Same ring-buffer, compaction and LRU semantics, but every worker
+    process sees the same conversations. Each append is one
+    ``BEGIN IMMEDIATE`` transaction.
+    """
+
+    def __init__(self, size=HISTORY_SIZE, max_chars=MAX_CHARS, compact=COMPACT):
+        self.size = size
+        self.max_chars = max_chars
+        self.compact = compact
+        init_state_db()
+
+    def append(self, user_id, role, content):
+        content = str(content)
+        with transaction() as conn:
+            conn.execute(
+                "INSERT INTO conversation_users (user_id, last_active) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET last_active = excluded.last_active",
+                (user_id, time.time()),
+            )
+            conn.execute("INSERT INTO conversation_messages (user_id, role, content) VALUES (?, ?, ?)",
+                         (user_id, role, content))
+            # 超出环形缓冲长度的旧消息：删除并折叠进摘要
+            dropped = conn.execute(
+                "SELECT id, role, content FROM conversation_messages WHERE user_id = ? "
+                "ORDER BY id DESC LIMIT -1 OFFSET ?",
+                (user_id, self.size),
+            ).fetchall()
+            summary = conn.execute("SELECT summary FROM conversation_users WHERE user_id = ?",
+                                   (user_id,)).fetchone()["summary"]
+            if dropped:
+                conn.executemany("DELETE FROM conversation_messages WHERE id = ?", [(row["id"],) for row in dropped])
+                if self.compact:
+                    for row in reversed(dropped):
+                        summary = ConversationStore._fold(summary, row)
+            chars = conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(content)), 0) FROM conversation_messages WHERE user_id = ?",
+                (user_id,),
+            ).fetchone()[0] + len(summary)
+            conn.execute("UPDATE conversation_users SET summary = ?, chars = ? WHERE user_id = ?",
+                         (summary, chars, user_id))
+            self._evict(conn, keep=user_id)
+
+    def history(self, user_id):
+        conn = get_state_db()
+        row = conn.execute("SELECT summary FROM conversation_users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return []
+        messages = [
+            {"role": r["role"], "content": r["content"]}
+            for r in conn.execute(
+                "SELECT role, content FROM conversation_messages WHERE user_id = ? ORDER BY id", (user_id,))
+        ]
+        if row["summary"]:
+            messages.insert(0, {"role": "system", "content": f"此前对话摘要：{row['summary']}"})
+        return messages
+
+    def clear(self, user_id):
+        with transaction() as conn:
+            conn.execute("DELETE FROM conversation_messages WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM conversation_users WHERE user_id = ?", (user_id,))
+
+    def stats(self):
+        row = get_state_db().execute(
+            "SELECT COUNT(*) AS users, COALESCE(SUM(chars), 0) AS chars FROM conversation_users").fetchone()
+        return {"users": row["users"], "chars": row["chars"]}
+
+    def _evict(self, conn, keep):
+        total = conn.execute("SELECT COALESCE(SUM(chars), 0) FROM conversation_users").fetchone()[0]
+        if total <= self.max_chars:
+            return
+        for row in conn.execute(
+            "SELECT user_id, chars FROM conversation_users WHERE user_id != ? ORDER BY last_active",
+            (keep,),
+        ).fetchall():
+            conn.execute("DELETE FROM conversation_messages WHERE user_id = ?", (row["user_id"],))
+            conn.execute("DELETE FROM conversation_users WHERE user_id = ?", (row["user_id"],))
+            HISTORY_EVICTIONS.inc()
+            total -= row["chars"]
+            if total <= self.max_chars:
+                break
+
+
+def create_store():
+    if STATE_BACKEND == "sqlite":
+        return SqliteConversationStore()
+    return ConversationStore()
+
+
+# 进程内共享的对话历史（多进程部署时为 SQLite 共享存储）
+conversations = create_store()
@@ -1,22 +1,188 @@
+import os
+import re
 import sqlite3
+import threading
+from datetime import date as _date, datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 
-DB_FILE = 'records.db'
+from flask import g, has_app_context
 
-def get_db():
-    conn = sqlite3.connect(DB_FILE)
+DB_FILE = os.getenv("DB_FILE", "records.db")
+
+# ✅ 连接参数，均可通过环境变量覆盖
+PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-16000")),  # 负数单位为 KiB
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024))),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000")),
+}
+
+# 每个连接池最多保留的空闲连接数
+POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "8"))
+
+
+def connect(readonly=False, path=None):
+    """Open a new connection with the configured pragmas applied."""
+    conn = sqlite3.connect(path or DB_FILE, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    for name, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    if readonly:
+        # 只读连接：WAL 模式下不会阻塞写入方
+        conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+class ConnectionPool:
+    """A small thread-safe pool of idle SQLite connections."""
+
+    def __init__(self, path, readonly=False, size=POOL_SIZE):
+        self.path = path
+        self.readonly = readonly
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return connect(self.readonly, self.path)
+
+    def release(self, conn):
+        # 归还前回滚未提交的事务，避免把锁带给下一个请求
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_pool(readonly=False):
+    key = (DB_FILE, readonly)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(DB_FILE, readonly)
+        return pool
+
+
+def get_db(readonly=False):
+    """Return the connection bound to the current request (or thread).
+
+    Inside a Flask app context the connection is checked out of the pool once
+    per request and returned by ``close_db`` on teardown; elsewhere (scripts,
+    background threads) each thread keeps its own connection.
+    """
+    attr = "_db_ro" if readonly else "_db"
+    if has_app_context():
+        conn = g.get(attr)
+        if conn is None:
+            conn = get_pool(readonly).acquire()
+            setattr(g, attr, conn)
+        return conn
+
+    conn = getattr(_local, attr, None)
+    if conn is None:
+        conn = connect(readonly)
+        setattr(_local, attr, conn)
     return conn
 
+
+def close_db(exc=None):
+    """Return request-scoped connections to their pools (teardown hook)."""
+    for attr, readonly in (("_db", False), ("_db_ro", True)):
+        conn = g.pop(attr, None)
+        if conn is not None:
+            get_pool(readonly).release(conn)
+
+
+# 可接受的日期写法，统一规范化为 YYYY-MM-DD
+DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%Y.%m.%d", "%Y年%m月%d日")
+
+
+def normalize_date(value=None):
+    """Normalize a date string into ``(date, day, month, year)``.
+
+    ``day`` is the proleptic Gregorian ordinal (``date.toordinal()``), an
+    integer that can be range-scanned through the ``(user_id, kind, day)`` index.
+    Empty values default to today; unparseable values raise ``ValueError``.
+    """
+    value = (value or "").strip()
+    if not value:
+        d = _date.today()
+    else:
+        # 去掉时间部分，如 "2025-06-08 12:30:00" / "2025-06-08T12:30"
+        head = value.replace("T", " ").split()[0]
+        for fmt in DATE_FORMATS:
+            try:
+                d = datetime.strptime(head, fmt).date()
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(f"无法识别的日期：{value}")
+    date_str = d.isoformat()
+    return date_str, d.toordinal(), date_str[:7], date_str[:4]
+
+
+def month_range(month):
+    """Return the inclusive ``(first_day, last_day)`` ordinals of ``YYYY-MM``."""
+    year, mon = int(month[:4]), int(month[5:7])
+    first = _date(year, mon, 1).toordinal()
+    nxt = _date(year + 1, 1, 1) if mon == 12 else _date(year, mon + 1, 1)
+    return first, nxt.toordinal() - 1
+
+
+def year_range(year):
+    """Return the inclusive ``(first_day, last_day)`` ordinals of ``YYYY``."""
+    year = int(year)
+    return _date(year, 1, 1).toordinal(), _date(year, 12, 31).toordinal()
+
+
+def to_cents(value):
+    """Parse an amount in yuan (str / int / float) into integer cents, rounding half up."""
+    try:
+        amount = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f"金额格式无效：{value!r}") from None
+    if not amount.is_finite():
+        raise ValueError(f"金额格式无效：{value!r}")
+    return int((amount * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    """Integer cents from the database -> yuan for the API (``None`` stays ``None``)."""
+    return None if cents is None else cents / 100
+
+
 def column_exists(cur, table, column):
     """Check if a column exists in a SQLite table."""
     cur.execute(f"PRAGMA table_info({table})")
     return any(row[1] == column for row in cur.fetchall())
 
 
-def init_db():
-    conn = get_db()
-    cur = conn.cursor()
+def table_exists(cur, table):
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    return cur.fetchone() is not None
+
 
+def _migration_1_base_schema(cur):
     # ✅ 每次启动清空所有表（调试用）
     #cur.execute("DROP TABLE IF EXISTS records")
     #cur.execute("DROP TABLE IF EXISTS budgets")
@@ -92,6 +258,515 @@ def init_db():
         if not column_exists(cur, tbl, "user_id"):
             cur.execute(f"ALTER TABLE {tbl} ADD COLUMN user_id INTEGER")
 
-    conn.commit()
-    conn.close()
 
+def _migration_2_indexes(cur):
+    # ✅ 覆盖索引：按用户 + 月份汇总分类金额时无需回表
+    for tbl in ("records", "income"):
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{tbl}_user_month ON {tbl}(user_id, month, category, amount)")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{tbl}_user_date ON {tbl}(user_id, date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_budgets_user_month ON budgets(user_id, month)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_categories_user_type ON categories(user_id, type, name)")
+
+
+def _migration_3_day_column(cur):
+    # ✅ 新增整数日期列 day，并回填历史数据（同时校正 month / year）
+    for tbl in ("records", "income"):
+        if not column_exists(cur, tbl, "day"):
+            cur.execute(f"ALTER TABLE {tbl} ADD COLUMN day INTEGER")
+
+        rows = cur.execute(f"SELECT id, date, month FROM {tbl}").fetchall()
+        updates = []
+        for row_id, date, month in rows:
+            # 日期缺失或无法识别时退回到该月 1 号
+            for candidate in (date, f"{month}-01" if month else None):
+                if not candidate:
+                    continue
+                try:
+                    updates.append(normalize_date(candidate) + (row_id,))
+                    break
+                except ValueError:
+                    continue
+            else:
+                print(f"⚠️ {tbl} #{row_id} 日期无效，跳过回填：{date!r}")
+        cur.executemany(
+            f"UPDATE {tbl} SET date = ?, day = ?, month = ?, year = ? WHERE id = ?",
+            updates,
+        )
+
+        cur.execute(f"DROP INDEX IF EXISTS idx_{tbl}_user_date")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{tbl}_user_day ON {tbl}(user_id, day)")
+
+
+# 明细表 -> 汇总表中的收支类型（与 categories.type 取值一致）
+ROLLUP_KINDS = {"records": "支出", "income": "收入"}
+
+
+def _rollup_trigger_sql(table, kind, key="category", empty="''"):
+    # key / empty：明细表中的分类列及其缺省值（迁移 8 之后为 category_id / 0）
+    # kind 为 None 时收支类型取自明细行自身的 kind 列（迁移 9 之后的 transactions 表）
+    new_kind, old_kind = (f"'{kind}'", f"'{kind}'") if kind else ("NEW.kind", "OLD.kind")
+    watched = f"user_id, {key}, amount, month" + ("" if kind else ", kind")
+    add = f"""
+        INSERT INTO monthly_totals (user_id, kind, month, {key}, total, cnt)
+        VALUES (NEW.user_id, {new_kind}, COALESCE(NEW.month, ''), COALESCE(NEW.{key}, {empty}), COALESCE(NEW.amount, 0), 1)
+        ON CONFLICT(user_id, kind, month, {key})
+        DO UPDATE SET total = total + excluded.total, cnt = cnt + 1;
+    """
+    remove = f"""
+        UPDATE monthly_totals SET total = total - COALESCE(OLD.amount, 0), cnt = cnt - 1
+        WHERE user_id = OLD.user_id AND kind = {old_kind}
+          AND month = COALESCE(OLD.month, '') AND {key} = COALESCE(OLD.{key}, {empty});
+        DELETE FROM monthly_totals
+        WHERE user_id = OLD.user_id AND kind = {old_kind}
+          AND month = COALESCE(OLD.month, '') AND {key} = COALESCE(OLD.{key}, {empty})
+          AND cnt <= 0;
+    """
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_rollup_insert
+            AFTER INSERT ON {table} WHEN NEW.user_id IS NOT NULL
+            BEGIN {add} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_rollup_delete
+            AFTER DELETE ON {table} WHEN OLD.user_id IS NOT NULL
+            BEGIN {remove} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_rollup_update_old
+            AFTER UPDATE OF {watched} ON {table} WHEN OLD.user_id IS NOT NULL
+            BEGIN {remove} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_rollup_update_new
+            AFTER UPDATE OF {watched} ON {table} WHEN NEW.user_id IS NOT NULL
+            BEGIN {add} END""",
+    ]
+
+
+def _category_key(cur):
+    """Category column of the rollups and its "uncategorized" value for the current schema."""
+    if column_exists(cur, "monthly_totals", "category_id"):
+        return "category_id", "0"
+    return "category", "''"
+
+
+def rebuild_rollups(cur, user_id=None):
+    """Recompute ``monthly_totals`` / ``category_totals`` from the detail tables (drift repair)."""
+    where, args = ("WHERE user_id = ?", (user_id,)) if user_id is not None else ("WHERE user_id IS NOT NULL", ())
+    key, empty = _category_key(cur)
+    cur.execute(f"DELETE FROM monthly_totals {where}", args)
+    # 迁移 9 之后收支同表，一次分组即可；之前按两张明细表分别汇总
+    sources = [("transactions", "kind", "kind, ")] if table_exists(cur, "transactions") \
+        else [(table, f"'{kind}'", "") for table, kind in ROLLUP_KINDS.items()]
+    for table, kind, group_kind in sources:
+        cur.execute(
+            f"""
+            INSERT INTO monthly_totals (user_id, kind, month, {key}, total, cnt)
+            SELECT user_id, {kind}, COALESCE(month, ''), COALESCE({key}, {empty}), SUM(COALESCE(amount, 0)), COUNT(*)
+            FROM {table} {where}
+            GROUP BY user_id, {group_kind}COALESCE(month, ''), COALESCE({key}, {empty})
+            """,
+            args,
+        )
+    if table_exists(cur, "category_totals"):
+        # 历史总额表本由 monthly_totals 上的触发器维护，这里整体重算一次消除累积误差
+        cur.execute(f"DELETE FROM category_totals {where}", args)
+        cur.execute(
+            f"""
+            INSERT INTO category_totals (user_id, kind, {key}, total, cnt)
+            SELECT user_id, kind, {key}, SUM(total), SUM(cnt)
+            FROM monthly_totals {where}
+            GROUP BY user_id, kind, {key}
+            """,
+            args,
+        )
+
+
+def _migration_4_monthly_totals(cur):
+    # ✅ 按 (用户, 收支类型, 月份, 分类) 物化的汇总表，由触发器在同一事务内增量维护
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS monthly_totals (
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,         -- '支出' / '收入'
+            month TEXT NOT NULL,        -- 如 "2025-06"
+            category TEXT NOT NULL,
+            total REAL NOT NULL DEFAULT 0,
+            cnt INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, kind, month, category)
+        ) WITHOUT ROWID
+    """)
+    for table, kind in ROLLUP_KINDS.items():
+        for sql in _rollup_trigger_sql(table, kind):
+            cur.execute(sql)
+    rebuild_rollups(cur)
+
+
+def _migration_5_content_hash(cur):
+    # ✅ 导入去重：(日期, 金额, 备注) 的内容哈希，仅导入的数据会写入该列
+    for tbl in ("records", "income"):
+        if not column_exists(cur, tbl, "content_hash"):
+            cur.execute(f"ALTER TABLE {tbl} ADD COLUMN content_hash TEXT")
+        cur.execute(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{tbl}_user_hash ON {tbl}(user_id, content_hash) "
+            "WHERE content_hash IS NOT NULL"
+        )
+
+
+# 每个用户的数据版本号：这些表的任何写入都会让版本号 +1，供结果缓存判断是否失效
+VERSIONED_TABLES = ("records", "income", "budgets", "categories")
+
+
+def _category_totals_trigger_sql(key="category"):
+    add = f"""
+        INSERT INTO category_totals (user_id, kind, {key}, total, cnt)
+        VALUES (NEW.user_id, NEW.kind, NEW.{key}, NEW.total, NEW.cnt)
+        ON CONFLICT(user_id, kind, {key})
+        DO UPDATE SET total = total + excluded.total, cnt = cnt + excluded.cnt;
+    """
+    remove = f"""
+        UPDATE category_totals SET total = total - OLD.total, cnt = cnt - OLD.cnt
+        WHERE user_id = OLD.user_id AND kind = OLD.kind AND {key} = OLD.{key};
+        DELETE FROM category_totals
+        WHERE user_id = OLD.user_id AND kind = OLD.kind AND {key} = OLD.{key} AND cnt <= 0;
+    """
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS trg_monthly_totals_insert AFTER INSERT ON monthly_totals BEGIN {add} END",
+        f"CREATE TRIGGER IF NOT EXISTS trg_monthly_totals_delete AFTER DELETE ON monthly_totals BEGIN {remove} END",
+        f"CREATE TRIGGER IF NOT EXISTS trg_monthly_totals_update AFTER UPDATE ON monthly_totals "
+        f"BEGIN {remove} {add} END",
+    ]
+
+
+def _version_trigger_sql(table):
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()}
+            AFTER {event} ON {table} WHEN {ref}.user_id IS NOT NULL
+            BEGIN
+                INSERT INTO data_versions (user_id, version) VALUES ({ref}.user_id, 1)
+                ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+            END"""
+        for event, ref in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD"))
+    ]
+
+
+def _migration_6_totals_and_versions(cur):
+    # ✅ 按 (用户, 收支类型, 分类) 的历史累计，由 monthly_totals 上的触发器增量维护
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS category_totals (
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            category TEXT NOT NULL,
+            total REAL NOT NULL DEFAULT 0,
+            cnt INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, kind, category)
+        ) WITHOUT ROWID
+    """)
+    for sql in _category_totals_trigger_sql():
+        cur.execute(sql)
+    cur.execute("""
+        INSERT OR REPLACE INTO category_totals (user_id, kind, category, total, cnt)
+        SELECT user_id, kind, category, SUM(total), SUM(cnt)
+        FROM monthly_totals GROUP BY user_id, kind, category
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS data_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    for table in VERSIONED_TABLES:
+        for sql in _version_trigger_sql(table):
+            cur.execute(sql)
+
+
+def _replace_table(cur, table, create_sql, columns, select_sql):
+    """Swap ``table`` for a new definition, copying its rows.
+
+    Follows SQLite's documented procedure for schema changes ALTER TABLE
+    cannot do: create ``{table}_new``, copy the rows with ``select_sql``
+    (filling ``columns``), drop the old table and rename. Indexes and
+    triggers of the old table are dropped with it; the caller recreates them.
+    """
+    seq = cur.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone() \
+        if table_exists(cur, "sqlite_sequence") else None
+    cur.execute(create_sql)
+    cur.execute(f"INSERT INTO {table}_new ({', '.join(columns)}) {select_sql}")
+    cur.execute(f"DROP TABLE {table}")
+    # 其它表上的触发器可能引用本表，改名时不让 SQLite 校验 / 改写它们
+    cur.execute("PRAGMA legacy_alter_table = ON")
+    cur.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    cur.execute("PRAGMA legacy_alter_table = OFF")
+    if seq is not None:
+        # 保留自增序号，已删除记录的 id 不会被复用
+        cur.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (seq[0], table))
+
+
+def _rebuild_table(cur, table, retype):
+    """Redeclare some columns of ``table`` by rebuilding it, keeping its indexes and triggers.
+
+    ``retype`` maps column -> (new declared type, SQL converting the old value).
+    """
+    create_sql = cur.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                             (table,)).fetchone()[0]
+    dependents = [row[0] for row in cur.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+        (table,),
+    ).fetchall()]
+    columns = [row[1] for row in cur.execute(f"PRAGMA table_info({table})").fetchall()]
+
+    new_sql = re.sub(rf"^CREATE TABLE\s+(IF NOT EXISTS\s+)?\"?{table}\"?", f"CREATE TABLE {table}_new", create_sql)
+    for column, (new_type, _) in retype.items():
+        new_sql = re.sub(rf"\b({column}\s+)[A-Z]+", rf"\g<1>{new_type}", new_sql, count=1)
+    select = ", ".join(retype[c][1] if c in retype else c for c in columns)
+    _replace_table(cur, table, new_sql, columns, f"SELECT {select} FROM {table}")
+    for sql in dependents:
+        cur.execute(sql)
+
+
+def _migration_7_integer_cents(cur):
+    # ✅ 金额改为以「分」为单位的整数存储，汇总求和不再有浮点误差
+    to_int = "CAST(ROUND({} * 100) AS INTEGER)"
+    for table in ("records", "income", "budgets"):
+        _rebuild_table(cur, table, {"amount": ("INTEGER", to_int.format("amount"))})
+    for table in ("monthly_totals", "category_totals"):
+        _rebuild_table(cur, table, {"total": ("INTEGER", to_int.format("total"))})
+    # 汇总值按新的明细重新求和，而不是各自四舍五入
+    rebuild_rollups(cur)
+
+
+# 明细表 -> 迁移 8 之后的表结构；category_id 为 NULL 表示未分类
+LEDGER_COLUMNS = ("id", "user_id", "category_id", "amount", "note", "date", "month", "year", "day", "content_hash")
+
+
+def _migration_8_category_ids(cur):
+    # ✅ 明细表与预算表改为引用 categories.id，分类改名只需更新 categories 一行
+    for table, category_type in (("records", "支出"), ("income", "收入"), ("budgets", "支出")):
+        # 先为只出现在明细里、尚未登记的分类名补建分类
+        cur.execute(f"""
+            INSERT OR IGNORE INTO categories (user_id, name, type)
+            SELECT DISTINCT user_id, category, '{category_type}' FROM {table}
+            WHERE user_id IS NOT NULL AND category IS NOT NULL AND category != ''
+        """)
+
+    for table in ("records", "income"):
+        _replace_table(cur, table, f"""
+            CREATE TABLE {table}_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                category_id INTEGER REFERENCES categories(id),
+                amount INTEGER,    -- 单位：分
+                note TEXT,
+                date TEXT,
+                month TEXT,
+                year TEXT,
+                day INTEGER,
+                content_hash TEXT
+            )
+        """, LEDGER_COLUMNS, f"""
+            SELECT t.id, t.user_id, c.id, t.amount, t.note, t.date, t.month, t.year, t.day, t.content_hash
+            FROM {table} t LEFT JOIN categories c ON c.user_id = t.user_id AND c.name = t.category
+        """)
+        cur.execute(f"CREATE INDEX idx_{table}_user_month ON {table}(user_id, month, category_id, amount)")
+        cur.execute(f"CREATE INDEX idx_{table}_user_day ON {table}(user_id, day)")
+        cur.execute(f"CREATE INDEX idx_{table}_category ON {table}(category_id)")
+        cur.execute(f"CREATE UNIQUE INDEX idx_{table}_user_hash ON {table}(user_id, content_hash) "
+                    "WHERE content_hash IS NOT NULL")
+
+    _replace_table(cur, "budgets", """
+        CREATE TABLE budgets_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            category_id INTEGER REFERENCES categories(id),
+            amount INTEGER,    -- 单位：分
+            cycle TEXT DEFAULT 'monthly',
+            month TEXT,
+            UNIQUE(category_id, month, user_id)
+        )
+    """, ("id", "user_id", "category_id", "amount", "cycle", "month"), """
+        SELECT b.id, b.user_id, c.id, b.amount, b.cycle, b.month
+        FROM budgets b LEFT JOIN categories c ON c.user_id = b.user_id AND c.name = b.category
+    """)
+    cur.execute("CREATE INDEX idx_budgets_user_month ON budgets(user_id, month)")
+
+    # 汇总表改为按 category_id 汇总（0 表示未分类），随后整体重算
+    cur.execute("DROP TABLE monthly_totals")
+    cur.execute("DROP TABLE category_totals")
+    cur.execute("""
+        CREATE TABLE monthly_totals (
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,         -- '支出' / '收入'
+            month TEXT NOT NULL,        -- 如 "2025-06"
+            category_id INTEGER NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            cnt INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, kind, month, category_id)
+        ) WITHOUT ROWID
+    """)
+    cur.execute("""
+        CREATE TABLE category_totals (
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            category_id INTEGER NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            cnt INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, kind, category_id)
+        ) WITHOUT ROWID
+    """)
+    for sql in _category_totals_trigger_sql("category_id"):
+        cur.execute(sql)
+    for table, kind in ROLLUP_KINDS.items():
+        for sql in _rollup_trigger_sql(table, kind, "category_id", "0"):
+            cur.execute(sql)
+    for table in ("records", "income", "budgets"):
+        for sql in _version_trigger_sql(table):
+            cur.execute(sql)
+    rebuild_rollups(cur)
+
+
+def _ledger_view_sql(view, kind):
+    # 兼容视图：按 kind 过滤出原来的 records / income，写入由 INSTEAD OF 触发器转到 transactions
+    columns = ", ".join(LEDGER_COLUMNS)
+    values = ", ".join(f"NEW.{c}" for c in LEDGER_COLUMNS)
+    updates = ", ".join(f"{c} = NEW.{c}" for c in LEDGER_COLUMNS)
+    return [
+        f"CREATE VIEW {view} AS SELECT {columns} FROM transactions WHERE kind = '{kind}'",
+        f"""CREATE TRIGGER trg_{view}_view_insert INSTEAD OF INSERT ON {view}
+            BEGIN INSERT INTO transactions (kind, {columns}) VALUES ('{kind}', {values}); END""",
+        f"""CREATE TRIGGER trg_{view}_view_update INSTEAD OF UPDATE ON {view}
+            BEGIN UPDATE transactions SET {updates} WHERE id = OLD.id; END""",
+        f"""CREATE TRIGGER trg_{view}_view_delete INSTEAD OF DELETE ON {view}
+            BEGIN DELETE FROM transactions WHERE id = OLD.id; END""",
+    ]
+
+
+def _migration_9_transactions(cur):
+    # ✅ 支出与收入合并为一张 transactions 表（kind 区分），统计接口一次分组即可同时得到两侧
+    cur.execute("""
+        CREATE TABLE transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            kind TEXT NOT NULL CHECK (kind IN ('支出', '收入')),
+            category_id INTEGER REFERENCES categories(id),
+            amount INTEGER,    -- 单位：分
+            note TEXT,
+            date TEXT,
+            month TEXT,
+            year TEXT,
+            day INTEGER,
+            content_hash TEXT
+        )
+    """)
+
+    # 支出保留原 id；收入 id 整体后移到支出已用过的最大 id 之后，避免冲突
+    def last_id(table):
+        seq = cur.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+        top = cur.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0]
+        return max(seq[0] if seq else 0, top or 0)
+
+    offset = last_id("records")
+    last = offset + last_id("income")
+    columns = ", ".join(LEDGER_COLUMNS)
+    rest = ", ".join(LEDGER_COLUMNS[1:])
+    cur.execute(f"INSERT INTO transactions (kind, {columns}) SELECT '支出', {columns} FROM records")
+    cur.execute(f"INSERT INTO transactions (kind, {columns}) SELECT '收入', id + ?, {rest} FROM income", (offset,))
+    cur.execute("DROP TABLE records")
+    cur.execute("DROP TABLE income")
+    cur.execute("DELETE FROM sqlite_sequence WHERE name IN ('records', 'income', 'transactions')")
+    if last:
+        # 自增序号接在两张旧表用过的最大 id 之后，已删除记录的 id 不会被复用
+        cur.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('transactions', ?)", (last,))
+
+    # 按类型的复合索引：kind 紧跟 user_id，单侧查询与两侧一起分组都能走索引
+    cur.execute("CREATE INDEX idx_transactions_user_month ON transactions(user_id, kind, month, category_id, amount)")
+    cur.execute("CREATE INDEX idx_transactions_user_day ON transactions(user_id, kind, day)")
+    cur.execute("CREATE INDEX idx_transactions_category ON transactions(category_id)")
+    cur.execute("CREATE UNIQUE INDEX idx_transactions_user_hash ON transactions(user_id, kind, content_hash) "
+                "WHERE content_hash IS NOT NULL")
+
+    for sql in _rollup_trigger_sql("transactions", None, "category_id", "0"):
+        cur.execute(sql)
+    for sql in _version_trigger_sql("transactions"):
+        cur.execute(sql)
+    for view, kind in ROLLUP_KINDS.items():
+        for sql in _ledger_view_sql(view, kind):
+            cur.execute(sql)
+    # 收入 id 已变化：让各用户的数据版本 +1，旧的 ETag / 缓存响应全部失效
+    cur.execute("UPDATE data_versions SET version = version + 1")
+
+
+def category_ref(conn, user_id, name, category_type=None):
+    """Return ``(id, type)`` of the user's category ``name``, or ``None``.
+
+    With ``category_type`` a missing category is created with that type
+    (not committed; the caller's transaction covers it).
+    """
+    row = conn.execute("SELECT id, type FROM categories WHERE user_id = ? AND name = ?", (user_id, name)).fetchone()
+    if row is not None:
+        return row["id"], row["type"]
+    if category_type is None:
+        return None
+    cursor = conn.execute("INSERT INTO categories (user_id, name, type) VALUES (?, ?, ?)",
+                          (user_id, name, category_type))
+    return cursor.lastrowid, category_type
+
+
+def data_version(conn, user_id):
+    """Current data version of ``user_id``; changes on every write to their data."""
+    row = conn.execute("SELECT version FROM data_versions WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row else 0
+
+
+# 按顺序执行的迁移列表，第 N 个迁移完成后 PRAGMA user_version = N
+# ⚠️ 只允许在末尾追加，不要修改已发布的迁移
+MIGRATIONS = [
+    _migration_1_base_schema,
+    _migration_2_indexes,
+    _migration_3_day_column,
+    _migration_4_monthly_totals,
+    _migration_5_content_hash,
+    _migration_6_totals_and_versions,
+    _migration_7_integer_cents,
+    _migration_8_category_ids,
+    _migration_9_transactions,
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def init_db():
+    conn = connect()
+    try:
+        # ✅ 已是最新版本时直接返回，启动无需探测表结构
+        if schema_version(conn) >= len(MIGRATIONS):
+            return
+
+        while True:
+            # 每个迁移单独一个写事务；拿到写锁后重新读取版本，避免并发进程重复执行
+            conn.execute("BEGIN IMMEDIATE")
+            version = schema_version(conn)
+            if version >= len(MIGRATIONS):
+                conn.commit()
+                break
+            cur = conn.cursor()
+            MIGRATIONS[version](cur)
+            cur.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+            print(f"🛠 数据库已迁移到版本 {version + 1}")
+    finally:
+        conn.close()
+
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="AI Finance 数据库维护工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_rebuild = sub.add_parser("rebuild-rollups", help="根据明细表重建 monthly_totals 汇总表")
+    p_rebuild.add_argument("--user", type=int, help="只重建指定用户")
+    args = parser.parse_args()
+
+    init_db()
+    if args.command == "rebuild-rollups":
+        conn = connect()
+        with conn:
+            rebuild_rollups(conn.cursor(), args.user)
+        conn.close()
+        print("✅ 汇总表已重建")
@@ -0,0 +1,241 @@
+"""账本导出：从数据库游标流式输出 CSV / NDJSON / 列式文件。
+
+列式格式优先使用 Arrow IPC stream（需安装 pyarrow），否则退回到下面的
+紧凑二进制格式（AFC1，全部为小端序）：
+
+    b"AFC1" | uint32 头部长度 | 头部 JSON（table、columns: [{name, type}]）
+    重复若干批次：
+        uint32 行数 n（为 0 表示结束）
+        每一列依次写入：
+            n 字节的有效位（1 = 有值，0 = NULL）
+            int64 / float64 列：n 个 8 字节数值
+            utf8 列：n + 1 个 uint32 偏移量 + UTF-8 字节串
+"""
+import csv
+import io
+import json
+import struct
+import sys
+from array import array
+from datetime import datetime
+
+from db import connect, normalize_date
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - pyarrow 为可选依赖
+    pa = None
+
+# 每次从游标取出的行数，决定了导出时的内存上限
+BATCH_SIZE = 500
+
+# 可导出的表：(列名, 列类型)
+EXPORT_TABLES = {
+    "records": [("id", "int64"), ("category", "utf8"), ("amount", "float64"), ("note", "utf8"),
+                ("date", "utf8"), ("month", "utf8"), ("year", "utf8")],
+    "income": [("id", "int64"), ("category", "utf8"), ("amount", "float64"), ("note", "utf8"),
+               ("date", "utf8"), ("month", "utf8"), ("year", "utf8")],
+    "budgets": [("id", "int64"), ("category", "utf8"), ("amount", "float64"), ("cycle", "utf8"),
+                ("month", "utf8")],
+    "categories": [("id", "int64"), ("name", "utf8"), ("type", "utf8")],
+}
+
+EXPORT_FORMATS = ("csv", "ndjson", "columnar")
+
+
+def build_query(table, user_id, start=None, end=None, categories=None):
+    """Build the filtered SELECT for ``table``; filters are applied in SQL."""
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"不支持导出的表：{table}")
+    # 金额以分存储，导出时换算成元；分类名通过 category_id 关联取出
+    expressions = {"amount": "t.amount / 100.0 AS amount", "category": "c.name AS category"}
+    columns = ", ".join(expressions.get(name, f"t.{name}") for name, _ in EXPORT_TABLES[table])
+    query = f"SELECT {columns} FROM {table} t"
+    if table != "categories":
+        query += " LEFT JOIN categories c ON c.id = t.category_id"
+    query += " WHERE t.user_id = ?"
+    args = [user_id]
+
+    if table in ("records", "income"):
+        if start:
+            query += " AND t.day >= ?"
+            args.append(normalize_date(start)[1])
+        if end:
+            query += " AND t.day <= ?"
+            args.append(normalize_date(end)[1])
+    elif table == "budgets":
+        if start:
+            query += " AND t.month >= ?"
+            args.append(normalize_date(start)[2])
+        if end:
+            query += " AND t.month <= ?"
+            args.append(normalize_date(end)[2])
+
+    if categories:
+        column = "t.name" if table == "categories" else "c.name"
+        query += f" AND {column} IN ({', '.join('?' for _ in categories)})"
+        args.extend(categories)
+
+    query += " ORDER BY t.day, t.id" if table in ("records", "income") else " ORDER BY t.id"
+    return query, args
+
+
+def iter_batches(conn, table, user_id, **filters):
+    """Yield lists of rows (tuples) straight from a cursor, BATCH_SIZE at a time."""
+    query, args = build_query(table, user_id, **filters)
+    cursor = conn.execute(query, args)
+    while True:
+        rows = cursor.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+        yield [tuple(row) for row in rows]
+
+
+def export_csv(batches, table):
+    names = [name for name, _ in EXPORT_TABLES[table]]
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(names)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def export_ndjson(batches, table):
+    names = [name for name, _ in EXPORT_TABLES[table]]
+    for rows in batches:
+        yield "".join(json.dumps(dict(zip(names, row)), ensure_ascii=False) + "\n" for row in rows)
+
+
+class _ChunkSink:
+    """Minimal writable file object that hands written bytes back to a generator."""
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+
+def _export_arrow(batches, table):
+    arrow_types = {"int64": pa.int64(), "float64": pa.float64(), "utf8": pa.string()}
+    schema = pa.schema([(name, arrow_types[kind]) for name, kind in EXPORT_TABLES[table]])
+    sink = _ChunkSink()
+    with pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema) as writer:
+        for rows in batches:
+            columns = list(zip(*rows))
+            writer.write_batch(pa.record_batch(
+                [pa.array(col, type=field.type) for col, field in zip(columns, schema)],
+                schema=schema,
+            ))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def _export_afc(batches, table):
+    spec = EXPORT_TABLES[table]
+    header = json.dumps({"table": table, "columns": [{"name": n, "type": t} for n, t in spec]},
+                        ensure_ascii=False).encode("utf-8")
+    yield b"AFC1" + struct.pack("<I", len(header)) + header
+
+    for rows in batches:
+        out = [struct.pack("<I", len(rows))]
+        for idx, (_, kind) in enumerate(spec):
+            values = [row[idx] for row in rows]
+            out.append(bytes(v is not None for v in values))
+            if kind == "utf8":
+                offsets, blob = array("I", [0]), bytearray()
+                for v in values:
+                    if v is not None:
+                        blob += str(v).encode("utf-8")
+                    offsets.append(len(blob))
+                out.append(_little_endian(offsets).tobytes() + bytes(blob))
+            else:
+                typecode, cast = ("q", int) if kind == "int64" else ("d", float)
+                out.append(_little_endian(array(typecode, (cast(v) if v is not None else 0 for v in values))).tobytes())
+        yield b"".join(out)
+    yield struct.pack("<I", 0)
+
+
+def _little_endian(arr):
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr
+
+
+def export_columnar(batches, table):
+    return _export_arrow(batches, table) if pa is not None else _export_afc(batches, table)
+
+
+def columnar_info():
+    """Return ``(extension, mimetype)`` of the columnar format in use."""
+    if pa is not None:
+        return "arrow", "application/vnd.apache.arrow.stream"
+    return "afc", "application/octet-stream"
+
+
+def export(conn, table, user_id, fmt="csv", **filters):
+    """Return a generator of str/bytes chunks for the requested export."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式：{fmt}")
+    # 先构造一次查询，让表名、日期等参数错误在开始输出前就暴露出来
+    build_query(table, user_id, **filters)
+    batches = iter_batches(conn, table, user_id, **filters)
+    if fmt == "csv":
+        return export_csv(batches, table)
+    if fmt == "ndjson":
+        return export_ndjson(batches, table)
+    return export_columnar(batches, table)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="导出 AI Finance 账本数据")
+    who = parser.add_mutually_exclusive_group(required=True)
+    who.add_argument("--user", type=int, help="用户 ID")
+    who.add_argument("--username", help="用户名")
+    parser.add_argument("--table", choices=EXPORT_TABLES, default="records")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--start", help="起始日期（含），如 2025-01-01")
+    parser.add_argument("--end", help="结束日期（含），如 2025-06-30")
+    parser.add_argument("--category", action="append", help="只导出指定分类，可重复")
+    parser.add_argument("--out", help="输出文件，默认写到标准输出")
+    args = parser.parse_args()
+
+    conn = connect(readonly=True)
+    user_id = args.user
+    if args.username:
+        row = conn.execute("SELECT id FROM users WHERE username = ?", (args.username,)).fetchone()
+        if not row:
+            sys.exit(f"用户「{args.username}」不存在")
+        user_id = row["id"]
+
+    chunks = export(conn, args.table, user_id, args.format,
+                    start=args.start, end=args.end, categories=args.category)
+    binary = args.format == "columnar"
+    if args.out:
+        out = open(args.out, "wb" if binary else "w", encoding=None if binary else "utf-8", newline=None if binary else "")
+    else:
+        out = sys.stdout.buffer if binary else sys.stdout
+    started = datetime.now()
+    for chunk in chunks:
+        out.write(chunk)
+    out.flush()
+    if args.out:
+        out.close()
+        print(f"✅ 已导出到 {args.out}，耗时 {(datetime.now() - started).total_seconds():.2f}s", file=sys.stderr)
@@ -0,0 +1,120 @@
+"""预算建议的本地特征提取：把历史支出压缩成按分类的月度统计表，而不是把原始记录发给 LLM。"""
+import os
+import re
+from datetime import date
+
+import numpy as np
+
+# 参与统计的最近完整月份数（不含当月：未过完的月份会拉低月均、中位数和趋势）
+FEATURE_MONTHS = int(os.getenv("BUDGET_FEATURE_MONTHS", "6"))
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text):
+    """Rough token estimate: ~0.6 token per CJK char, ~4 chars per token otherwise."""
+    cjk = len(_CJK_RE.findall(text))
+    return int(cjk * 0.6 + (len(text) - cjk) / 4) + 1
+
+
+def window_months(months=FEATURE_MONTHS, today=None):
+    """The last ``months`` complete month labels ('YYYY-MM'), oldest first, ending last month."""
+    today = today or date.today()
+    index = today.year * 12 + today.month - 2
+    return [f"{i // 12:04d}-{i % 12 + 1:02d}" for i in range(index - months + 1, index + 1)]
+
+
+def monthly_matrix(conn, user_id, months):
+    """Return ``(categories, matrix)``: spend per expense category (rows) per month (columns).
+
+    ``categories`` is a list of ``(category_id, name)`` sorted by name. Read
+    from the ``monthly_totals`` rollup, so the cost does not grow with the
+    number of records.
+    """
+    rows = conn.execute(
+        """
+        SELECT t.category_id, c.name, t.month, t.total
+        FROM monthly_totals t
+        JOIN categories c ON c.id = t.category_id AND c.type = '支出'
+        WHERE t.user_id = ? AND t.kind = '支出' AND t.month BETWEEN ? AND ?
+        """,
+        (user_id, months[0], months[-1]),
+    ).fetchall()
+    categories = sorted({(row["category_id"], row["name"]) for row in rows}, key=lambda c: c[1])
+    cat_index = {cid: i for i, (cid, _) in enumerate(categories)}
+    month_index = {m: i for i, m in enumerate(months)}
+    matrix = np.zeros((len(categories), len(months)))
+    for row in rows:
+        matrix[cat_index[row["category_id"]], month_index[row["month"]]] = row["total"] / 100  # 分 -> 元
+    return categories, matrix
+
+
+def spend_features(conn, user_id, months=FEATURE_MONTHS, today=None):
+    """Per-category spending statistics over the window, computed for all categories at once.
+
+    For every category: months with spend, total, mean / median monthly
+    spend, last month's spend, trend (least-squares slope in yuan per
+    month) and volatility (coefficient of variation).
+    """
+    labels = window_months(months, today)
+    categories, m = monthly_matrix(conn, user_id, labels)
+    if not categories:
+        return labels, []
+
+    x = np.arange(len(labels), dtype=float)
+    x -= x.mean()
+    total = m.sum(axis=1)
+    mean = m.mean(axis=1)
+    median = np.median(m, axis=1)
+    std = m.std(axis=1)
+    active = np.count_nonzero(m, axis=1)
+    slope = (m - mean[:, None]) @ x / (x @ x) if len(labels) > 1 else np.zeros(len(categories))
+    volatility = np.divide(std, mean, out=np.zeros_like(std), where=mean > 0)
+
+    features = []
+    for i, (category_id, name) in enumerate(categories):
+        features.append({
+            "category_id": category_id,
+            "category": name,
+            "active_months": int(active[i]),
+            "total": round(float(total[i]), 2),
+            "mean": round(float(mean[i]), 2),
+            "median": round(float(median[i]), 2),
+            "last": round(float(m[i, -1]), 2),
+            "trend": round(float(slope[i]), 2),
+            "volatility": round(float(volatility[i]), 2),
+        })
+    features.sort(key=lambda f: f["total"], reverse=True)
+    return labels, features
+
+
+def format_features(labels, features):
+    """Compact text table for the prompt, one line per category."""
+    lines = [
+        f"统计区间：{labels[0]} 至 {labels[-1]}（共 {len(labels)} 个月，金额单位：元）",
+        "分类|有支出月数|合计|月均|月中位数|最近一月|趋势(元/月)|波动系数",
+    ]
+    for f in features:
+        lines.append(
+            f"{f['category']}|{f['active_months']}|{f['total']:.2f}|{f['mean']:.2f}|{f['median']:.2f}|"
+            f"{f['last']:.2f}|{f['trend']:+.2f}|{f['volatility']:.2f}"
+        )
+    return "\n".join(lines)
+
+
+def raw_history_tokens(conn, user_id):
+    """Estimated tokens of the old prompt that embedded every record as JSON.
+
+    Computed with one aggregate query instead of loading the records.
+    """
+    row = conn.execute(
+        """
+        SELECT COUNT(*) AS n,
+               COALESCE(SUM(LENGTH(c.name)), 0) AS cat_chars,
+               COALESCE(SUM(LENGTH(CAST(r.amount / 100.0 AS TEXT)) + LENGTH(r.date)), 0) AS other_chars
+        FROM records r LEFT JOIN categories c ON c.id = r.category_id WHERE r.user_id = ?
+        """,
+        (user_id,),
+    ).fetchone()
+    # 每条形如 {"category": "餐饮", "amount": 25.5, "date": "2025-06-08"}, 固定部分约 40 个 ASCII 字符
+    return int(row["cat_chars"] * 0.6 + (row["other_chars"] + 40 * row["n"]) / 4)
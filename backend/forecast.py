@@ -0,0 +1,289 @@
+"""支出预测与异常检测：一次取出用户的全部支出明细，用 NumPy 在整段历史上向量化计算。
+
+月底预测、滚动均值、与往月 / 去年同期的对比以及异常交易都在 (分类 × 天) 的矩阵上一次算完，
+不按分类或按天循环。计算放在独立的线程池里执行，结果按用户数据版本缓存。
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import date
+
+import numpy as np
+
+from cache import VersionedCache
+from db import get_db, data_version, month_range
+
+FORECAST_WORKERS = int(os.getenv("FORECAST_WORKERS", "2"))
+# 请求线程最多等待计算结果的秒数，超时返回 202，计算继续在后台完成并写入缓存
+FORECAST_WAIT = float(os.getenv("FORECAST_WAIT", "5"))
+# 异常判定：z 分数阈值、IQR 上界系数，以及分类至少要有的历史交易笔数
+Z_THRESHOLD = float(os.getenv("FORECAST_Z_THRESHOLD", "3"))
+IQR_K = float(os.getenv("FORECAST_IQR_K", "3"))
+MIN_HISTORY = int(os.getenv("FORECAST_MIN_HISTORY", "8"))
+# 用于月底预测的历史日均窗口（天）
+TRAILING_DAYS = 90
+MAX_OUTLIERS = 20
+
+_UNIX_EPOCH = date(1970, 1, 1).toordinal()
+
+forecast_cache = VersionedCache("forecast")
+_executor = ThreadPoolExecutor(max_workers=FORECAST_WORKERS, thread_name_prefix="forecast")
+_pending = {}  # (缓存键, 数据版本) -> 正在计算的 Future，同一份结果只算一次
+_pending_lock = threading.Lock()
+
+
+def _yuan(values):
+    """Cents (scalar or array) -> yuan rounded to 2 decimals, as Python floats."""
+    return np.round(np.asarray(values, dtype=float) / 100, 2).tolist()
+
+
+def _pct_change(new, old):
+    """Element-wise percent change; ``None`` where the old value is 0."""
+    out = np.divide(new - old, old, out=np.full(np.shape(new), np.nan), where=old > 0) * 100
+    return [None if np.isnan(v) else round(float(v), 1) + 0.0 for v in np.atleast_1d(out)]
+
+
+def _rolling_mean(series, window):
+    """Trailing ``window``-day mean along the last axis (days before the series count as 0)."""
+    padded = np.concatenate([np.zeros(series.shape[:-1] + (window,)), series], axis=-1)
+    cs = np.cumsum(padded, axis=-1)
+    return (cs[..., window:] - cs[..., :-window]) / window
+
+
+def _group_quantiles(groups, values, counts, qs):
+    """Linear-interpolated quantiles of ``values`` within each group, for all groups at once.
+
+    ``groups`` are dense indices 0..len(counts)-1; groups without values get 0.
+    """
+    order = np.lexsort((values, groups))
+    ordered = values[order].astype(float)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    result = []
+    for q in qs:
+        pos = starts + q * np.maximum(counts - 1, 0)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.ceil(pos).astype(np.int64)
+        if len(ordered):
+            lo, hi = np.minimum(lo, len(ordered) - 1), np.minimum(hi, len(ordered) - 1)
+            value = ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+        else:
+            value = np.zeros(len(counts))
+        result.append(np.where(counts > 0, value, 0.0))
+    return result
+
+
+def compute_forecast(conn, user_id, month, today=None):
+    """Spending forecast and anomalies for ``month`` ('YYYY-MM') as of ``today``.
+
+    For every expense category: spend so far, month-end projection (current
+    run rate blended with the trailing 90-day daily mean, weighted by how
+    much of the month has passed), budget usage, 7 / 30-day rolling means,
+    change vs. the prior 3 months and the same month last year, and a
+    seasonal index. Transactions of the month are flagged when their amount
+    is more than ``Z_THRESHOLD`` standard deviations above, or ``IQR_K``
+    IQRs above the third quartile of, the category's earlier history.
+    """
+    today = today or date.today()
+    first, last = month_range(month)
+    days_in_month = last - first + 1
+    as_of = min(today.toordinal(), last)
+    elapsed = max(as_of - first + 1, 0)  # 未来月份为 0，按今天之前的历史预测
+
+    names = {row["id"]: row["name"] for row in conn.execute(
+        "SELECT id, name FROM categories WHERE user_id = ? AND type = '支出'", (user_id,))}
+    budget_rows = conn.execute(
+        "SELECT COALESCE(category_id, 0), amount FROM budgets WHERE user_id = ? AND month = ?", (user_id, month)
+    ).fetchall()
+    rows = conn.execute(
+        "SELECT id, COALESCE(category_id, 0), day, amount FROM transactions "
+        "WHERE user_id = ? AND kind = '支出' AND day <= ? AND amount IS NOT NULL",
+        (user_id, as_of),
+    ).fetchall()
+
+    result = {
+        "month": month,
+        "as_of": date.fromordinal(as_of).isoformat(),
+        "days_elapsed": elapsed,
+        "days_in_month": days_in_month,
+        "total": None,
+        "categories": [],
+        "daily": [],
+        "outliers": [],
+    }
+    if not rows:
+        return result
+
+    data = np.array([tuple(r) for r in rows], dtype=np.int64)
+    ids, cat_ids, days, amounts = data.T
+    categories, cat_idx = np.unique(cat_ids, return_inverse=True)
+    n_cat = len(categories)
+
+    # ===== (分类 × 天) 日支出矩阵，从最早一笔所在月的 1 号到 as_of =====
+    first_month = (np.datetime64(int(days.min()) - _UNIX_EPOCH, "D").astype("datetime64[M]")
+                   .astype("datetime64[D]").astype(np.int64) + _UNIX_EPOCH)
+    origin = int(first_month)
+    n_days = as_of - origin + 1
+    daily = np.zeros((n_cat, n_days))
+    np.add.at(daily, (cat_idx, days - origin), amounts)
+
+    # 每一列所在的月份（自 1970-01 起的月序号），按月边界 reduceat 得到 (分类 × 月) 矩阵
+    month_ids = (np.arange(origin, as_of + 1) - _UNIX_EPOCH).astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, np.diff(month_ids) != 0])
+    monthly = np.add.reduceat(daily, starts, axis=1)
+    column_months = month_ids[starts]
+    target_month = np.datetime64(month, "M").astype(np.int64)
+    has_target = elapsed > 0 and column_months[-1] == target_month
+    # 往月基线只用完整月份：目标月本身，或预测未来月份时尚未过完的当月都不算
+    tail_partial = np.datetime64(as_of + 1 - _UNIX_EPOCH, "D").astype("datetime64[M]").astype(np.int64) == month_ids[-1]
+    prior = monthly[:, :-1] if has_target or tail_partial else monthly
+
+    # ===== 月底预测 =====
+    spent = monthly[:, -1] if has_target else np.zeros(n_cat)
+    before = n_days - elapsed  # 本月之前的天数
+    window = daily[:, max(0, before - TRAILING_DAYS):before]
+    trailing_rate = window.mean(axis=1) if window.shape[1] else np.zeros(n_cat)
+    run_rate = spent / elapsed if elapsed > 0 else np.zeros(n_cat)
+    weight = elapsed / days_in_month
+    projected = spent + (days_in_month - elapsed) * (weight * run_rate + (1 - weight) * trailing_rate)
+
+    budgets = np.zeros(n_cat)
+    has_budget = np.zeros(n_cat, dtype=bool)
+    position = {int(c): i for i, c in enumerate(categories)}
+    for category_id, amount in budget_rows:
+        if category_id in position:
+            budgets[position[category_id]] = amount or 0
+            has_budget[position[category_id]] = True
+
+    # ===== 滚动均值（按分类与合计）=====
+    roll7, roll30 = _rolling_mean(daily, 7), _rolling_mean(daily, 30)
+    total_daily = daily.sum(axis=0)
+    total7, total30 = _rolling_mean(total_daily, 7), _rolling_mean(total_daily, 30)
+
+    # ===== 与往月 / 去年同期对比、季节性指数 =====
+    prior3 = prior[:, -3:].mean(axis=1) if prior.shape[1] else np.zeros(n_cat)
+    last_year_col = len(column_months) - 1 - 12 if has_target else None
+    last_year = monthly[:, last_year_col] if last_year_col is not None and last_year_col >= 0 else None
+    seasonal = None
+    if prior.shape[1] >= 12:
+        # 历史上同一日历月的月均 / 全部月份的月均；首月可能不完整，不参与
+        full = prior[:, 1:]
+        same = (column_months[1:prior.shape[1]] % 12) == target_month % 12
+        overall = full.mean(axis=1)
+        seasonal = np.divide(full[:, same].mean(axis=1), overall, out=np.full(n_cat, np.nan),
+                             where=(overall > 0) & same.any())
+
+    # ===== 异常交易：用本月之前的历史做基线 =====
+    base = days < first
+    counts = np.bincount(cat_idx[base], minlength=n_cat)
+    sums = np.bincount(cat_idx[base], weights=amounts[base], minlength=n_cat)
+    sq = np.bincount(cat_idx[base], weights=amounts[base].astype(float) ** 2, minlength=n_cat)
+    mean = np.divide(sums, counts, out=np.zeros(n_cat), where=counts > 0)
+    std = np.sqrt(np.maximum(np.divide(sq, counts, out=np.zeros(n_cat), where=counts > 0) - mean ** 2, 0))
+    q1, q3 = _group_quantiles(cat_idx[base], amounts[base], counts, (0.25, 0.75))
+    fence = q3 + IQR_K * (q3 - q1)
+
+    current = ~base
+    c = cat_idx[current]
+    z = np.divide(amounts[current] - mean[c], std[c], out=np.zeros(current.sum()), where=std[c] > 0)
+    flagged = (counts[c] >= MIN_HISTORY) & ((z > Z_THRESHOLD) | (amounts[current] > fence[c]))
+    order = np.argsort(-z[flagged], kind="stable")[:MAX_OUTLIERS]
+    outlier_ids = ids[current][flagged][order]
+    details = {}
+    if len(outlier_ids):
+        marks = ",".join("?" * len(outlier_ids))
+        details = {row["id"]: row for row in conn.execute(
+            f"SELECT id, date, note FROM transactions WHERE id IN ({marks})", [int(i) for i in outlier_ids])}
+    for i, tx_id, amount, score in zip(c[flagged][order], outlier_ids, amounts[current][flagged][order],
+                                       z[flagged][order]):
+        row = details.get(int(tx_id))
+        result["outliers"].append({
+            "id": int(tx_id),
+            "date": row["date"] if row else None,
+            "category": names.get(int(categories[i]), ""),
+            "amount": round(int(amount) / 100, 2),
+            "note": row["note"] if row else None,
+            "z": round(float(score), 2),
+            "typical": round(float(mean[i]) / 100, 2),
+            "upper_fence": round(float(fence[i]) / 100, 2),
+        })
+
+    # ===== 组装结果 =====
+    spent_y, projected_y, budgets_y = _yuan(spent), _yuan(projected), _yuan(budgets)
+    prior3_y, roll7_y, roll30_y = _yuan(prior3), _yuan(roll7[:, -1]), _yuan(roll30[:, -1])
+    vs_prior = _pct_change(projected, prior3)
+    vs_last_year = _pct_change(projected, last_year) if last_year is not None else [None] * n_cat
+    used = np.round(np.divide(projected, budgets, out=np.zeros(n_cat), where=budgets > 0) * 100, 1).tolist()
+    for i, category_id in enumerate(categories):
+        if not (spent[i] or projected[i] or prior3[i]):
+            continue
+        result["categories"].append({
+            "category_id": int(category_id),
+            "category": names.get(int(category_id), ""),
+            "spent": spent_y[i],
+            "projected": projected_y[i],
+            "budget": budgets_y[i] if has_budget[i] else None,
+            "projected_budget_pct": used[i] if has_budget[i] and budgets[i] > 0 else None,
+            "over_budget": bool(has_budget[i] and projected[i] > budgets[i]),
+            "rolling_7": roll7_y[i],
+            "rolling_30": roll30_y[i],
+            "prior_3m_mean": prior3_y[i],
+            "vs_prior_3m": vs_prior[i],
+            "vs_last_year": vs_last_year[i],
+            "seasonal_index": None if seasonal is None or np.isnan(seasonal[i]) else round(float(seasonal[i]), 2),
+        })
+    result["categories"].sort(key=lambda item: item["projected"], reverse=True)
+
+    total_budget = budgets[has_budget].sum() if has_budget.any() else None
+    total_projected = projected.sum()
+    result["total"] = {
+        "spent": round(float(spent.sum()) / 100, 2),
+        "projected": round(float(total_projected) / 100, 2),
+        "budget": None if total_budget is None else round(float(total_budget) / 100, 2),
+        "over_budget": bool(total_budget is not None and projected[has_budget].sum() > total_budget),
+        "prior_3m_mean": round(float(prior3.sum()) / 100, 2),
+        "vs_prior_3m": _pct_change(np.array(total_projected), np.array(prior3.sum()))[0],
+        "vs_last_year": (_pct_change(np.array(total_projected), np.array(last_year.sum()))[0]
+                         if last_year is not None else None),
+    }
+
+    if has_target:
+        lo = n_days - elapsed
+        for offset, (spend, r7, r30) in enumerate(zip(_yuan(total_daily[lo:]), _yuan(total7[lo:]), _yuan(total30[lo:]))):
+            result["daily"].append({"date": date.fromordinal(first + offset).isoformat(), "支出": spend,
+                                    "rolling_7": r7, "rolling_30": r30})
+    return result
+
+
+def _run(key, user_id, month, today, version):
+    try:
+        # 线程池里没有 Flask 上下文，get_db 返回本线程自己的只读连接
+        result = compute_forecast(get_db(readonly=True), user_id, month, today)
+        forecast_cache.put(key, version, result)
+        return result
+    finally:
+        with _pending_lock:
+            _pending.pop((key, version), None)
+
+
+def get_forecast(conn, user_id, month, today=None, wait=FORECAST_WAIT):
+    """Cached forecast for the current data version, or ``None`` if not ready within ``wait`` seconds.
+
+    The computation runs on the forecast pool; concurrent requests for the
+    same user, month, day and data version share one computation, and one that times out
+    keeps running so a retry finds the result in the cache.
+    """
+    today = today or date.today()
+    version = data_version(conn, user_id)
+    key = (user_id, month, today.isoformat())
+    cached = forecast_cache.get(key, version)
+    if cached is not None:
+        return cached
+    # 正在计算的结果也按数据版本区分：写入之后的请求不能拿到写入之前开始的计算
+    with _pending_lock:
+        future = _pending.get((key, version))
+        if future is None:
+            future = _pending[(key, version)] = _executor.submit(_run, key, user_id, month, today, version)
+    try:
+        return future.result(timeout=wait)
+    except FutureTimeout:
+        return None
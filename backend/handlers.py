@@ -1,83 +1,71 @@
-from db import get_db
+from db import get_db, normalize_date, data_version, to_cents, from_cents, category_ref
+from cache import VersionedCache
 from datetime import datetime
+from llm import client as llm_client, LLMError, completion_text
+from features import spend_features, format_features, estimate_tokens, raw_history_tokens
+from allocator import allocate
+import os
 current_month = datetime.now().strftime("%Y-%m")
+# 总预算分配完成后是否再请 LLM 写一段点评（会增加一次 LLM 调用）
+BUDGET_LLM_COMMENTARY = os.getenv("BUDGET_LLM_COMMENTARY", "0") == "1"
 
 def add_record(user_id, params):
     db = get_db()
     category = params.get("分类", "").strip()
     note = params.get("备注", "").strip()
-    amount = float(params.get("金额", 0))
+    amount = to_cents(params.get("金额", 0))  # 以分为单位入库
 
-    date = params.get("时间", "").strip()
-    if not date:
-        date = datetime.now().strftime("%Y-%m-%d")
-
-    month = date[:7]
-    year = date[:4]
+    try:
+        date, day, month, year = normalize_date(params.get("时间", ""))
+    except ValueError as e:
+        return f"⚠️ {e}"
 
     if not category or not amount:
         return "⚠️ 分类和金额不能为空"
 
-    # ✅ 查询分类类型是否为“收入”，不允许误用
-    row = db.execute(
-        "SELECT type FROM categories WHERE name = ? AND user_id = ?",
-        (category, user_id)
-    ).fetchone()
-    if row:
-        if row['type'] == '收入':
-            return f"⚠️ 分类「{category}」已被设为收入来源，不能作为支出使用，请更换分类名。"
-    else:
-        # ✅ 新增分类并标记为“支出”
-        db.execute("INSERT INTO categories (user_id, name, type) VALUES (?, ?, ?)", (user_id, category, '支出'))
+    # ✅ 查询分类类型是否为“收入”，不允许误用；不存在时新增并标记为“支出”
+    category_id, category_type = category_ref(db, user_id, category, '支出')
+    if category_type == '收入':
+        return f"⚠️ 分类「{category}」已被设为收入来源，不能作为支出使用，请更换分类名。"
 
     # ✅ 插入支出记录
     db.execute(
-        "INSERT INTO records (user_id, category, amount, note, date, month, year) VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (user_id, category, amount, note, date, month, year)
+        "INSERT INTO transactions (user_id, kind, category_id, amount, note, date, day, month, year) "
+        "VALUES (?, '支出', ?, ?, ?, ?, ?, ?, ?)",
+        (user_id, category_id, amount, note, date, day, month, year)
     )
     db.commit()
 
-    return f"✅ 成功记录一笔消费：你在「{category}」方面支出了 ¥{amount}，备注为「{note}」，日期为 {date}。"
+    return f"✅ 成功记录一笔消费：你在「{category}」方面支出了 ¥{from_cents(amount)}，备注为「{note}」，日期为 {date}。"
 
 def add_income(user_id, params):
     db = get_db()
     category = params.get("分类", "").strip()
     note = params.get("备注", "").strip()
-    amount = float(params.get("金额", 0))
-
-    date = params.get("时间", "").strip()
-    if not date:
-        date = datetime.now().strftime("%Y-%m-%d")
+    amount = to_cents(params.get("金额", 0))  # 以分为单位入库
 
-    month = date[:7]
-    year = date[:4]
+    try:
+        date, day, month, year = normalize_date(params.get("时间", ""))
+    except ValueError as e:
+        return f"⚠️ {e}"
 
     if not category or not amount:
         return "⚠️ 收入的来源和金额不能为空"
 
-    # ✅ 检查该收入来源是否已存在为“支出”分类
-    row = db.execute(
-        "SELECT type FROM categories WHERE name = ? AND user_id = ?",
-        (category, user_id)
-    ).fetchone()
-    if row:
-        if row['type'] == '支出':
-            return f"⚠️ 「{category}」已作为支出分类存在，不能记录为收入来源，请更换名称。"
-    else:
-        # ✅ 新增收入来源分类
-        db.execute(
-            "INSERT INTO categories (user_id, name, type) VALUES (?, ?, ?)",
-            (user_id, category, '收入')
-        )
+    # ✅ 检查该收入来源是否已存在为“支出”分类；不存在时新增收入来源分类
+    category_id, category_type = category_ref(db, user_id, category, '收入')
+    if category_type == '支出':
+        return f"⚠️ 「{category}」已作为支出分类存在，不能记录为收入来源，请更换名称。"
 
     # ✅ 插入收入记录
     db.execute(
-        "INSERT INTO income (user_id, category, amount, note, date, month, year) VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (user_id, category, amount, note, date, month, year)
+        "INSERT INTO transactions (user_id, kind, category_id, amount, note, date, day, month, year) "
+        "VALUES (?, '收入', ?, ?, ?, ?, ?, ?, ?)",
+        (user_id, category_id, amount, note, date, day, month, year)
     )
     db.commit()
 
-    return f"✅ 成功记录一笔收入：你从「{category}」获得了 ¥{amount}，备注为「{note}」，日期为 {date}。"
+    return f"✅ 成功记录一笔收入：你从「{category}」获得了 ¥{from_cents(amount)}，备注为「{note}」，日期为 {date}。"
 
 def set_budget(user_id, params):
     print("🧠 LLM 预算参数:", params)
@@ -91,25 +79,15 @@ def set_budget(user_id, params):
 
     db = get_db()
 
-    # ✅ 查询分类是否存在，检查类型
-    row = db.execute(
-        "SELECT type FROM categories WHERE name = ? AND user_id = ?",
-        (category, user_id)
-    ).fetchone()
-    if row:
-        if row['type'] != '支出':
-            return f"⚠️ 分类「{category}」不是支出分类，无法设置预算。"
-    else:
-        # ✅ 如果不存在则创建为支出分类
-        db.execute(
-            "INSERT INTO categories (user_id, name, type) VALUES (?, ?, ?)",
-            (user_id, category, '支出')
-        )
+    # ✅ 查询分类是否存在，检查类型；不存在则创建为支出分类
+    category_id, category_type = category_ref(db, user_id, category, '支出')
+    if category_type != '支出':
+        return f"⚠️ 分类「{category}」不是支出分类，无法设置预算。"
 
     # ✅ 设置预算（默认使用当前月）
     db.execute(
-        "INSERT OR REPLACE INTO budgets (user_id, category, amount, cycle, month) VALUES (?, ?, ?, ?, ?)",
-        (user_id, category, float(amount), cycle, current_month)
+        "INSERT OR REPLACE INTO budgets (user_id, category_id, amount, cycle, month) VALUES (?, ?, ?, ?, ?)",
+        (user_id, category_id, to_cents(amount), cycle, current_month)
     )
     db.commit()
 
@@ -125,119 +103,101 @@ def update_budget(user_id, params):
 
     db = get_db()
 
-    # ✅ 检查分类是否为支出类型
-    row = db.execute(
-        "SELECT type FROM categories WHERE name = ? AND user_id = ?",
-        (category, user_id)
-    ).fetchone()
-    if row:
-        if row['type'] != '支出':
-            return f"⚠️ 分类「{category}」不是支出分类，无法更新预算。"
-    else:
-        # ✅ 若不存在则创建为支出分类
-        db.execute(
-            "INSERT INTO categories (user_id, name, type) VALUES (?, ?, ?)",
-            (user_id, category, '支出')
-        )
+    # ✅ 检查分类是否为支出类型；若不存在则创建为支出分类
+    category_id, category_type = category_ref(db, user_id, category, '支出')
+    if category_type != '支出':
+        return f"⚠️ 分类「{category}」不是支出分类，无法更新预算。"
 
     # ✅ 更新预算记录
     db.execute(
-        "UPDATE budgets SET amount = ?, cycle = ? WHERE category = ? AND user_id = ?",
-        (float(amount), cycle, category, user_id)
+        "UPDATE budgets SET amount = ?, cycle = ? WHERE category_id = ? AND user_id = ?",
+        (to_cents(amount), cycle, category_id, user_id)
     )
     db.commit()
 
     return f"✅ 已更新「{category}」的预算为 ¥{amount}/{cycle}。别忘了定期检查哦！"
 
-def analyze_spend(user_id, params):
-    db = get_db()
-    month = params.get("月份") or datetime.now().strftime('%Y-%m')
+# 分析报告的结构化结果，按 (用户, 月份) 缓存，用户数据有任何写入即失效
+report_cache = VersionedCache("analyze_spend")
 
-    reply = f"📊「{month}」财务分析报告：\n"
+RANKING_SIZE = 5
 
-    # ✅ 本月支出排行
-    cursor = db.execute(
-        """
-        SELECT category, SUM(amount) as total
-        FROM records
-        WHERE month = ? AND user_id = ?
-        GROUP BY category
-        ORDER BY total DESC
-        LIMIT 5
-    """,
-        (month, user_id)
-    )
-    monthly_spend = cursor.fetchall()
 
-    # ✅ 历史总支出排行
-    cursor = db.execute(
-        """
-        SELECT category, SUM(amount) as total
-        FROM records
-        WHERE user_id = ?
-        GROUP BY category
-        ORDER BY total DESC
-        LIMIT 5
-    """,
-        (user_id,)
-    )
-    overall_spend = cursor.fetchall()
+def spend_report(db, user_id, month):
+    """Top categories for the month and all time, spend and income, in one query.
 
-    # ✅ 本月收入排行
-    cursor = db.execute(
+    Returns ``{(scope, kind): [(category, total), ...]}`` where scope is
+    ``"month"`` or ``"overall"``. The all-time side reads ``category_totals``,
+    which triggers keep up to date, so nothing is rescanned per call.
+    """
+    rows = db.execute(
         """
-        SELECT category, SUM(amount) as total
-        FROM income
-        WHERE month = ? AND user_id = ?
-        GROUP BY category
-        ORDER BY total DESC
-        LIMIT 5
-    """,
-        (month, user_id)
-    )
-    monthly_income = cursor.fetchall()
+        WITH scoped AS (
+            SELECT 'month' AS scope, kind, category_id, total
+            FROM monthly_totals WHERE user_id = ? AND month = ?
+            UNION ALL
+            SELECT 'overall' AS scope, kind, category_id, total
+            FROM category_totals WHERE user_id = ?
+        ), ranked AS (
+            SELECT s.scope, s.kind, COALESCE(c.name, '') AS category, s.total,
+                   ROW_NUMBER() OVER (PARTITION BY s.scope, s.kind ORDER BY s.total DESC, s.category_id) AS rn
+            FROM scoped s LEFT JOIN categories c ON c.id = s.category_id
+        )
+        SELECT scope, kind, category, total FROM ranked WHERE rn <= ? ORDER BY scope, kind, rn
+        """,
+        (user_id, month, user_id, RANKING_SIZE),
+    ).fetchall()
+    report = {(scope, kind): [] for scope in ("month", "overall") for kind in ("支出", "收入")}
+    for row in rows:
+        report.setdefault((row["scope"], row["kind"]), []).append((row["category"], row["total"]))
+    return report
 
-    # ✅ 历史总收入排行
-    cursor = db.execute(
-        """
-        SELECT category, SUM(amount) as total
-        FROM income
-        WHERE user_id = ?
-        GROUP BY category
-        ORDER BY total DESC
-        LIMIT 5
-    """,
-        (user_id,)
-    )
-    overall_income = cursor.fetchall()
+
+def analyze_spend(user_id, params):
+    db = get_db()
+    month = params.get("月份") or datetime.now().strftime('%Y-%m')
+
+    # ✅ 版本号未变时直接复用上次的结构化结果
+    version = data_version(db, user_id)
+    report = report_cache.get((user_id, month), version)
+    if report is None:
+        report = spend_report(db, user_id, month)
+        report_cache.put((user_id, month), version, report)
+
+    monthly_spend = report[("month", "支出")]      # 本月支出排行
+    overall_spend = report[("overall", "支出")]    # 历史总支出排行
+    monthly_income = report[("month", "收入")]     # 本月收入排行
+    overall_income = report[("overall", "收入")]   # 历史总收入排行
+
+    reply = f"📊「{month}」财务分析报告：\n"
 
     # === 支出分析输出 ===
     reply += "\n💸 本月支出排行：\n"
     if monthly_spend:
-        for row in monthly_spend:
-            reply += f"👉 分类「{row['category']}」共支出 ¥{row['total']:.2f}\n"
+        for category, total in monthly_spend:
+            reply += f"👉 分类「{category}」共支出 ¥{from_cents(total):.2f}\n"
     else:
         reply += "暂无支出记录。\n"
 
     reply += "\n📌 总体支出排行：\n"
     if overall_spend:
-        for row in overall_spend:
-            reply += f"📌 分类「{row['category']}」累计支出 ¥{row['total']:.2f}\n"
+        for category, total in overall_spend:
+            reply += f"📌 分类「{category}」累计支出 ¥{from_cents(total):.2f}\n"
     else:
         reply += "暂无历史支出数据。\n"
 
     # === 收入分析输出 ===
     reply += "\n💰 本月收入来源排行：\n"
     if monthly_income:
-        for row in monthly_income:
-            reply += f"✅ 来源「{row['category']}」共收入 ¥{row['total']:.2f}\n"
+        for category, total in monthly_income:
+            reply += f"✅ 来源「{category}」共收入 ¥{from_cents(total):.2f}\n"
     else:
         reply += "暂无收入记录。\n"
 
     reply += "\n📈 总体收入来源排行：\n"
     if overall_income:
-        for row in overall_income:
-            reply += f"📈 来源「{row['category']}」累计收入 ¥{row['total']:.2f}\n"
+        for category, total in overall_income:
+            reply += f"📈 来源「{category}」累计收入 ¥{from_cents(total):.2f}\n"
     else:
         reply += "暂无历史收入数据。\n"
 
@@ -281,22 +241,17 @@ def delete_category(user_id, params):
     if not category:
         return "⚠️ 分类名不能为空"
 
-    row = db.execute(
-        "SELECT type FROM categories WHERE name = ? AND user_id = ?",
-        (category, user_id)
-    ).fetchone()
-    if not row:
+    ref = category_ref(db, user_id, category)
+    if not ref:
         return f"⚠️ 分类「{category}」不存在，无法删除。"
 
-    category_type = row['type']
+    category_id, category_type = ref
 
-    if category_type == '支出':
-        db.execute("DELETE FROM records WHERE category = ? AND user_id = ?", (category, user_id))
-        db.execute("DELETE FROM budgets WHERE category = ? AND user_id = ?", (category, user_id))
-    elif category_type == '收入':
-        db.execute("DELETE FROM income WHERE category = ? AND user_id = ?", (category, user_id))
+    # 按 category_id 删除引用该分类的全部记录与预算
+    for table in ("transactions", "budgets"):
+        db.execute(f"DELETE FROM {table} WHERE category_id = ? AND user_id = ?", (category_id, user_id))
 
-    db.execute("DELETE FROM categories WHERE name = ? AND user_id = ?", (category, user_id))
+    db.execute("DELETE FROM categories WHERE id = ?", (category_id,))
     db.commit()
 
     return f"✅ 已彻底删除分类「{category}」（{category_type}）及其相关记录，清理完毕！"
@@ -310,26 +265,20 @@ def budget_remain(user_id, params):
     # ✅ 查询该月份的所有“支出”类预算信息
     cursor = db.execute(
         """
-        SELECT b.category, b.amount
+        SELECT c.name AS category, b.amount, t.total AS spent
         FROM budgets b
-        JOIN categories c ON b.category = c.name AND c.user_id = b.user_id
+        JOIN categories c ON c.id = b.category_id
+        LEFT JOIN monthly_totals t
+          ON t.user_id = b.user_id AND t.kind = '支出' AND t.month = b.month AND t.category_id = b.category_id
         WHERE b.month = ? AND b.user_id = ? AND c.type = '支出'
+        ORDER BY b.id
     """,
         (month, user_id)
     )
-    budget_map = {row['category']: float(row['amount']) for row in cursor.fetchall()}
-
-    # ✅ 查询该月份的所有“支出”记录
-    cursor = db.execute(
-        """
-        SELECT category, SUM(amount) as total
-        FROM records
-        WHERE month = ? AND user_id = ?
-        GROUP BY category
-    """,
-        (month, user_id)
-    )
-    spend_map = {row['category']: float(row['total']) for row in cursor.fetchall()}
+    rows = cursor.fetchall()
+    budget_map = {row['category']: from_cents(row['amount']) for row in rows}
+    # ✅ 该月份各分类的支出合计（来自汇总表，按 category_id 关联）
+    spend_map = {row['category']: from_cents(row['spent']) for row in rows if row['spent'] is not None}
 
     if category:
         if category not in budget_map:
@@ -346,94 +295,92 @@ def budget_remain(user_id, params):
         return reply
 
 import re
-def call_deepseek_budget_advice(user_id, records, total_budget=None, llm=None):
-    import os, requests, json
-
-    llm = llm or {}
-
-    print("开始分配预算")
-    api_key = llm.get("apikey") or os.getenv("DEEPSEEK_API_KEY")
-    url = llm.get("url") or "https://api.siliconflow.cn/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-
-    # ✅ 过滤掉收入类分类
-    db = get_db()
-    cursor = db.execute(
-        "SELECT name FROM categories WHERE type = '支出' AND user_id = ?",
-        (user_id,)
-    )
-    valid_categories = set(row['name'] for row in cursor.fetchall())
-
-    filtered_records = [
-        r for r in records if r['category'] in valid_categories
-    ]
-
-    if not filtered_records:
-        return "📭 没有可用于分析的支出记录，无法生成预算建议。"
-
-    history_json = json.dumps(filtered_records, ensure_ascii=False)
-    print("🎯 用于预算分析的分类：", list(valid_categories))
-    print("🎯 传给 LLM 的记录条数：", len(filtered_records))
-    print("🎯 设定总预算：", total_budget)
-
-    if total_budget:
-        budget_instruction = (
-            f"你是一个智能财务顾问，用户设定了本月总预算为 {total_budget} 元。\n"
-            "请根据用户历史消费记录中每个分类的支出情况，为所有出现过的分类分配一个合理的月预算。\n"
-            "⚠️ 要求如下：\n"
-            f"1. 所有分类预算总和必须严格等于 {total_budget} 元；\n"
-            "2. 不得遗漏任何分类，至少涵盖所有出现在历史记录中的分类；\n"
-            "3. 输出前请进行总额加和验证，确保不多不少刚好为总预算；\n"
-            "4. 每个类别的预算值必须为整数！\n"
-            "5. 输出结构化格式，不添加任何自然语言描述。\n"
-        )
-    else:
-        budget_instruction = (
-            "你是一个智能财务顾问，请根据用户历史消费记录中每个分类的支出情况，为每个分类生成一个合理的月预算建议。\n"
-            "不限制预算总额，但应体现实际消费趋势。\n"
-            "输出结构化格式，不添加自然语言描述。\n"
-        )
+def call_deepseek_budget_advice(feature_table, llm=None):
+    print("开始生成预算建议")
 
-    format_instruction = (
+    prompt = (
+        "你是一个智能财务顾问，请根据用户各支出分类的历史月度统计，为每个分类生成一个合理的月预算建议。\n"
+        "不限制预算总额，但应体现实际消费趋势（趋势为正表示支出在增长，波动系数越大越不稳定）。\n"
+        "输出结构化格式，不添加自然语言描述。\n"
         "输出格式如下（每个分类占用两行）：\n"
         "分类：<分类名>\n"
         "建议预算：<预算金额>\n"
         "单位为元，金额保留一位小数。\n"
+        "\n用户历史支出统计如下：\n" +
+        feature_table
     )
 
-    prompt = (
-        budget_instruction +
-        format_instruction +
-        "\n用户历史记录如下（JSON 列表，每项包含 category, amount, date）：\n" +
-        history_json
+    data = llm_client.chat(
+        [{"role": "user", "content": prompt}], llm, call="budget_advice", temperature=0.5
     )
+    usage = data.get("usage") or {}
+    print("🧮 预算建议 prompt tokens（服务端统计）：", usage.get("prompt_tokens", "未返回"))
+    content = completion_text(data)
+    print("📥 DeepSeek-r1 返回内容：", content)
+    return content
 
-    response = requests.post(url, headers=headers, json={
-        "model": llm.get("model") or "Pro/deepseek-ai/DeepSeek-V3",
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": 0.5
-    })
 
-    print("📥 DeepSeek-r1 返回内容：", response.json())
-    return response.json()["choices"][0]["message"]["content"]
+def call_deepseek_budget_comment(feature_table, allocation_text, total_budget, llm=None):
+    """可选：让 LLM 对本地算好的分配方案写一两句点评，失败时返回空字符串。"""
+    prompt = (
+        f"用户本月总预算为 {total_budget} 元，系统已按历史支出比例分配如下：\n{allocation_text}\n\n"
+        f"用户历史支出统计：\n{feature_table}\n\n"
+        "请用不超过 80 字点评这个分配方案并给出一条建议，不要改动任何金额，不要添加格式化符号。"
+    )
+    try:
+        return llm_client.complete([{"role": "user", "content": prompt}], llm, call="budget_advice", temperature=0.5)
+    except LLMError as e:
+        print("⚠️ 预算点评生成失败：", e)
+        return ""
+
+
+def allocate_total_budget(db, user_id, total, labels, features, feature_table, llm=None):
+    """按历史月均支出在本地切分总预算，一个事务批量写入。"""
+    amounts = allocate(total, [f["mean"] for f in features])
+    month = datetime.now().strftime("%Y-%m")
+    with db:
+        db.executemany(
+            "INSERT OR REPLACE INTO budgets (user_id, category_id, amount, cycle, month) VALUES (?, ?, ?, ?, ?)",
+            [(user_id, f["category_id"], to_cents(amount), "月", month) for f, amount in zip(features, amounts)],
+        )
 
+    allocation_text = "\n".join(
+        f"👉「{f['category']}」预算 ¥{amount}（近 {len(labels)} 个月月均 ¥{f['mean']:.2f}）"
+        for f, amount in zip(features, amounts)
+    )
+    reply = f"✅ 已按历史支出比例将总预算 ¥{total:g} 分配到 {len(features)} 个分类（{month}）：\n" + allocation_text
+    if BUDGET_LLM_COMMENTARY:
+        comment = call_deepseek_budget_comment(feature_table, allocation_text, total, llm)
+        if comment:
+            reply += "\n\n💡 " + comment
+    return reply
 
 
 def suggest_budgets(user_id, params=None, llm=None):
     db = get_db()
-    cursor = db.execute(
-        "SELECT category, amount, date FROM records WHERE user_id = ?",
-        (user_id,)
-    )
-    records = [dict(row) for row in cursor.fetchall()]
-    if not records:
-        return "📊 暂无支出记录，无法生成预算建议。"
-
-    total = float(params.get("总预算", 0)) if params and "总预算" in params else None
-    llm_reply = call_deepseek_budget_advice(user_id, records, total, llm)
+    # ✅ 只取按分类、按月汇总后的统计特征，不再把全部原始记录塞进 prompt
+    labels, features = spend_features(db, user_id)
+    if not features:
+        return f"📊 最近 {len(labels)} 个月暂无支出记录，无法生成预算建议。"
+
+    feature_table = format_features(labels, features)
+    print("🎯 用于预算分析的分类：", [f["category"] for f in features])
+
+    if params and params.get("总预算"):
+        try:
+            total = float(str(params["总预算"]).replace("元", "").replace(",", "").strip())
+        except ValueError:
+            return f"⚠️ 无法识别总预算：{params['总预算']}"
+        if total <= 0:
+            return "⚠️ 总预算必须大于 0"
+        # ✅ 有总预算时在本地确定性分配，合计必然等于总预算，LLM 只做可选点评
+        return allocate_total_budget(db, user_id, total, labels, features, feature_table, llm)
+
+    print(f"🧮 预算建议 prompt 估算 tokens：原始记录 {raw_history_tokens(db, user_id)} -> 统计表 {estimate_tokens(feature_table)}")
+    try:
+        llm_reply = call_deepseek_budget_advice(feature_table, llm)
+    except LLMError as e:
+        return f"⚠️ 预算建议生成失败：{e}"
     print("🧠 LLM 预算建议回复：\n", llm_reply)
 
     # ✅ 解析 LLM 输出格式
@@ -445,29 +392,20 @@ def suggest_budgets(user_id, params=None, llm=None):
 
     for category, budget in matches:
         category = category.strip()
-        budget = float(budget)
+        budget = to_cents(budget)
 
         # ✅ 确保分类存在且是支出类型
-        row = db.execute(
-            "SELECT type FROM categories WHERE name = ? AND user_id = ?",
-            (category, user_id)
-        ).fetchone()
-        if row:
-            if row['type'] != '支出':
-                continue  # 跳过收入分类
-        else:
-            db.execute(
-                "INSERT INTO categories (user_id, name, type) VALUES (?, ?, ?)",
-                (user_id, category, '支出')
-            )
+        category_id, category_type = category_ref(db, user_id, category, '支出')
+        if category_type != '支出':
+            continue  # 跳过收入分类
 
         # ✅ 写入预算（无 year 字段）
         db.execute(
             """
-            INSERT OR REPLACE INTO budgets (user_id, category, amount, cycle, month)
+            INSERT OR REPLACE INTO budgets (user_id, category_id, amount, cycle, month)
             VALUES (?, ?, ?, ?, ?)
         """,
-            (user_id, category, budget, "月", current_month)
+            (user_id, category_id, budget, "月", current_month)
         )
 
     db.commit()
@@ -480,19 +418,20 @@ def query_income(user_id, params):
     show_all = params.get("全部", "") == "是"
 
     results = []
-    total = 0.0
+    total = 0
 
     # ✅ 查询所有收入记录
     if show_all:
         cursor = db.execute(
-            "SELECT * FROM income WHERE user_id = ? ORDER BY date DESC",
+            "SELECT i.*, c.name AS category FROM income i LEFT JOIN categories c ON c.id = i.category_id "
+            "WHERE i.user_id = ? ORDER BY i.day DESC",
             (user_id,)
         )
         results = [dict(row) for row in cursor.fetchall()]
-        total = sum(float(r["amount"]) for r in results)
-        reply = f"📊 当前共记录 {len(results)} 笔收入，总计 ¥{total:.2f}\n"
+        total = sum(r["amount"] or 0 for r in results)
+        reply = f"📊 当前共记录 {len(results)} 笔收入，总计 ¥{from_cents(total):.2f}\n"
         for r in results[:10]:  # 最多展示前10条
-            reply += f"📌 {r['date']} - 来源「{r['category']}」收入 ¥{r['amount']}（备注：{r['note']}）\n"
+            reply += f"📌 {r['date']} - 来源「{r['category']}」收入 ¥{from_cents(r['amount'])}（备注：{r['note']}）\n"
         return reply + ("...（仅展示前10条）" if len(results) > 10 else "")
 
     # ✅ 聚合查询（可选时间范围 + 来源）
@@ -503,17 +442,17 @@ def query_income(user_id, params):
         if len(time_range) == 7:  # 2025-06（按月）
             query += " AND month = ?"
             args.append(time_range)
-        elif len(time_range) == 4:  # 2025（按年）
-            query += " AND year = ?"
-            args.append(time_range)
+        elif len(time_range) == 4:  # 2025（按年），按月份范围走覆盖索引
+            query += " AND month BETWEEN ? AND ?"
+            args.extend((f"{time_range}-01", f"{time_range}-12"))
 
     if category:
-        query += " AND category = ?"
-        args.append(category)
+        query += " AND category_id = (SELECT id FROM categories WHERE user_id = ? AND name = ?)"
+        args.extend((user_id, category))
 
     cursor = db.execute(query, tuple(args))
     row = cursor.fetchone()
-    total = float(row["total"] or 0)
+    total = from_cents(row["total"] or 0)
 
     # 构造自然语言响应
     scope = ""
@@ -0,0 +1,203 @@
+"""账单批量导入：解析银行 / 钱包导出的 CSV、JSON 文件并一次性写入。"""
+import csv
+import hashlib
+import io
+import json
+
+from db import normalize_date, to_cents
+
+# 常见账单表头 -> 标准字段
+COLUMN_ALIASES = {
+    "date": ("date", "日期", "交易日期", "交易时间", "记账日期", "时间"),
+    "amount": ("amount", "金额", "交易金额", "金额(元)", "金额（元）", "收/支金额"),
+    "category": ("category", "分类", "类别", "交易分类", "交易类型"),
+    "note": ("note", "备注", "摘要", "商品", "商品说明", "交易对方", "description", "memo"),
+    "type": ("type", "kind", "收/支", "收支", "收支类型"),
+}
+
+# 收支类型 -> (结果中的表名, transactions.kind / categories.type)
+KINDS = {
+    "expense": ("records", "支出"),
+    "income": ("income", "收入"),
+}
+
+# 未提供分类时的默认分类（收支各一个，避免同名冲突）
+DEFAULT_CATEGORIES = {"expense": "其他", "income": "其他收入"}
+
+# 返回给前端的错误行最多条数
+MAX_REPORTED_ERRORS = 50
+# 查询已有哈希时每条 IN 语句的参数个数（低于 SQLite 的变量上限）
+HASH_CHUNK = 500
+
+
+def content_hash(date, amount, note, occurrence=1):
+    """Stable duplicate-detection key for an imported transaction (``amount`` in cents).
+
+    ``occurrence`` numbers identical rows within one file (two 25-yuan
+    coffees on the same day), so each copy gets its own key while
+    re-importing the same file still matches every copy.
+    """
+    raw = f"{date}|{amount // 100}.{amount % 100:02d}|{note or ''}"
+    if occurrence > 1:
+        raw += f"#{occurrence}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def decode(data):
+    """Decode uploaded bytes; bank exports are often GBK rather than UTF-8."""
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return data.decode("gb18030")
+
+
+def parse_rows(data, fmt):
+    """Yield raw row dicts from CSV or JSON file content."""
+    text = decode(data) if isinstance(data, bytes) else data
+    if fmt == "json":
+        payload = json.loads(text)
+        if isinstance(payload, dict):
+            payload = payload.get("rows") or payload.get("records") or []
+        if not isinstance(payload, list):
+            raise ValueError("JSON 文件应为对象数组")
+        yield from payload
+    elif fmt == "csv":
+        yield from csv.DictReader(io.StringIO(text))
+    else:
+        raise ValueError(f"不支持的导入格式：{fmt}")
+
+
+def resolve_columns(fieldnames, mapping=None):
+    """Map file headers to standard fields, honouring an explicit mapping first."""
+    mapping = dict(mapping or {})
+    names = [str(f).strip() for f in fieldnames]
+    for field, aliases in COLUMN_ALIASES.items():
+        if field in mapping:
+            continue
+        for alias in aliases:
+            if alias in names:
+                mapping[field] = alias
+                break
+    missing = [f for f in ("date", "amount") if f not in mapping]
+    if missing:
+        raise ValueError(f"无法识别必需的列：{', '.join(missing)}")
+    return mapping
+
+
+def parse_amount(value):
+    """Parse a signed amount in yuan into integer cents."""
+    text = str(value).strip().replace(",", "").replace("¥", "").replace("￥", "").replace("元", "")
+    return to_cents(text)
+
+
+def resolve_kind(raw_type, amount, default_kind):
+    if raw_type:
+        text = str(raw_type).strip().lower()
+        if "收" in text or text in ("income", "in", "credit"):
+            return "income"
+        if "支" in text or text in ("expense", "out", "debit"):
+            return "expense"
+    if default_kind == "auto":
+        return "expense" if amount < 0 else "income"
+    return default_kind
+
+
+def import_rows(conn, user_id, raw_rows, mapping=None, default_kind="expense", default_category=None):
+    """Insert parsed rows into records / income in a single transaction.
+
+    Rows whose (date, amount, note) hash already exists for the user are
+    skipped and their line numbers reported, so re-importing an overlapping
+    statement only inserts the new rows. Identical rows within one file are
+    all kept (see :func:`content_hash`).
+    """
+    if default_kind not in ("expense", "income", "auto"):
+        raise ValueError("kind 只能是 expense、income 或 auto")
+
+    rows = {"expense": [], "income": []}
+    errors = []
+    seen = {}  # (kind, date, amount, note) -> 文件内出现次数
+    wanted = {}  # 分类名 -> categories.type
+    columns = None
+
+    for line, raw in enumerate(raw_rows, start=1):
+        if not isinstance(raw, dict):
+            errors.append({"line": line, "error": "每一行应为「列名: 值」的对象"})
+            continue
+        if columns is None:
+            columns = resolve_columns(raw.keys(), mapping)
+        try:
+            amount = parse_amount(raw.get(columns["amount"]))
+            date, day, month, year = normalize_date(str(raw.get(columns["date"]) or ""))
+        except (TypeError, ValueError) as e:
+            errors.append({"line": line, "error": str(e)})
+            continue
+        if not amount:
+            errors.append({"line": line, "error": "金额为 0"})
+            continue
+
+        kind = resolve_kind(raw.get(columns.get("type", "")), amount, default_kind)
+        amount = abs(amount)
+        category = str(raw.get(columns.get("category", "")) or "").strip() or default_category or DEFAULT_CATEGORIES[kind]
+        note = str(raw.get(columns.get("note", "")) or "").strip()
+
+        cat_type = KINDS[kind][1]
+        if wanted.setdefault(category, cat_type) != cat_type:
+            errors.append({"line": line, "error": f"分类「{category}」同时出现在收入和支出中"})
+            continue
+        occurrence = seen[kind, date, amount, note] = seen.get((kind, date, amount, note), 0) + 1
+        rows[kind].append((user_id, category, amount, note, date, day, month, year,
+                           content_hash(date, amount, note, occurrence), line))
+
+    summary = {"inserted": {"records": 0, "income": 0}, "duplicates": 0, "duplicate_lines": [],
+               "categories_created": [], "errors": errors[:MAX_REPORTED_ERRORS], "error_count": len(errors)}
+    if not wanted:
+        return summary
+
+    with conn:
+        # ✅ 一次查询取出已有分类，缺失的分类一次性批量创建
+        existing = {
+            row["name"]: row["type"]
+            for row in conn.execute("SELECT name, type FROM categories WHERE user_id = ?", (user_id,))
+        }
+        conflicts = {name for name, t in wanted.items() if name in existing and existing[name] != t}
+        if conflicts:
+            for kind in rows:
+                kept = [r for r in rows[kind] if r[1] not in conflicts]
+                summary["error_count"] += len(rows[kind]) - len(kept)
+                rows[kind] = kept
+            for name in sorted(conflicts):
+                summary["errors"].append({"line": None, "error": f"分类「{name}」已作为{existing[name]}分类存在，相关行已跳过"})
+
+        new_categories = [(user_id, name, t) for name, t in wanted.items() if name not in existing and name not in conflicts]
+        conn.executemany("INSERT OR IGNORE INTO categories (user_id, name, type) VALUES (?, ?, ?)", new_categories)
+        summary["categories_created"] = [name for _, name, _ in new_categories]
+        # 分类名 -> category_id，明细表只存整数键
+        ids = {row["name"]: row["id"]
+               for row in conn.execute("SELECT id, name FROM categories WHERE user_id = ?", (user_id,))}
+
+        for kind, batch in rows.items():
+            table, kind_name = KINDS[kind]
+            # ✅ 只与库里已有的行去重：先查出已存在的哈希，报告被跳过的行号
+            existing_hashes = set()
+            for i in range(0, len(batch), HASH_CHUNK):
+                chunk = [r[8] for r in batch[i:i + HASH_CHUNK]]
+                existing_hashes.update(row[0] for row in conn.execute(
+                    f"SELECT content_hash FROM transactions WHERE user_id = ? AND kind = ? "
+                    f"AND content_hash IN ({','.join('?' * len(chunk))})",
+                    [user_id, kind_name, *chunk]))
+            fresh = [r for r in batch if r[8] not in existing_hashes]
+            cursor = conn.executemany(
+                "INSERT OR IGNORE INTO transactions "
+                "(user_id, kind, category_id, amount, note, date, day, month, year, content_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(r[0], kind_name, ids[r[1]]) + r[2:9] for r in fresh],
+            )
+            # rowcount 只统计语句本身插入的行（不含触发器）
+            inserted = max(cursor.rowcount, 0)
+            summary["inserted"][table] = inserted
+            summary["duplicates"] += len(batch) - inserted
+            summary["duplicate_lines"] += [r[9] for r in batch if r[8] in existing_hashes]
+
+        summary["duplicate_lines"] = sorted(summary["duplicate_lines"])[:MAX_REPORTED_ERRORS]
+
+    return summary
@@ -0,0 +1,416 @@
+"""意图识别加速：本地规则解析快速通道，以及按规范化消息缓存 LLM 的解析结果。"""
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+import metrics
+from state import STATE_BACKEND, init_state_db, get_state_db, transaction
+
+CACHE_SIZE = int(os.getenv("INTENT_CACHE_SIZE", "2048"))
+CACHE_TTL = float(os.getenv("INTENT_CACHE_TTL", "86400"))
+
+# 含相对日期的消息，解析结果只在当天有效
+RELATIVE_DATE_RE = re.compile(
+    r"今天|今日|昨天|昨日|前天|明天|后天|刚才|刚刚|本周|这周|上周|下周|本月|这个月|上个月|上月|下个月|"
+    r"今年|去年|明年|[周星期礼拜][一二三四五六日天末]"
+)
+# 含绝对日期的消息（5月1日、2025-06-08、8号……），结果与年份相关
+ABSOLUTE_DATE_RE = re.compile(r"\d{1,4}\s*[-/.年]\s*\d{1,2}|\d{1,2}\s*月\s*\d{1,2}|\d{1,2}\s*[日号]")
+
+# 缓存中代表“解析当天日期 / 月份”的占位符
+TODAY_TOKEN = "{today}"
+MONTH_TOKEN = "{month}"
+
+CACHE_REQUESTS = metrics.Counter("intent_cache_requests_total", "意图缓存命中情况", ("result",))
+INTENT_SOURCE = metrics.Counter("intent_source_total", "意图解析来源（local / cache / llm）", ("source",))
+
+
+def normalize_message(message):
+    """Canonical form used as the cache key: NFKC, lower case, collapsed spaces."""
+    text = unicodedata.normalize("NFKC", message or "").strip().lower()
+    return re.sub(r"\s+", " ", text)
+
+
+class IntentCache:
+    """Thread-safe LRU + TTL cache of ``(message, date context) -> (intent, params)``.
+
+    Messages with relative dates (今天/昨天/上周五…) are keyed by today's date
+    so another day never reuses them. Messages without any date are keyed
+    without a date, and a parse's implicit "today" values are stored as
+    placeholders that are filled in with the current date on every hit.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _context(message, now):
+        if RELATIVE_DATE_RE.search(message):
+            return "day", now.strftime("%Y-%m-%d")
+        if ABSOLUTE_DATE_RE.search(message):
+            return "year", now.strftime("%Y")
+        return "none", None
+
+    def _key(self, message, model, now):
+        text = normalize_message(message)
+        return (text, model or "", *self._context(text, now))
+
+    def get(self, message, model=None, now=None):
+        now = now or datetime.now()
+        key = self._key(message, model, now)
+        entry = self._lookup(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        CACHE_REQUESTS.inc(result="miss" if entry is None else "hit")
+        if entry is None:
+            return None
+
+        intent, params = entry
+        if key[2] == "none":
+            today, month = now.strftime("%Y-%m-%d"), now.strftime("%Y-%m")
+            params = {k: v.replace(TODAY_TOKEN, today).replace(MONTH_TOKEN, month) for k, v in params.items()}
+        return intent, dict(params)
+
+    def put(self, message, intent, params, model=None, now=None):
+        now = now or datetime.now()
+        key = self._key(message, model, now)
+        params = dict(params)
+        if key[2] == "none":
+            # 没写日期的消息，LLM 会默认填入当天，存成占位符以便跨天复用
+            today, month = now.strftime("%Y-%m-%d"), now.strftime("%Y-%m")
+            params = {k: str(v).replace(today, TODAY_TOKEN).replace(month, MONTH_TOKEN) for k, v in params.items()}
+        self._store(key, intent, params)
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._data[key]
+                entry = None
+            if entry is None:
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def _store(self, key, intent, params):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, (intent, params))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def _size(self):
+        with self._lock:
+            return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        size = self._size()
+        total = self.hits + self.misses
+        return {"size": size, "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+
+class SqliteIntentCache(IntentCache):
+    """:class:`IntentCache` whose entries live in the shared state DB.
+
+    Lets every worker process reuse one parse. Expiry uses wall-clock
+    time; hit/miss counters stay per process. Hits are read-only: the
+    LRU ``used`` times are collected in memory and written in one batch
+    with the next store (or once ``TOUCH_BATCH`` hits have piled up).
+    """
+
+    TOUCH_BATCH = 100
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        super().__init__(maxsize, ttl)
+        self._touched = {}  # key -> 最近一次命中的时间，尚未写回
+        init_state_db()
+
+    def _lookup(self, key):
+        now = time.time()
+        key = json.dumps(key, ensure_ascii=False)
+        row = get_state_db().execute("SELECT intent, params, expires FROM intent_cache WHERE key = ?",
+                                     (key,)).fetchone()
+        if row is None or row["expires"] < now:
+            return None
+        with self._lock:
+            self._touched[key] = now
+            flush = len(self._touched) >= self.TOUCH_BATCH
+        if flush:
+            with transaction() as conn:
+                self._flush_touched(conn)
+        return row["intent"], json.loads(row["params"])
+
+    def _flush_touched(self, conn):
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        if touched:
+            conn.executemany("UPDATE intent_cache SET used = MAX(used, ?) WHERE key = ?",
+                             [(used, key) for key, used in touched.items()])
+
+    def _store(self, key, intent, params):
+        now = time.time()
+        with transaction() as conn:
+            self._flush_touched(conn)  # 淘汰前先写回命中时间
+            conn.execute(
+                "INSERT OR REPLACE INTO intent_cache (key, intent, params, expires, used) VALUES (?, ?, ?, ?, ?)",
+                (json.dumps(key, ensure_ascii=False), intent, json.dumps(params, ensure_ascii=False),
+                 now + self.ttl, now),
+            )
+            # 超出容量时按最近使用时间淘汰，顺带清掉过期项
+            conn.execute("DELETE FROM intent_cache WHERE expires < ?", (now,))
+            excess = conn.execute("SELECT COUNT(*) FROM intent_cache").fetchone()[0] - self.maxsize
+            if excess > 0:
+                conn.execute("DELETE FROM intent_cache WHERE key IN "
+                             "(SELECT key FROM intent_cache ORDER BY used LIMIT ?)", (excess,))
+
+    def _size(self):
+        return get_state_db().execute("SELECT COUNT(*) FROM intent_cache").fetchone()[0]
+
+    def clear(self):
+        get_state_db().execute("DELETE FROM intent_cache")
+
+
+# 进程内共享的意图缓存（多进程部署时为 SQLite 共享存储）
+intent_cache = SqliteIntentCache() if STATE_BACKEND == "sqlite" else IntentCache()
+
+
+# ===== 本地规则解析（零 LLM 快速通道） =====
+
+# 置信度不低于该阈值时直接采用本地解析结果，否则回退到 LLM
+LOCAL_PARSE_THRESHOLD = float(os.getenv("LOCAL_PARSE_THRESHOLD", "0.8"))
+
+# 常见支出关键词 -> 分类
+EXPENSE_KEYWORDS = {
+    "餐饮": ("早餐", "早饭", "午餐", "午饭", "晚餐", "晚饭", "夜宵", "宵夜", "外卖", "奶茶", "咖啡",
+             "饮料", "水果", "零食", "聚餐", "吃饭", "食堂"),
+    "交通": ("打车", "滴滴", "出租车", "地铁", "公交", "高铁", "火车票", "机票", "加油", "停车", "油费", "单车"),
+    "购物": ("超市", "淘宝", "京东", "网购", "衣服", "鞋子", "日用品", "购物"),
+    "住房": ("房租", "租金", "物业费", "水电", "电费", "水费", "燃气费"),
+    "通讯": ("话费", "流量", "宽带"),
+    "娱乐": ("电影", "游戏", "唱歌", "旅游", "门票"),
+    "医疗": ("看病", "买药", "医院", "挂号"),
+}
+# 常见收入来源关键词（直接作为收入分类名）
+INCOME_KEYWORDS = ("年终奖", "工资", "薪水", "薪资", "奖金", "兼职", "稿费", "报销", "分红", "利息", "外快", "退款")
+
+WEEKDAYS = {"一": 0, "二": 1, "三": 2, "四": 3, "五": 4, "六": 5, "日": 6, "天": 6}
+DAY_OFFSETS = {"大前天": -3, "前天": -2, "昨天": -1, "昨日": -1, "今天": 0, "今日": 0}
+
+AMOUNT = r"(?P<amount>\d+(?:\.\d{1,2})?)\s*(?:元|块钱|块|rmb)?"
+WORD = r"(?P<word>[^\d\s，,。]+?)"
+RECORD_RE = [re.compile(rf"^{WORD}\s*{AMOUNT}$"), re.compile(rf"^{AMOUNT}\s*{WORD}$")]
+BUDGET_RE = re.compile(
+    rf"^(?:设置|设定|把)?{WORD}(?:的)?(?:月)?预算(?:设置?为|设为|改为|调整为|是|为|:|：)?\s*{AMOUNT}$"
+)
+# 预算句式里分类名前的时间范围 / 修饰前缀（长的在前），以及 "月" 被正则吃掉后剩下的残片
+BUDGET_PREFIXES = ("这个月", "每个月", "本月", "每月", "当月", "我的", "总")
+BUDGET_LEFTOVERS = ("月", "每", "这个", "本", "当", "我")
+# 预算剩余查询里分类名前后的时间、疑问与口语词（长的在前）
+BUDGET_QUERY_WORDS = ("这个月", "上个月", "本月", "上月", "查询", "查看", "查一下", "查", "还剩下", "还剩", "剩下",
+                      "剩余", "还有", "多少", "超支了", "超支", "余额", "我的", "我")
+EXPENSE_FILLERS = ("记一笔", "记账", "花了", "消费了", "消费", "支出", "买了", "付了", "用了")
+INCOME_FILLERS = ("收到了", "收到", "到账了", "到账", "进账", "发了", "收入了", "收入")
+QUESTION_WORDS = ("多少", "吗", "?", "几", "怎么", "什么")
+
+
+def resolve_date(text, today=None):
+    """Find one date expression in ``text``; return ``(date or None, text without it)``."""
+    today = today or datetime.now().date()
+
+    m = re.search(r"(\d{4})\s*[-/.年]\s*(\d{1,2})\s*[-/.月]\s*(\d{1,2})\s*[日号]?", text)
+    if m:
+        try:
+            found = date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        except ValueError:
+            return None, text
+        return found, text[:m.start()] + text[m.end():]
+
+    m = re.search(r"(\d{1,2})\s*月\s*(\d{1,2})\s*[日号]?", text)
+    if m:
+        try:
+            found = date(today.year, int(m.group(1)), int(m.group(2)))
+        except ValueError:
+            return None, text
+        return found, text[:m.start()] + text[m.end():]
+
+    for word, offset in DAY_OFFSETS.items():
+        if word in text:
+            return today + timedelta(days=offset), text.replace(word, "", 1)
+
+    m = re.search(r"(上|这|本|下)?(?:个)?(?:周|星期|礼拜)([一二三四五六日天])", text)
+    if m:
+        monday = today - timedelta(days=today.weekday())
+        shift = {"上": -7, "下": 7}.get(m.group(1), 0)
+        found = monday + timedelta(days=shift + WEEKDAYS[m.group(2)])
+        if not m.group(1) and found > today:
+            found -= timedelta(days=7)  # 单说“周五”指最近已过去的那一天，不记到未来
+        return found, text[:m.start()] + text[m.end():]
+
+    m = re.search(r"(?<![\d.])(\d{1,2})\s*[日号]", text)
+    if m:
+        try:
+            found = today.replace(day=int(m.group(1)))
+        except ValueError:
+            return None, text
+        return found, text[:m.start()] + text[m.end():]
+
+    return None, text
+
+
+def resolve_month(text, today=None):
+    """Find a month / year scope (本月, 上个月, 2025年, 6月…) for queries."""
+    today = today or datetime.now().date()
+    if any(w in text for w in ("上个月", "上月")):
+        prev = today.replace(day=1) - timedelta(days=1)
+        return prev.strftime("%Y-%m")
+    if any(w in text for w in ("这个月", "本月", "当月")):
+        return today.strftime("%Y-%m")
+    if "今年" in text:
+        return today.strftime("%Y")
+    if "去年" in text:
+        return str(today.year - 1)
+    m = re.search(r"(\d{4})\s*[-/.年]\s*(\d{1,2})\s*月?", text)
+    if m:
+        return f"{m.group(1)}-{int(m.group(2)):02d}"
+    m = re.search(r"(\d{4})\s*年", text)
+    if m:
+        return m.group(1)
+    m = re.search(r"(?<!\d)(\d{1,2})\s*月", text)
+    if m and 1 <= int(m.group(1)) <= 12:
+        return f"{today.year}-{int(m.group(1)):02d}"
+    return None
+
+
+def _strip(text, words):
+    for w in words:
+        text = text.replace(w, "")
+    return text.strip(" ，,。的")
+
+
+def _classify_expense(word):
+    for category, keywords in EXPENSE_KEYWORDS.items():
+        if word == category:
+            return category
+        for kw in sorted(keywords, key=len, reverse=True):
+            if kw in word:
+                return category
+    return None
+
+
+def _income_source(word):
+    for kw in INCOME_KEYWORDS:
+        if kw in word:
+            return kw
+    return None
+
+
+def parse_local(message, categories=None, today=None):
+    """Deterministically parse common bookkeeping commands.
+
+    Returns ``(intent, params, confidence)`` in the same parameter format as
+    ``parse_response``, or ``None`` if no rule applies. ``categories`` maps
+    the user's category names to their type and raises confidence for
+    exact matches.
+    """
+    categories = categories or {}
+    today = today or datetime.now().date()
+    text = unicodedata.normalize("NFKC", message or "").strip().lower()
+    if not text:
+        return None
+
+    # ✅ 预算剩余查询
+    if "预算" in text and any(w in text for w in ("剩", "还有多少", "余额", "超支")):
+        month = resolve_month(text, today) or today.strftime("%Y-%m")
+        word = re.sub(r"\d{4}\s*[-/.年]\s*\d{1,2}\s*月?|\d{1,2}\s*月", "", re.sub(r"预算.*$", "", text))
+        word = _strip(word, BUDGET_QUERY_WORDS)
+        params = {"月份": month if len(month) == 7 else today.strftime("%Y-%m")}
+        if not word:
+            return "budget_remain", params, 0.9  # 没有分类即查询全部预算
+        params["分类"] = word
+        # ⚠️ 未知分类多半是没剥干净的口语，交给 LLM
+        return "budget_remain", params, 0.9 if categories.get(word) == "支出" else 0.5
+
+    # ✅ 收入查询
+    if "收入" in text and (any(w in text for w in QUESTION_WORDS + ("全部", "所有", "明细"))
+                         or text.startswith(("查", "统计"))):
+        if re.search(r"\d+(?:\.\d+)?\s*(?:元|块)", text):
+            return None
+        params = {}
+        if any(w in text for w in ("全部", "所有", "明细", "列表")):
+            params["全部"] = "是"
+        scope = resolve_month(text, today)
+        if scope:
+            params["时间范围"] = scope
+        source = _income_source(text)
+        if source:
+            params["分类"] = source
+        return "query_income", params, 0.9
+
+    if any(w in text for w in QUESTION_WORDS):
+        return None
+
+    # ✅ 设置预算
+    m = BUDGET_RE.match(text)
+    if m:
+        word = m.group("word").strip(" 的")
+        while word.startswith(BUDGET_PREFIXES):
+            word = word[len(next(p for p in BUDGET_PREFIXES if word.startswith(p))):].strip(" 的")
+        if not word or word in BUDGET_LEFTOVERS:
+            return None  # 总预算 / 月预算分配交给 suggest_budgets
+        # ⚠️ 未知分类会新建分类，交给 LLM 确认
+        confidence = 0.95 if categories.get(word) == "支出" else 0.5 if word not in categories else 0.0
+        if not confidence:
+            return None
+        return "set_budget", {"分类": word, "金额": m.group("amount")}, confidence
+
+    # ✅ 记账：<描述> <金额>
+    found, rest = resolve_date(text, today)
+    when = found or today
+    is_income = any(w in rest for w in INCOME_FILLERS)
+    rest = _strip(rest, EXPENSE_FILLERS + INCOME_FILLERS)
+    for pattern in RECORD_RE:
+        m = pattern.match(rest)
+        if m:
+            break
+    else:
+        return None
+    word = m.group("word").strip(" ，,。的")
+    amount = m.group("amount")
+    if not word or float(amount) <= 0:
+        return None
+
+    params = {"金额": amount, "时间": when.isoformat(), "月份": when.strftime("%Y-%m")}
+    known_type = categories.get(word)
+    if known_type == "收入" or (known_type is None and (is_income or _income_source(word))):
+        params.update({"分类": word if known_type else (_income_source(word) or word), "备注": word})
+        confidence = 0.95 if known_type else 0.9 if _income_source(word) else 0.6
+        return "add_income", params, confidence
+
+    if known_type == "支出":
+        params.update({"分类": word, "备注": ""})
+        return "add_record", params, 0.95
+    category = _classify_expense(word)
+    if category and categories.get(category) != "收入":
+        params.update({"分类": category, "备注": "" if word == category else word})
+        return "add_record", params, 0.9
+    # 未知描述（如商户名）需要 LLM 推断分类
+    params.update({"分类": word, "备注": word})
+    return "add_record", params, 0.5
@@ -0,0 +1,440 @@
+"""共享的 LLM 客户端：连接池复用、调用截止时间、有限重试与熔断。"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - 仅异步模式（asgi.py）需要
+    httpx = None
+
+import metrics
+
+# 请求未指定 llm.url / llm.model 时使用；LLM_URL 可指向本地的 mockllm.py 做压测
+DEFAULT_URL = os.getenv("LLM_URL", "https://api.siliconflow.cn/v1/chat/completions")
+DEFAULT_MODEL = os.getenv("LLM_MODEL", "Pro/deepseek-ai/DeepSeek-V3")
+
+# 各类调用的总截止时间（秒），包含重试在内
+TIMEOUTS = {
+    "intent": 10,
+    "summary": 30,
+    "chat": 10,
+    "budget_advice": 60,
+}
+CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "3.05"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.25"))
+POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "16"))
+# 异步模式下单进程可同时挂起数百个聊天请求，连接池相应放大
+ASYNC_POOL_SIZE = int(os.getenv("LLM_ASYNC_POOL_SIZE", "200"))
+
+# 这些状态码通常是瞬时问题，值得重试
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """Raised when the provider cannot produce a usable response."""
+
+
+class CircuitOpenError(LLMError):
+    """Raised without touching the network while the breaker is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._probing:
+                return False
+            # 冷却期已过：放行一个探测请求（half-open）
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def settle(self):
+        """Release a half-open probe that ended without a verdict.
+
+        A stream abandoned by its consumer or stopped by an unexpected error
+        never reaches ``record_success`` / ``record_failure``; such a probe
+        counts as a failure so the breaker reopens instead of staying stuck.
+        """
+        with self._lock:
+            probing = self._probing
+        if probing:
+            self.record_failure()
+
+
+# 同步 / 异步客户端共用同一组熔断器：同一服务商的故障对两者都生效
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(url):
+    host = urlsplit(url).netloc
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker()
+        return _breakers[host]
+
+
+def prepare_request(messages, llm, call, timeout, options, stream=False):
+    """Return ``(url, headers, payload, breaker, deadline)`` for one call.
+
+    Raises :class:`CircuitOpenError` straight away while the provider's
+    breaker is open.
+    """
+    llm = llm or {}
+    url = llm.get("url") or DEFAULT_URL
+    api_key = llm.get("apikey") or os.getenv("DEEPSEEK_API_KEY")
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+    }
+    payload = {"model": llm.get("model") or DEFAULT_MODEL, "messages": messages, **options}
+    if stream:
+        headers["Accept"] = "text/event-stream"
+        payload["stream"] = True
+
+    breaker = breaker_for(url)
+    if not breaker.allow():
+        metrics.record_llm_call(call, 0.0, outcome="circuit_open")
+        raise CircuitOpenError("LLM 服务暂时不可用，请稍后再试")
+    return url, headers, payload, breaker, time.monotonic() + (timeout or TIMEOUTS.get(call, 30))
+
+
+def completion_text(data):
+    """Extract the first choice's text from a chat completion body."""
+    if "choices" in data:
+        return data["choices"][0]["message"]["content"]
+    if "error" in data:
+        error = data["error"]
+        message = error.get("message", "未知错误") if isinstance(error, dict) else str(error)
+        raise LLMError(message)
+    raise LLMError("LLM 响应格式异常")
+
+
+def parse_stream_line(line):
+    """Parse one SSE line of a streamed completion.
+
+    Returns ``None`` for lines to skip, ``False`` at ``[DONE]`` and the
+    decoded event dict otherwise.
+    """
+    if not line or not line.startswith("data:"):
+        return None
+    chunk = line[5:].strip()
+    if chunk == "[DONE]":
+        return False
+    try:
+        return json.loads(chunk)
+    except ValueError:
+        return None
+
+
+def stream_deltas(event):
+    for choice in event.get("choices") or []:
+        delta = (choice.get("delta") or {}).get("content")
+        if delta:
+            yield delta
+
+
+class LLMClient:
+    def __init__(self, pool_size=POOL_SIZE, max_retries=MAX_RETRIES, backoff_base=BACKOFF_BASE):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def breaker(self, url):
+        return breaker_for(url)
+
+    def chat(self, messages, llm=None, call="chat", timeout=None, **options):
+        """POST a chat completion and return the decoded JSON body.
+
+        ``timeout`` is the overall deadline for the call including retries.
+        Connection errors and 429/5xx responses are retried with jittered
+        exponential backoff while the deadline allows; read timeouts are not
+        retried because the deadline is already spent.
+        """
+        url, headers, payload, breaker, deadline = prepare_request(messages, llm, call, timeout, options)
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            started = time.perf_counter()
+            try:
+                res = self.session.post(
+                    url, headers=headers, json=payload,
+                    timeout=(min(CONNECT_TIMEOUT, remaining), max(remaining, 0.1)),
+                )
+                if res.status_code in RETRY_STATUS:
+                    raise _RetryableStatus(res)
+                data = res.json()
+            except (requests.ConnectionError, _RetryableStatus) as e:
+                metrics.record_llm_call(call, time.perf_counter() - started, outcome="retryable_error")
+                delay = self.backoff_base * (2 ** attempt) * random.random()  # full jitter
+                if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    breaker.record_failure()
+                    raise LLMError(f"LLM 请求失败：{e}") from e
+                attempt += 1
+                time.sleep(delay)
+                continue
+            except (requests.RequestException, ValueError) as e:
+                metrics.record_llm_call(call, time.perf_counter() - started, outcome="error")
+                breaker.record_failure()
+                raise LLMError(f"LLM 请求失败：{e}") from e
+
+            metrics.record_llm_call(call, time.perf_counter() - started, data)
+            breaker.record_success()
+            return data
+
+    def complete(self, messages, llm=None, call="chat", timeout=None, **options):
+        """Like :meth:`chat` but return the first choice's text."""
+        return completion_text(self.chat(messages, llm, call, timeout, **options))
+
+    def stream(self, messages, llm=None, call="chat", timeout=None, **options):
+        """Yield content deltas from a ``stream: true`` chat completion.
+
+        Connection failures before the first byte are retried like
+        :meth:`chat`; once tokens have started flowing errors are raised as
+        :class:`LLMError` to the consumer.
+        """
+        url, headers, payload, breaker, deadline = prepare_request(messages, llm, call, timeout, options, stream=True)
+        try:
+            attempt = 0
+            started = time.perf_counter()
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    res = self.session.post(
+                        url, headers=headers, json=payload, stream=True,
+                        timeout=(min(CONNECT_TIMEOUT, remaining), max(remaining, 0.1)),
+                    )
+                    if res.status_code in RETRY_STATUS:
+                        res.close()
+                        raise _RetryableStatus(res)
+                    break
+                except (requests.ConnectionError, _RetryableStatus) as e:
+                    delay = self.backoff_base * (2 ** attempt) * random.random()
+                    if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                        metrics.record_llm_call(call, time.perf_counter() - started, outcome="retryable_error")
+                        breaker.record_failure()
+                        raise LLMError(f"LLM 请求失败：{e}") from e
+                    attempt += 1
+                    time.sleep(delay)
+                except requests.RequestException as e:
+                    metrics.record_llm_call(call, time.perf_counter() - started, outcome="error")
+                    breaker.record_failure()
+                    raise LLMError(f"LLM 请求失败：{e}") from e
+
+            if "text/event-stream" not in res.headers.get("Content-Type", ""):
+                # 服务端不支持流式时会直接返回完整 JSON
+                try:
+                    data = res.json()
+                except ValueError as e:
+                    breaker.record_failure()
+                    raise LLMError("LLM 响应格式异常") from e
+                finally:
+                    res.close()
+                metrics.record_llm_call(call, time.perf_counter() - started, data)
+                text = completion_text(data)
+                breaker.record_success()
+                yield text
+                return
+
+            usage = None
+            first = True
+            try:
+                for line in res.iter_lines(decode_unicode=True):
+                    event = parse_stream_line(line)
+                    if event is False:
+                        break
+                    if event is None:
+                        continue
+                    usage = event.get("usage") or usage
+                    for delta in stream_deltas(event):
+                        if first:
+                            metrics.LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started, call=call)
+                            first = False
+                        yield delta
+            except requests.RequestException as e:
+                metrics.record_llm_call(call, time.perf_counter() - started, outcome="error")
+                breaker.record_failure()
+                raise LLMError(f"LLM 流式响应中断：{e}") from e
+            finally:
+                res.close()
+
+            metrics.record_llm_call(call, time.perf_counter() - started, {"usage": usage} if usage else None)
+            breaker.record_success()
+        finally:
+            breaker.settle()  # 被中途放弃的探测请求按失败处理
+
+    def prewarm(self, url=None):
+        """Open a pooled TLS connection to the provider in the background."""
+        target = url or DEFAULT_URL
+
+        def _warm():
+            parts = urlsplit(target)
+            try:
+                self.session.head(f"{parts.scheme}://{parts.netloc}/", timeout=CONNECT_TIMEOUT)
+                print("🔌 LLM 连接已预热：", parts.netloc)
+            except requests.RequestException as e:
+                print("⚠️ LLM 连接预热失败：", e)
+
+        threading.Thread(target=_warm, name="llm-prewarm", daemon=True).start()
+
+
+class AsyncLLMClient:
+    """asyncio counterpart of :class:`LLMClient` built on ``httpx.AsyncClient``.
+
+    Same deadlines, retry policy, breakers and metrics; waiting on the
+    provider does not hold a thread. Create and close it inside the event
+    loop that uses it.
+    """
+
+    # 连接阶段的错误可以安全重试；读超时说明截止时间已耗尽，不再重试
+    RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout) if httpx else ()
+
+    def __init__(self, pool_size=ASYNC_POOL_SIZE, max_retries=MAX_RETRIES, backoff_base=BACKOFF_BASE):
+        if httpx is None:
+            raise RuntimeError("异步模式需要安装 httpx")
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.client = httpx.AsyncClient(limits=httpx.Limits(
+            max_connections=pool_size, max_keepalive_connections=pool_size))
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def _send(self, url, headers, payload, call, breaker, deadline, stream=False):
+        """Send with retries and return the (possibly still streaming) response."""
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            started = time.perf_counter()
+            request = self.client.build_request(
+                "POST", url, headers=headers, json=payload,
+                timeout=httpx.Timeout(max(remaining, 0.1), connect=min(CONNECT_TIMEOUT, remaining)),
+            )
+            try:
+                res = await self.client.send(request, stream=stream)
+                if res.status_code in RETRY_STATUS:
+                    await res.aclose()
+                    raise _RetryableStatus(res)
+                return res
+            except (*self.RETRY_ERRORS, _RetryableStatus) as e:
+                metrics.record_llm_call(call, time.perf_counter() - started, outcome="retryable_error")
+                delay = self.backoff_base * (2 ** attempt) * random.random()  # full jitter
+                if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    breaker.record_failure()
+                    raise LLMError(f"LLM 请求失败：{e!r}") from e
+                attempt += 1
+                await asyncio.sleep(delay)
+            except httpx.HTTPError as e:
+                metrics.record_llm_call(call, time.perf_counter() - started, outcome="error")
+                breaker.record_failure()
+                raise LLMError(f"LLM 请求失败：{e!r}") from e
+
+    async def chat(self, messages, llm=None, call="chat", timeout=None, **options):
+        url, headers, payload, breaker, deadline = prepare_request(messages, llm, call, timeout, options)
+        started = time.perf_counter()
+        res = await self._send(url, headers, payload, call, breaker, deadline)
+        try:
+            data = res.json()
+        except ValueError as e:
+            metrics.record_llm_call(call, time.perf_counter() - started, outcome="error")
+            breaker.record_failure()
+            raise LLMError(f"LLM 请求失败：{e}") from e
+        metrics.record_llm_call(call, time.perf_counter() - started, data)
+        breaker.record_success()
+        return data
+
+    async def complete(self, messages, llm=None, call="chat", timeout=None, **options):
+        return completion_text(await self.chat(messages, llm, call, timeout, **options))
+
+    async def stream(self, messages, llm=None, call="chat", timeout=None, **options):
+        """Async generator of content deltas, see :meth:`LLMClient.stream`."""
+        url, headers, payload, breaker, deadline = prepare_request(messages, llm, call, timeout, options, stream=True)
+        started = time.perf_counter()
+        res = None
+        try:
+            res = await self._send(url, headers, payload, call, breaker, deadline, stream=True)
+            if "text/event-stream" not in res.headers.get("Content-Type", ""):
+                # 服务端不支持流式时会直接返回完整 JSON
+                await res.aread()
+                try:
+                    data = res.json()
+                except ValueError as e:
+                    breaker.record_failure()
+                    raise LLMError("LLM 响应格式异常") from e
+                metrics.record_llm_call(call, time.perf_counter() - started, data)
+                text = completion_text(data)
+                breaker.record_success()
+                yield text
+                return
+
+            usage = None
+            first = True
+            try:
+                async for line in res.aiter_lines():
+                    event = parse_stream_line(line)
+                    if event is False:
+                        break
+                    if event is None:
+                        continue
+                    usage = event.get("usage") or usage
+                    for delta in stream_deltas(event):
+                        if first:
+                            metrics.LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started, call=call)
+                            first = False
+                        yield delta
+            except httpx.HTTPError as e:
+                metrics.record_llm_call(call, time.perf_counter() - started, outcome="error")
+                breaker.record_failure()
+                raise LLMError(f"LLM 流式响应中断：{e!r}") from e
+            metrics.record_llm_call(call, time.perf_counter() - started, {"usage": usage} if usage else None)
+            breaker.record_success()
+        finally:
+            if res is not None:
+                await res.aclose()
+            breaker.settle()  # 被中途放弃的探测请求按失败处理
+
+
+class _RetryableStatus(Exception):
+    def __init__(self, response):
+        super().__init__(f"HTTP {response.status_code}")
+        self.response = response
+
+
+# 进程内共享的客户端
+client = LLMClient()
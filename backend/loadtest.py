@@ -0,0 +1,220 @@
+"""聊天接口压测：N 个并发会话各自登录后循环请求 /api/chat，统计吞吐、尾延迟与线程饱和度。
+
+    python mockllm.py --port 8001 &
+    python serve.py --workers 1 --threads 8 &
+    python loadtest.py --sessions 32 --duration 30 --llm-url http://127.0.0.1:8001/v1/chat/completions --server-threads 8
+
+--llm-url 通过请求体里的 llm.url 让后端改调指定的服务（也可以在后端设置 LLM_URL）。
+压测期间定时读取 /metrics 中的 http_requests_in_flight，与 --server-threads 对比得到线程饱和度；
+多 worker 部署时 /metrics 只反映处理该请求的那个进程。
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+
+import requests
+
+from bench import percentile
+
+# 默认的消息组合：记账类走本地解析 + 总结 LLM，闲聊走意图 LLM + 闲聊 LLM
+DEFAULT_MESSAGES = [
+    "午饭花了25元",
+    "打车 38",
+    "这个月餐饮预算还剩多少",
+    "分析一下这个月的支出",
+    "今天心情不错",
+    "工资到账8000",
+    "查一下今年的收入",
+]
+
+
+class Stats:
+    """Request outcomes collected from all session threads."""
+
+    def __init__(self):
+        self.latencies = []
+        self.first_token = []
+        self.outcomes = {}
+        self._lock = threading.Lock()
+
+    def add(self, outcome, latency=None, first_token=None):
+        with self._lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            if latency is not None:
+                self.latencies.append(latency)
+            if first_token is not None:
+                self.first_token.append(first_token)
+
+
+def login(base, name, password):
+    session = requests.Session()
+    session.post(f"{base}/api/register", json={"username": name, "password": password}, timeout=30)
+    res = session.post(f"{base}/api/login", json={"username": name, "password": password}, timeout=30)
+    res.raise_for_status()
+    return session
+
+
+def send(session, args, message):
+    """Send one chat message; return ``(outcome, latency, first token latency)``."""
+    body = {"message": message}
+    if args.llm_url:
+        body["llm"] = {"url": args.llm_url, "apikey": "mock"}
+    started = time.perf_counter()
+    if not args.stream:
+        res = session.post(f"{args.base}/api/chat", json=body, timeout=args.timeout)
+        latency = time.perf_counter() - started
+        if res.status_code != 200:
+            return f"http_{res.status_code}", latency, None
+        reply = res.json().get("reply", "")
+        # LLM 失败时后端仍返回 200，只是回复为兜底文案
+        return ("llm_fallback" if reply.startswith(("❌", "⚠️ 暂时无法回复")) else "ok"), latency, None
+
+    first_token, event, outcome = None, None, "ok"
+    with session.post(f"{args.base}/api/chat/stream", json=body, timeout=args.timeout, stream=True) as res:
+        if res.status_code != 200:
+            return f"http_{res.status_code}", time.perf_counter() - started, None
+        for line in res.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[6:].strip()
+                if event == "token" and first_token is None:
+                    first_token = time.perf_counter() - started
+                elif event == "error":
+                    outcome = "llm_error"
+    return outcome, time.perf_counter() - started, first_token
+
+
+def run_session(index, args, stats, deadline, start_at, run_id):
+    time.sleep(max(0.0, start_at - time.monotonic()))
+    try:
+        session = login(args.base, f"load-{run_id}-{index}", "load-test")
+    except requests.RequestException as e:
+        stats.add(f"login_failed: {type(e).__name__}")
+        return
+    sent = 0
+    while time.monotonic() < deadline and (not args.requests or sent < args.requests):
+        message = args.messages[(index + sent) % len(args.messages)]
+        try:
+            outcome, latency, first_token = send(session, args, message)
+        except requests.RequestException as e:
+            outcome, latency, first_token = f"exception: {type(e).__name__}", None, None
+        stats.add(outcome, latency, first_token)
+        sent += 1
+        if args.think_ms:
+            time.sleep(args.think_ms / 1000)
+
+
+def sample_in_flight(base, interval, stop, samples):
+    """Poll ``http_requests_in_flight`` from /metrics until ``stop`` is set."""
+    while not stop.wait(interval):
+        try:
+            text = requests.get(f"{base}/metrics", timeout=5).text
+        except requests.RequestException:
+            continue
+        for line in text.splitlines():
+            if line.startswith("http_requests_in_flight"):
+                # 减去本次 /metrics 请求自己
+                samples.append(max(0.0, float(line.split()[-1]) - 1))
+                break
+
+
+def summarize(args, stats, samples, elapsed):
+    latencies = sorted(stats.latencies)
+    total = sum(stats.outcomes.values())
+    ok = stats.outcomes.get("ok", 0)
+    report = {
+        "sessions": args.sessions,
+        "elapsed_s": round(elapsed, 2),
+        "requests": total,
+        "ok": ok,
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+        "ok_rps": round(ok / elapsed, 2) if elapsed else 0.0,
+        "outcomes": dict(sorted(stats.outcomes.items())),
+        "latency_ms": {
+            f"p{p}": round(percentile(latencies, p) * 1000, 1) for p in (50, 90, 95, 99)
+        },
+    }
+    report["latency_ms"]["max"] = round(latencies[-1] * 1000, 1) if latencies else 0.0
+    if stats.first_token:
+        first = sorted(stats.first_token)
+        report["first_token_ms"] = {f"p{p}": round(percentile(first, p) * 1000, 1) for p in (50, 90, 99)}
+    if samples:
+        report["in_flight"] = {"max": max(samples), "mean": round(sum(samples) / len(samples), 2),
+                               "samples": len(samples)}
+        if args.server_threads:
+            # 采样请求本身占用一个线程：其余线程全部在处理请求时，新请求只能排队
+            saturated = sum(1 for s in samples if s + 1 >= args.server_threads)
+            report["in_flight"]["saturated_pct"] = round(saturated / len(samples) * 100, 1)
+    return report
+
+
+def print_report(report):
+    print(f"\n📈 {report['sessions']} 个会话，{report['elapsed_s']}s 内共 {report['requests']} 次请求，"
+          f"成功 {report['ok']} 次")
+    print(f"吞吐：{report['throughput_rps']} req/s（成功 {report['ok_rps']} req/s）")
+    print("结果：" + "，".join(f"{k} {v}" for k, v in report["outcomes"].items()))
+    print("延迟(ms)：" + "  ".join(f"{k} {v}" for k, v in report["latency_ms"].items()))
+    if "first_token_ms" in report:
+        print("首 token(ms)：" + "  ".join(f"{k} {v}" for k, v in report["first_token_ms"].items()))
+    if "in_flight" in report:
+        in_flight = report["in_flight"]
+        line = f"处理中的请求数：最大 {in_flight['max']:g}，平均 {in_flight['mean']}"
+        if "saturated_pct" in in_flight:
+            line += f"，{in_flight['saturated_pct']}% 的采样时刻线程已占满"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI Finance 聊天接口压测")
+    parser.add_argument("--base", default="http://127.0.0.1:5000", help="后端地址")
+    parser.add_argument("--sessions", type=int, default=16, help="并发会话数（每个会话一个独立用户）")
+    parser.add_argument("--duration", type=float, default=30.0, help="压测时长（秒）")
+    parser.add_argument("--requests", type=int, default=0, help="每个会话最多发送的请求数，0 表示不限")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="在这段时间内（秒）逐个启动会话")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="每个会话两次请求之间的间隔（毫秒）")
+    parser.add_argument("--stream", action="store_true", help="改为请求 /api/chat/stream，并统计首 token 延迟")
+    parser.add_argument("--llm-url", help="让后端调用的 LLM 地址（如 mockllm.py），经请求体 llm.url 传递")
+    parser.add_argument("--messages", metavar="FILE", help="消息文件，每行一条；默认使用内置组合")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单个请求的超时（秒）")
+    parser.add_argument("--server-threads", type=int, help="后端的线程数，用于计算线程饱和度")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="读取 /metrics 的间隔（秒）")
+    parser.add_argument("--json", metavar="FILE", help="把结果另存为 JSON")
+    args = parser.parse_args()
+
+    if args.messages:
+        with open(args.messages, encoding="utf-8") as f:
+            args.messages = [line.strip() for line in f if line.strip()]
+    else:
+        args.messages = DEFAULT_MESSAGES
+
+    stats, samples, stop = Stats(), [], threading.Event()
+    run_id = uuid.uuid4().hex[:8]
+    sampler = threading.Thread(target=sample_in_flight, args=(args.base, args.sample_interval, stop, samples),
+                               daemon=True)
+    now = time.monotonic()
+    deadline = now + args.ramp_up + args.duration
+    step = args.ramp_up / args.sessions if args.sessions else 0
+    threads = [
+        threading.Thread(target=run_session, args=(i, args, stats, deadline, now + i * step, run_id), daemon=True)
+        for i in range(args.sessions)
+    ]
+    print(f"🚀 {args.sessions} 个会话开始压测 {args.base}（{'流式' if args.stream else '非流式'}）")
+    started = time.perf_counter()
+    sampler.start()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+
+    report = summarize(args, stats, samples, elapsed)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""进程内指标：计数器 / 仪表 / 直方图，并以 Prometheus 文本格式输出。"""
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+
+# 默认的延迟分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_value(self, key, state):
+        counts, total, count = state
+        lines = []
+        for bound, n in zip(self.buckets, counts):
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} {n}")
+        lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+def render():
+    """Render every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ===== 指标定义 =====
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP 请求耗时（到响应头返回为止）", ("route", "method", "status"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "正在处理的 HTTP 请求数")
+CHAT_STAGE_SECONDS = Histogram(
+    "chat_stage_duration_seconds", "/api/chat 各阶段耗时", ("stage", "intent"))
+CHAT_REQUESTS = Counter("chat_requests_total", "按意图统计的聊天请求数", ("intent",))
+LLM_REQUEST_SECONDS = Histogram(
+    "llm_request_duration_seconds", "LLM 调用往返耗时", ("call", "outcome"))
+LLM_FIRST_TOKEN_SECONDS = Histogram(
+    "llm_first_token_seconds", "流式 LLM 调用的首 token 延迟", ("call",))
+LLM_TOKENS = Counter("llm_tokens_total", "LLM 消耗的 token 数", ("call", "type"))
+
+
+def record_llm_call(call, seconds, data=None, outcome="ok"):
+    """Record one LLM round trip and the token usage reported by the provider."""
+    LLM_REQUEST_SECONDS.observe(seconds, call=call, outcome=outcome)
+    usage = (data or {}).get("usage") if isinstance(data, dict) else None
+    if usage:
+        LLM_TOKENS.inc(usage.get("prompt_tokens", 0), call=call, type="prompt")
+        LLM_TOKENS.inc(usage.get("completion_tokens", 0), call=call, type="completion")
+
+
+class StageTimer:
+    """Accumulate per-stage durations of one chat request, labelled by intent at the end."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0.0) + time.perf_counter() - started
+
+    def finish(self, intent):
+        self.durations["total"] = time.perf_counter() - self.started
+        intent = intent or "unknown"
+        CHAT_REQUESTS.inc(intent=intent)
+        for name, seconds in self.durations.items():
+            CHAT_STAGE_SECONDS.observe(seconds, stage=name, intent=intent)
+        return {name: round(seconds * 1000, 1) for name, seconds in self.durations.items()}
+
+
+def init_app(app):
+    """Register request hooks that feed the HTTP metrics."""
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+
+    @app.after_request
+    def _observe_request(response):
+        started = g.pop("_metrics_started", None)
+        if started is not None:
+            if response.is_streamed:
+                # ⚠️ 流式响应（SSE、导出）在 after_request 之后才开始发送，线程直到发送完才空闲
+                response.call_on_close(HTTP_IN_FLIGHT.dec)
+            else:
+                HTTP_IN_FLIGHT.dec()
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                route=route, method=request.method, status=response.status_code,
+            )
+        return response
+
+    @app.teardown_request
+    def _release_in_flight(exc=None):
+        # 视图抛出异常时 after_request 不会执行，这里补上
+        if g.pop("_metrics_started", None) is not None:
+            HTTP_IN_FLIGHT.dec()
@@ -0,0 +1,310 @@
+"""本地的 OpenAI 兼容 LLM 替身，用于在不花钱、不联网的情况下压测聊天链路。
+
+    python mockllm.py --port 8001 --latency lognormal:400,0.5 --latency intent=fixed:150 --error-rate 0.02
+    LLM_URL=http://127.0.0.1:8001/v1/chat/completions python serve.py
+
+实现 POST /v1/chat/completions（含 stream: true）。按 prompt 识别调用类型
+（intent / summary / chat / budget_advice），意图调用用本地规则解析用户消息后返回
+「意图：…」格式的固定输出。--record 把上游真实响应按请求内容保存下来，--replay 按同样的
+键回放，未命中的请求再转发上游（同时指定 --upstream 时）或返回固定输出。
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+
+from flask import Flask, Response, jsonify, request
+
+CALL_TYPES = ("intent", "summary", "chat", "budget_advice")
+
+# 各类调用的固定回复（intent 由规则解析生成）
+CANNED_REPLIES = {
+    "summary": "📌 已为你完成操作。建议继续保持记账习惯，合理安排本月支出 👍",
+    "chat": "你好！记得随手记账哦～",
+    "budget_advice": "餐饮：1500\n交通：500\n购物：800\n其他：300",
+}
+
+_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def parse_latency(spec):
+    """Parse a latency spec into a sampler returning seconds.
+
+    ``fixed:MS``, ``uniform:LO,HI``, ``normal:MEAN,SD`` or
+    ``lognormal:MEDIAN,SIGMA`` (milliseconds; sigma is unitless).
+    """
+    kind, _, args = spec.partition(":")
+    try:
+        values = [float(v) for v in args.split(",")] if args else []
+        if kind == "fixed" and len(values) == 1:
+            return lambda rng: values[0] / 1000
+        if kind == "uniform" and len(values) == 2:
+            return lambda rng: rng.uniform(*values) / 1000
+        if kind == "normal" and len(values) == 2:
+            return lambda rng: max(0.0, rng.gauss(*values)) / 1000
+        if kind == "lognormal" and len(values) == 2:
+            median, sigma = values
+            return lambda rng: median * rng.lognormvariate(0, sigma) / 1000
+    except ValueError:
+        pass
+    raise ValueError(f"无法识别的延迟分布：{spec}")
+
+
+def classify(messages):
+    """Tell which of the app's prompts this is from its system message."""
+    system = " ".join(m.get("content", "") for m in messages if m.get("role") == "system")
+    if "意图" in system:
+        return "intent"
+    if "财务顾问" in system:
+        return "summary"
+    if "记账助手" in system:
+        return "chat"
+    return "budget_advice"
+
+
+def request_key(payload):
+    """Replay key of a request: model + messages, with dates in system prompts masked.
+
+    The intent prompt embeds today's date, so without masking a recording
+    would only replay on the day it was made.
+    """
+    messages = [
+        {"role": m.get("role"), "content": _DATE_RE.sub("<date>", m.get("content", "")) if m.get("role") == "system"
+         else m.get("content", "")}
+        for m in payload.get("messages") or []
+    ]
+    raw = json.dumps({"model": payload.get("model"), "messages": messages}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def canned_intent(message):
+    """Intent output in the app's format, produced by the local rule parser."""
+    from intent import parse_local
+
+    parsed = parse_local(message)
+    if not parsed:
+        return "意图：chat\n参数："
+    intent, params, _ = parsed
+    return "\n".join([f"意图：{intent}", "参数："] + [f"{k}：{v}" for k, v in params.items()])
+
+
+class MockLLM:
+    """Settings, recordings and the random source shared by all request threads."""
+
+    def __init__(self, latency, token_interval=0.02, error_rate=0.0, error_statuses=(500,),
+                 hang_rate=0.0, hang_seconds=30.0, seed=None, replay=None, record=None,
+                 upstream=None, upstream_key=None, strict=False):
+        self.latency = latency  # 调用类型 -> 采样函数，"default" 为缺省
+        self.token_interval = token_interval
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.upstream = upstream
+        self.upstream_key = upstream_key
+        self.strict = strict
+        self.record_path = record
+        self.recordings = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {}
+        if replay:
+            with open(replay, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.recordings[entry["key"]] = entry["content"]
+            print(f"📼 已加载 {len(self.recordings)} 条录制响应：{replay}")
+
+    def draw(self, call):
+        """Sample ``(latency seconds, outcome)`` for one call; outcome is ``ok``, ``hang`` or a status."""
+        with self._lock:
+            delay = self.latency.get(call, self.latency["default"])(self._rng)
+            roll = self._rng.random()
+            if roll < self.hang_rate:
+                return delay, "hang"
+            if roll < self.hang_rate + self.error_rate:
+                return delay, self._rng.choice(self.error_statuses)
+            return delay, "ok"
+
+    def count(self, call, outcome):
+        with self._lock:
+            key = f"{call}:{outcome}"
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(sorted(self.counts.items()))
+
+    def content_for(self, payload, call, auth):
+        """Reply text: recording, then upstream (recorded), then canned output."""
+        key = request_key(payload)
+        with self._lock:
+            content = self.recordings.get(key)
+        if content is not None:
+            return content, "replay"
+        if self.upstream:
+            content = self.fetch_upstream(payload, auth)
+            self.save(key, call, payload, content)
+            return content, "upstream"
+        if self.strict:
+            return None, "miss"
+        if call == "intent":
+            user = [m.get("content", "") for m in payload.get("messages") or [] if m.get("role") == "user"]
+            return canned_intent(user[-1] if user else ""), "canned"
+        return CANNED_REPLIES[call], "canned"
+
+    def fetch_upstream(self, payload, auth):
+        import requests
+        from llm import completion_text
+
+        headers = {"Authorization": f"Bearer {self.upstream_key}" if self.upstream_key else auth,
+                   "Content-Type": "application/json"}
+        # 上游一律用非流式请求，录下完整文本，回放时再按需切成流
+        body = {k: v for k, v in payload.items() if k != "stream"}
+        res = requests.post(self.upstream, headers=headers, json=body, timeout=120)
+        res.raise_for_status()
+        return completion_text(res.json())
+
+    def save(self, key, call, payload, content):
+        with self._lock:
+            self.recordings[key] = content
+            if self.record_path:
+                with open(self.record_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"key": key, "call": call, "model": payload.get("model"),
+                                        "messages": payload.get("messages"), "content": content},
+                                       ensure_ascii=False) + "\n")
+
+
+def _usage(payload, content):
+    from features import estimate_tokens
+
+    prompt = sum(estimate_tokens(m.get("content", "")) for m in payload.get("messages") or [])
+    completion = estimate_tokens(content)
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+def _error(status, message):
+    return jsonify({"error": {"message": message, "type": "mock_error", "code": status}}), status
+
+
+def create_app(mock):
+    app = Flask(__name__)
+
+    @app.route("/v1/chat/completions", methods=["POST"])
+    @app.route("/chat/completions", methods=["POST"])
+    def completions():
+        payload = request.get_json(silent=True) or {}
+        if not payload.get("messages"):
+            return _error(400, "messages 不能为空")
+        call = classify(payload["messages"])
+        delay, outcome = mock.draw(call)
+        time.sleep(delay)
+        if outcome == "hang":
+            mock.count(call, "hang")
+            time.sleep(mock.hang_seconds)
+            return _error(504, "mock: upstream timeout")
+        if outcome != "ok":
+            mock.count(call, outcome)
+            return _error(outcome, f"mock: injected {outcome}")
+
+        try:
+            content, source = mock.content_for(payload, call, request.headers.get("Authorization", ""))
+        except Exception as e:
+            mock.count(call, "upstream_error")
+            return _error(502, f"mock: 上游请求失败：{e}")
+        mock.count(call, source)
+        if content is None:
+            return _error(404, "mock: 没有对应的录制响应")
+
+        model = payload.get("model") or "mock"
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        usage = _usage(payload, content)
+        if not payload.get("stream"):
+            return jsonify({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        def chunk(delta, finish=None, **extra):
+            return "data: " + json.dumps({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}], **extra,
+            }, ensure_ascii=False) + "\n\n"
+
+        def generate():
+            # 首个分片在采样的延迟之后立即发出，此后每 token_interval 秒一个分片（约 4 个字符）
+            yield chunk({"role": "assistant", "content": ""})
+            for i in range(0, len(content), 4):
+                if i:
+                    time.sleep(mock.token_interval)
+                yield chunk({"content": content[i:i + 4]})
+            yield chunk({}, "stop", usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return Response(generate(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    @app.route("/mock/stats")
+    def stats():
+        # 按「调用类型:结果」统计的请求数，压测后可与 loadtest.py 的结果对照
+        return jsonify(mock.snapshot())
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容的 LLM 替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--threads", type=int, default=256, help="waitress 线程数，应不少于压测并发数")
+    parser.add_argument("--latency", action="append", default=[], metavar="[CALL=]SPEC",
+                        help="延迟分布，如 lognormal:400,0.5；加 intent= 等前缀只作用于该类调用，可重复")
+    parser.add_argument("--token-ms", type=float, default=20.0, help="流式响应中相邻分片的间隔（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回错误状态码的概率")
+    parser.add_argument("--error-status", default="500,503,429", help="注入的错误状态码，逗号分隔")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="挂起不响应（模拟超时）的概率")
+    parser.add_argument("--hang-seconds", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, help="随机种子，指定后延迟与错误序列可复现")
+    parser.add_argument("--replay", metavar="FILE", help="从录制文件回放响应")
+    parser.add_argument("--record", metavar="FILE", help="把上游响应追加写入录制文件（需要 --upstream）")
+    parser.add_argument("--upstream", help="真实的 chat/completions 地址，用于录制")
+    parser.add_argument("--upstream-key", default=os.getenv("DEEPSEEK_API_KEY"),
+                        help="上游 API Key，默认取 DEEPSEEK_API_KEY，未设置时透传请求里的 Authorization")
+    parser.add_argument("--strict", action="store_true", help="回放未命中且没有上游时返回 404，而不是固定输出")
+    args = parser.parse_args()
+
+    if args.record and not args.upstream:
+        parser.error("--record 需要同时指定 --upstream")
+    latency = {"default": parse_latency("lognormal:400,0.5")}
+    for item in args.latency:
+        call, sep, spec = item.partition("=")
+        if sep and call not in CALL_TYPES:
+            parser.error(f"未知的调用类型：{call}（可选 {', '.join(CALL_TYPES)}）")
+        try:
+            latency[call if sep else "default"] = parse_latency(spec if sep else item)
+        except ValueError as e:
+            parser.error(str(e))
+
+    mock = MockLLM(
+        latency, token_interval=args.token_ms / 1000, error_rate=args.error_rate,
+        error_statuses=[int(s) for s in args.error_status.split(",") if s.strip()],
+        hang_rate=args.hang_rate, hang_seconds=args.hang_seconds, seed=args.seed,
+        replay=args.replay, record=args.record, upstream=args.upstream,
+        upstream_key=args.upstream_key, strict=args.strict,
+    )
+
+    from waitress import serve
+
+    print(f"🤖 Mock LLM 监听 http://{args.host}:{args.port}/v1/chat/completions")
+    serve(create_app(mock), host=args.host, port=args.port, threads=args.threads, send_bytes=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""多进程部署：主进程预先绑定端口，再 fork 出 N 个 waitress worker 共享同一个监听 socket。
+
+    python serve.py --workers 4 --threads 8 --port 5000
+
+worker 数大于 1 时默认使用 STATE_BACKEND=sqlite，让会话历史与意图缓存在
+进程间共享。依赖 os.fork，仅支持 Linux / macOS；Windows 下请使用
+``uvicorn asgi:app --workers N``。
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+
+
+def run_worker(sock, threads):
+    # 在子进程中才导入应用，避免 fork 前创建的线程、连接被复制
+    from waitress import serve
+    from app import app
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    serve(app, sockets=[sock], threads=threads, send_bytes=1)
+
+
+def spawn(sock, threads):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(sock, threads)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以多进程方式运行 AI Finance 后端")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=8, help="每个 worker 的线程数")
+    parser.add_argument("--backlog", type=int, default=1024)
+    args = parser.parse_args()
+
+    # 先读 .env，再补默认值，.env 里的设置才会生效
+    from dotenv import load_dotenv
+    load_dotenv()
+    if args.workers > 1:
+        os.environ.setdefault("STATE_BACKEND", "sqlite")
+
+    from db import init_db
+    from state import STATE_BACKEND, init_state_db, load_secret_key
+
+    # ✅ 建表 / 迁移、签名密钥只在主进程里做一次，worker 启动时直接复用
+    init_db()
+    os.environ["SECRET_KEY"] = load_secret_key()
+    if STATE_BACKEND == "sqlite":
+        init_state_db()
+
+    sock = socket.create_server((args.host, args.port), backlog=args.backlog)
+    if args.workers == 1 or not hasattr(os, "fork"):
+        run_worker(sock, args.threads)
+        return
+
+    workers = {spawn(sock, args.threads) for _ in range(args.workers)}
+    print(f"🚀 已启动 {len(workers)} 个 worker，监听 {args.host}:{args.port}")
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        workers.discard(pid)
+        if not stopping:
+            # worker 意外退出时补一个新的
+            print(f"⚠️ worker {pid} 退出（状态 {status}），正在重启")
+            time.sleep(1)
+            workers.add(spawn(sock, args.threads))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""多进程共享状态：持久化的会话签名密钥，以及存放对话历史 / 缓存的 SQLite 库。
+
+STATE_BACKEND=memory（默认）时对话历史与缓存留在进程内；多进程部署时设为
+sqlite，各 worker 通过同一个 STATE_DB_FILE 共享。
+"""
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+from db import DB_FILE, connect
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+# 与账本库分开，避免高频的缓存写入和记账写入争抢同一把写锁
+STATE_DB_FILE = os.getenv("STATE_DB_FILE", os.path.join(os.path.dirname(DB_FILE) or ".", "state.db"))
+SECRET_KEY_FILE = os.getenv("SECRET_KEY_FILE", os.path.join(os.path.dirname(DB_FILE) or ".", "secret.key"))
+
+_local = threading.local()
+
+
+def load_secret_key(path=SECRET_KEY_FILE):
+    """Return ``SECRET_KEY`` from the environment, or the key persisted in ``path``.
+
+    The first process to get here creates the file with ``O_EXCL``; every
+    other worker reads the same key, so sessions stay valid whichever
+    worker serves the request.
+    """
+    key = os.getenv("SECRET_KEY")
+    if key:
+        return key
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # 另一个进程可能刚创建文件还没写完，稍等重读
+        for _ in range(50):
+            with open(path, encoding="utf-8") as f:
+                key = f.read().strip()
+            if key:
+                return key
+            time.sleep(0.1)
+        raise RuntimeError(f"签名密钥文件 {path} 为空，请删除后重启或设置 SECRET_KEY")
+    key = secrets.token_hex(32)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(key)
+    print("🔑 已生成会话签名密钥：", path)
+    return key
+
+
+def get_state_db():
+    """Per-thread connection to the shared state database."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = connect(path=STATE_DB_FILE)
+        conn.isolation_level = None  # 事务由调用方显式 BEGIN IMMEDIATE
+    return conn
+
+
+def init_state_db():
+    conn = connect(path=STATE_DB_FILE)
+    try:
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS conversation_users (
+                user_id INTEGER PRIMARY KEY,
+                summary TEXT NOT NULL DEFAULT '',
+                chars INTEGER NOT NULL DEFAULT 0,
+                last_active REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS conversation_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_conversation_messages_user
+                ON conversation_messages(user_id, id);
+            CREATE INDEX IF NOT EXISTS idx_conversation_users_active
+                ON conversation_users(last_active);
+
+            CREATE TABLE IF NOT EXISTS intent_cache (
+                key TEXT PRIMARY KEY,
+                intent TEXT NOT NULL,
+                params TEXT NOT NULL,
+                expires REAL NOT NULL,
+                used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_intent_cache_used ON intent_cache(used);
+        """)
+    finally:
+        conn.close()
+
+
+@contextmanager
+def transaction():
+    """BEGIN IMMEDIATE on the state DB; commit on success, roll back on error."""
+    conn = get_state_db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
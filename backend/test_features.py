@@ -0,0 +1,36 @@
+"""features.py 的窗口与统计：固定“今天”为月中，确认未过完的当月不参与统计。
+
+    python -m pytest backend/test_features.py
+"""
+import sqlite3
+from datetime import date
+
+from features import window_months, spend_features
+
+TODAY = date(2025, 6, 16)
+
+
+def make_db(totals):
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute("CREATE TABLE categories (id INTEGER PRIMARY KEY, user_id INTEGER, name TEXT, type TEXT)")
+    conn.execute("CREATE TABLE monthly_totals (user_id INTEGER, kind TEXT, month TEXT, category_id INTEGER, total INTEGER)")
+    conn.execute("INSERT INTO categories VALUES (1, 1, '餐饮', '支出')")
+    conn.executemany("INSERT INTO monthly_totals VALUES (1, '支出', ?, 1, ?)", totals.items())
+    return conn
+
+
+def test_window_ends_at_last_complete_month():
+    assert window_months(3, TODAY) == ["2025-03", "2025-04", "2025-05"]
+    assert window_months(2, date(2025, 1, 31)) == ["2024-11", "2024-12"]
+
+
+def test_partial_month_does_not_drag_statistics_down():
+    # 每个完整月都是 1000 元；当月过了一半只花了 300 元
+    totals = {m: 100000 for m in ("2025-01", "2025-02", "2025-03", "2025-04", "2025-05")}
+    totals["2025-06"] = 30000
+    labels, features = spend_features(make_db(totals), 1, months=5, today=TODAY)
+    assert labels[-1] == "2025-05"
+    (f,) = features
+    assert f["mean"] == f["median"] == f["last"] == 1000.0
+    assert f["trend"] == 0.0
@@ -11,7 +11,15 @@ if (-Not (Test-Path 'venv')) {
 pip install --upgrade pip
 pip install -r requirements.txt
 $env:FLASK_APP = 'app.py'
-$backendProc = Start-Process 'waitress-serve' '--host=0.0.0.0 --thread=4 --port=5000 app:app' -NoNewWindow -PassThru
+# WORKERS>1 时以多进程运行（Windows 上仅异步模式支持），会话历史与缓存改存到共享的 SQLite
+$workers = if ($env:WORKERS) { [int]$env:WORKERS } else { 1 }
+if ($workers -gt 1 -and -not $env:STATE_BACKEND) { $env:STATE_BACKEND = 'sqlite' }
+if ($env:ASYNC_CHAT -eq '1') {
+    # 异步模式：聊天接口在事件循环中等待 LLM，其余路由仍由 Flask 处理
+    $backendProc = Start-Process 'uvicorn' "asgi:app --host 0.0.0.0 --port 5000 --workers $workers" -NoNewWindow -PassThru
+} else {
+    $backendProc = Start-Process 'waitress-serve' '--host=0.0.0.0 --thread=4 --port=5000 --send-bytes=1 app:app' -NoNewWindow -PassThru
+}
 deactivate
 Pop-Location
 
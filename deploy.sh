@@ -11,7 +11,20 @@ source venv/bin/activate
 pip install --upgrade pip
 pip install -r requirements.txt
 export FLASK_APP=app.py
-waitress-serve --host=0.0.0.0 --port=5000 app:app &
+# WORKERS>1 时以多进程运行，会话历史与缓存改存到共享的 SQLite（state.db）
+WORKERS=${WORKERS:-1}
+if [ "$WORKERS" -gt 1 ]; then
+  export STATE_BACKEND=${STATE_BACKEND:-sqlite}
+fi
+if [ "${ASYNC_CHAT:-0}" = "1" ]; then
+  # 异步模式：聊天接口在事件循环中等待 LLM，其余路由仍由 Flask 处理
+  uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers "$WORKERS" &
+elif [ "$WORKERS" -gt 1 ]; then
+  python serve.py --host 0.0.0.0 --port 5000 --workers "$WORKERS" &
+else
+  # --send-bytes=1：让 /api/chat/stream 的每个 SSE 事件立即发出，而不是攒满 18KB
+  waitress-serve --host=0.0.0.0 --port=5000 --send-bytes=1 app:app &
+fi
 BACKEND_PID=$!
 deactivate
 popd >/dev/null